@@ -0,0 +1,126 @@
+"""Benchmark the encoding of set_configuration() payloads.
+
+Compare the compiled command encoders (payload bytes joined from JSON
+rendered in advance) with the previous implementation (configuration dict
+built by _parse_command_args, then json.dumps of the whole message).
+
+Run from the repository root::
+
+    python -m benchmarks.command_encoder [commands counts...]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+from libpurecool.const import FanSpeed, NightMode
+from libpurecool.dyson_pure_cool import DysonPureCool
+from libpurecool.dyson_pure_cool_link import DysonPureCoolLink
+from libpurecool.dyson_pure_state import DysonPureCoolState
+from libpurecool.dyson_pure_state_v2 import DysonPureCoolV2State
+
+COUNTS = [1000, 50000]
+KWARGS = {"fan_speed": FanSpeed.FAN_SPEED_4,
+          "night_mode": NightMode.NIGHT_MODE_ON}
+
+
+def _value(kwargs, argument, default):
+    """Return an enumeration argument value, else the default value."""
+    value = kwargs.get(argument)
+    return value.value if value else default
+
+
+def _link_data(kwargs, state):
+    """Build a Pure Cool Link configuration as _parse_command_args did."""
+    sleep_timer = kwargs.get('sleep_timer')
+    return {
+        "fmod": _value(kwargs, 'fan_mode', state.fan_mode),
+        "fnsp": _value(kwargs, 'fan_speed', state.speed),
+        "oson": _value(kwargs, 'oscillation', state.oscillation),
+        "sltm": sleep_timer if sleep_timer or isinstance(
+            sleep_timer, int) else "STET",
+        "rhtm": _value(kwargs, 'standby_monitoring',
+                       state.standby_monitoring),
+        "rstf": _value(kwargs, 'reset_filter', "STET"),
+        "qtar": _value(kwargs, 'quality_target', state.quality_target),
+        "nmod": _value(kwargs, 'night_mode', state.night_mode)
+    }
+
+
+def _pure_cool_data(kwargs, state):
+    """Build a Pure Cool configuration as _parse_command_args did."""
+    sleep_timer = kwargs.get('sleep_timer')
+    angle_low = kwargs.get('oscillation_angle_low')
+    angle_high = kwargs.get('oscillation_angle_high')
+    return {
+        "fpwr": _value(kwargs, 'fan_power', state.fan_power),
+        "fdir": _value(kwargs, 'front_direction', state.front_direction),
+        "auto": _value(kwargs, 'auto_mode', state.auto_mode),
+        "oson": _value(kwargs, 'oscillation', state.oscillation),
+        "nmod": _value(kwargs, 'night_mode', state.night_mode),
+        "rhtm": _value(kwargs, 'continuous_monitoring',
+                       state.continuous_monitoring),
+        "fnsp": _value(kwargs, 'fan_speed', state.speed),
+        "sltm": str(sleep_timer) if sleep_timer or isinstance(
+            sleep_timer, int) else "STET",
+        "ancp": "CUST",
+        "osal": str(angle_low) if angle_low else state.oscillation_angle_low,
+        "osau": str(angle_high) if angle_high
+                else state.oscillation_angle_high,
+        "rstf": _value(kwargs, 'reset_filter', "STET"),
+    }
+
+
+MODELS = [(DysonPureCoolLink, DysonPureCoolState, "state.json", _link_data),
+          (DysonPureCool, DysonPureCoolV2State, "state_pure_cool.json",
+           _pure_cool_data)]
+
+
+def _json_payload(parse, state):
+    """Encode a configuration as done before compiled encoders."""
+    return json.dumps({
+        "msg": "STATE-SET",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "mode-reason": "LAPP",
+        "data": parse(KWARGS, state)
+    })
+
+
+def _measure(function, count):
+    """Return the time per call (us) and the peak allocation of one call."""
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    elapsed_us = (time.perf_counter() - start) / count * 1e6
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed_us, peak
+
+
+def main(counts=None):
+    """Run the measures and print the results."""
+    print("{0:>18} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+        "model", "count", "json (us)", "json (B)", "enc. (us)", "enc. (B)"))
+    for device_class, state_class, fixture, parse in MODELS:
+        with open("tests/data/" + fixture, "r",
+                  encoding="utf-8") as state_file:
+            state = state_class(state_file.read())
+        # pylint: disable=protected-access
+        encoder = device_class._COMMAND_ENCODER
+        payload = encoder.encode(KWARGS, state)[0]
+        assert json.loads(payload)["data"] == json.loads(
+            _json_payload(parse, state))["data"]
+        for count in counts or COUNTS:
+            old = _measure(partial(_json_payload, parse, state), count)
+            new = _measure(partial(encoder.encode, KWARGS, state), count)
+            print("{0:>18} {1:>8} {2:>10.2f} {3:>10} {4:>10.2f} {5:>10}"
+                  .format(device_class.__name__, count, old[0], old[1],
+                          new[0], new[1]))
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]])
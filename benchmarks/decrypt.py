@@ -0,0 +1,55 @@
+"""Benchmark the decryption of device credentials.
+
+Compare decrypt_passwords() (one ECB cipher set up for the batch, CBC
+chaining applied with XOR, invalid credentials isolated per password) with
+the previous implementation (one CBC cipher per password, unpadding and
+reading JSON from a decoded str, raising on the first invalid password).
+
+Run from the repository root::
+
+    python -m benchmarks.decrypt [credentials counts...]
+"""
+
+import base64
+import json
+import sys
+import time
+
+from Crypto.Cipher import AES
+
+from libpurecool.utils import decrypt_passwords, unpad, _KEY, _INIT_VECTOR
+
+COUNTS = [100, 5000]
+CREDENTIALS = ["1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1Ke1i0ZHakFH84DZ"
+               "uxsSQ4KTT2vbCm7uYeTORULKLKQ==",
+               "1/aJ5t52WvAfn+z+fjDuebkH6aWl2H5Q1vCqCQSjJfENzMefozxWaDoW1yD"
+               "luPsi09SGT5nWMxqxtrfkxnUtRQ=="]
+
+
+def _decrypt_one(encrypted_password):
+    """Decrypt a password as done before decrypt_passwords()."""
+    cipher = AES.new(_KEY, AES.MODE_CBC, _INIT_VECTOR)
+    json_password = json.loads(unpad(
+        cipher.decrypt(base64.b64decode(encrypted_password)).decode('utf-8')))
+    return json_password["apPasswordHash"]
+
+
+def main(counts=None):
+    """Run the measures and print the results."""
+    print("{0:>8} {1:>12} {2:>12}".format("count", "single (us)",
+                                          "current (us)"))
+    for count in counts or COUNTS:
+        credentials = [CREDENTIALS[index % 2] for index in range(count)]
+        start = time.perf_counter()
+        single = [_decrypt_one(password) for password in credentials]
+        single_us = (time.perf_counter() - start) / count * 1e6
+        start = time.perf_counter()
+        current = decrypt_passwords(credentials)
+        current_us = (time.perf_counter() - start) / count * 1e6
+        assert single == current
+        print("{0:>8} {1:>12.2f} {2:>12.2f}".format(count, single_us,
+                                                    current_us))
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]])
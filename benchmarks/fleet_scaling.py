@@ -0,0 +1,133 @@
+"""Benchmark thread count, memory and message latency of many devices.
+
+Compare devices connected with their own connect() method (one paho
+network thread and one sensor thread per device) with devices connected
+by a DysonFleet. Devices are simulated by the in-process MQTT broker used
+by the tests. Each measure runs in its own process.
+
+Run from the repository root::
+
+    python -m benchmarks.fleet_scaling [device counts...]
+"""
+
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from queue import Empty
+
+from libpurecool.const import DYSON_PURE_COOL
+from libpurecool.dyson_fleet import DysonFleet
+from libpurecool.dyson_pure_cool import DysonPureCool
+from tests.mqtt_broker import MqttBroker, DeviceStandIn
+from tests.test_dyson_async import _device_json, _load
+
+DEVICE_COUNTS = [10, 100, 1000]
+MODES = ["threads", "fleet"]
+LATENCY_ROUNDS = 5
+
+
+def _rss_kb():
+    """Return the resident memory of the process in kB."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(mode, count):
+    """Connect count devices and return the measures."""
+    broker = MqttBroker().start()
+    devices = []
+    for index in range(count):
+        serial = "device-{0}".format(index)
+        broker.add_device(DeviceStandIn(
+            DYSON_PURE_COOL, serial, "password1",
+            _load("state_pure_cool.json"), _load("sensor_pure_cool.json")))
+        devices.append(DysonPureCool(_device_json(serial, DYSON_PURE_COOL)))
+    threads = threading.active_count()
+    rss = _rss_kb()
+
+    fleet = DysonFleet() if mode == "fleet" else None
+    start = time.monotonic()
+    connected = []
+    for device in devices:
+        try:
+            if fleet:
+                result = fleet.connect(device, "127.0.0.1", broker.port)
+            else:
+                result = device.connect("127.0.0.1", broker.port)
+        except Empty:
+            result = False
+        if not result:
+            # Do not wait for the timeout of every remaining device
+            break
+        connected.append(device)
+    connect_time = time.monotonic() - start
+    devices = connected
+    count = len(devices)
+
+    received = {}
+    done = threading.Event()
+
+    def listener(device):
+        def on_message(msg):
+            received[device.serial] = time.monotonic()
+            if len(received) == count:
+                done.set()
+        return on_message
+
+    for device in devices:
+        device.add_message_listener(listener(device))
+    message = json.dumps(_load("state_pure_cool.json"))
+    latencies = []
+    for _ in range(LATENCY_ROUNDS):
+        received.clear()
+        done.clear()
+        sent = time.monotonic()
+        for device in devices:
+            broker.publish(device.status_topic, message)
+        done.wait(30)
+        latencies.extend(arrival - sent for arrival in received.values())
+    latencies = latencies or [0]
+
+    return {
+        "connected": count,
+        "threads": threading.active_count() - threads,
+        "rss_kb": _rss_kb() - rss,
+        "connect_s": connect_time,
+        "latency_median_ms": statistics.median(latencies) * 1000,
+        "latency_max_ms": max(latencies) * 1000
+    }
+
+
+def main(counts=None):
+    """Run every measure in a subprocess and print the results."""
+    print("{0:>7} {1:>8} {2:>9} {3:>8} {4:>10} {5:>10} {6:>12} "
+          "{7:>12}".format("devices", "mode", "connected", "threads",
+                           "rss (kB)", "connect", "median (ms)", "max (ms)"))
+    for count in counts or DEVICE_COUNTS:
+        for mode in MODES:
+            output = subprocess.check_output(
+                [sys.executable, "-m", "benchmarks.fleet_scaling", "--run",
+                 mode, str(count)])
+            result = json.loads(output.decode("utf-8").splitlines()[-1])
+            print("{0:>7} {1:>8} {connected:>9} {threads:>8} {rss_kb:>10} "
+                  "{connect_s:>9.2f}s {latency_median_ms:>12.1f} "
+                  "{latency_max_ms:>12.1f}".format(count, mode, **result))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--run"]:
+        print(json.dumps(_measure(sys.argv[2], int(sys.argv[3]))))
+        sys.stdout.flush()
+        # Sensor threads of connected devices are not daemon threads
+        os._exit(0)  # pylint: disable=protected-access
+    else:
+        main([int(count) for count in sys.argv[1:]])
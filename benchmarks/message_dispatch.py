@@ -0,0 +1,147 @@
+"""Benchmark MQTT message dispatch throughput.
+
+Run from the repository root::
+
+    python -m benchmarks.message_dispatch
+"""
+
+import timeit
+
+from libpurecool.const import DYSON_PURE_COOL_LINK_DESK, \
+    DYSON_PURE_HOT_COOL_LINK_TOUR, DYSON_PURE_COOL, DYSON_PURE_HOT_COOL, \
+    DYSON_360_EYE
+from libpurecool.dyson_360_eye import Dyson360Eye, Dyson360EyeState, \
+    Dyson360EyeMapGlobal, Dyson360EyeTelemetryData, Dyson360EyeMapGrid, \
+    Dyson360EyeMapData, Dyson360Goodbye
+from libpurecool.dyson_pure_cool_link import DysonPureCoolLink
+from libpurecool.dyson_pure_state import DysonPureCoolState, \
+    DysonPureHotCoolState, DysonEnvironmentalSensorState
+from libpurecool.dyson_pure_state_v2 import DysonPureCoolV2State, \
+    DysonPureHotCoolV2State, DysonEnvironmentalSensorV2State
+from libpurecool.utils import support_heating, support_heating_v2, \
+    is_pure_cool_v2
+
+DATA_DIR = "tests/data/"
+
+# (product type, fixture) pairs replayed by the fan benchmark
+FAN_FIXTURES = [
+    (DYSON_PURE_COOL_LINK_DESK, "state.json"),
+    (DYSON_PURE_COOL_LINK_DESK, "sensor.json"),
+    (DYSON_PURE_COOL_LINK_DESK, "sensor_sltm_off.json"),
+    (DYSON_PURE_HOT_COOL_LINK_TOUR, "state_hot.json"),
+    (DYSON_PURE_COOL, "state_pure_cool.json"),
+    (DYSON_PURE_COOL, "sensor_pure_cool.json"),
+    (DYSON_PURE_COOL, "sensor_pure_cool_init.json"),
+    (DYSON_PURE_COOL, "sensor_pure_cool_off.json"),
+    (DYSON_PURE_HOT_COOL, "state_pure_hotcool.json"),
+]
+
+# Fixtures replayed by the 360 Eye benchmark
+VACUUM_FIXTURES = [
+    (DYSON_360_EYE, "vacuum/state.json"),
+    (DYSON_360_EYE, "vacuum/state-change.json"),
+    (DYSON_360_EYE, "vacuum/map-global.json"),
+    (DYSON_360_EYE, "vacuum/map-grid.json"),
+    (DYSON_360_EYE, "vacuum/map-data.json"),
+    (DYSON_360_EYE, "vacuum/telemetry-data.json"),
+    (DYSON_360_EYE, "vacuum/goodbye.json"),
+]
+
+
+class _Message:
+    """Minimal stand-in for paho MQTTMessage."""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class _Device:
+    """Minimal fan stand-in receiving dispatched messages."""
+
+    def __init__(self, product_type):
+        self.product_type = product_type
+        self.device_available = True
+        self.callback_message = []
+        self.state = None
+        self.environmental_state = None
+
+
+def _legacy_fan_on_message(client, userdata, msg):
+    # pylint: disable=unused-argument
+    """Dispatch the way on_message did before the single-parse table."""
+    payload = msg.payload.decode("utf-8")
+    if DysonPureCoolState.is_state_message(payload):
+        if support_heating(userdata.product_type):
+            device_msg = DysonPureHotCoolState(payload)
+        elif support_heating_v2(userdata.product_type):
+            device_msg = DysonPureHotCoolV2State(payload)
+        elif is_pure_cool_v2(userdata.product_type):
+            device_msg = DysonPureCoolV2State(payload)
+        else:
+            device_msg = DysonPureCoolState(payload)
+        userdata.state = device_msg
+    elif DysonEnvironmentalSensorState.is_environmental_state_message(
+            payload):
+        if is_pure_cool_v2(userdata.product_type):
+            device_msg = DysonEnvironmentalSensorV2State(payload)
+        else:
+            device_msg = DysonEnvironmentalSensorState(payload)
+        userdata.environmental_state = device_msg
+
+
+def _legacy_vacuum_on_message(client, userdata, msg):
+    # pylint: disable=unused-argument
+    """Dispatch the way on_message did before the message type registry."""
+    payload = msg.payload.decode("utf-8")
+    if Dyson360EyeState.is_state_message(payload):
+        userdata.state = Dyson360EyeState(payload)
+    elif Dyson360EyeMapGlobal.is_map_global(payload):
+        Dyson360EyeMapGlobal(payload)
+    elif Dyson360EyeTelemetryData.is_telemetry_data(payload):
+        Dyson360EyeTelemetryData(payload)
+    elif Dyson360EyeMapGrid.is_map_grid(payload):
+        Dyson360EyeMapGrid(payload)
+    elif Dyson360EyeMapData.is_map_data(payload):
+        Dyson360EyeMapData(payload)
+    elif Dyson360Goodbye.is_goodbye_message(payload):
+        Dyson360Goodbye(payload)
+
+
+def _load(fixtures):
+    """Return (device, message) pairs for the given fixtures."""
+    samples = []
+    for product_type, fixture in fixtures:
+        with open(DATA_DIR + fixture, "rb") as data:
+            samples.append((_Device(product_type), _Message(data.read())))
+    return samples
+
+
+def _throughput(on_message, samples, rounds):
+    """Return the number of messages dispatched per second."""
+    def run():
+        for device, msg in samples:
+            on_message(None, device, msg)
+    elapsed = min(timeit.repeat(run, number=rounds, repeat=3))
+    return len(samples) * rounds / elapsed
+
+
+def _report(name, before, after):
+    """Print a before/after line."""
+    print("{0:<24} before {1:>10.0f} msg/s  after {2:>10.0f} msg/s  "
+          "x{3:.2f}".format(name, before, after, after / before))
+
+
+def main(rounds=2000):
+    """Run the benchmarks."""
+    samples = _load(FAN_FIXTURES)
+    _report("DysonPureCoolLink",
+            _throughput(_legacy_fan_on_message, samples, rounds),
+            _throughput(DysonPureCoolLink.on_message, samples, rounds))
+    samples = _load(VACUUM_FIXTURES)
+    _report("Dyson360Eye",
+            _throughput(_legacy_vacuum_on_message, samples, rounds),
+            _throughput(Dyson360Eye.on_message, samples, rounds))
+
+
+if __name__ == '__main__':
+    main()
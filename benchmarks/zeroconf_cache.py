@@ -0,0 +1,127 @@
+"""Benchmark the zeroconf DNS cache with many records.
+
+Compare the indexed DNSCache with the previous implementation (one list
+of records per name, linear lookups) on a cache holding records of many
+devices: PTR, SRV, TXT and A records of each service, most of them
+sharing a few service types.
+
+Run from the repository root::
+
+    python -m benchmarks.zeroconf_cache [record counts...]
+"""
+
+import sys
+import time
+from functools import reduce
+
+from libpurecool.zeroconf import DNSCache, DNSPointer, DNSService, \
+    DNSText, DNSAddress, current_time_millis, _TYPE_PTR, _TYPE_SRV, \
+    _TYPE_TXT, _TYPE_A, _CLASS_IN
+
+RECORD_COUNTS = [1000, 10000]
+SERVICE_TYPES = ["_googlecast._tcp.local.", "_ipp._tcp.local.",
+                 "_airplay._tcp.local.", "_dyson_mqtt._tcp.local."]
+# Share of the records expired when the reaper runs
+EXPIRED_SHARE = 0.01
+
+
+class _ListCache:
+    """DNS cache before indexing: one list of records per name."""
+
+    def __init__(self):
+        self.cache = {}
+
+    def add(self, entry):
+        self.cache.setdefault(entry.key, []).append(entry)
+
+    def remove(self, entry):
+        try:
+            self.cache[entry.key].remove(entry)
+        except (KeyError, ValueError):
+            pass
+
+    def get(self, entry):
+        for cached_entry in self.cache.get(entry.key, []):
+            if entry.__eq__(cached_entry):
+                return cached_entry
+        return None
+
+    def entries(self):
+        return reduce(lambda a, b: a + b, list(self.cache.values()))
+
+    def handle_response(self, record):
+        """Cache lookup done by Zeroconf.handle_response."""
+        if record in self.entries():
+            return self.get(record)
+        return None
+
+    def reap(self, now):
+        """Cache walk done by the Reaper every 10 seconds."""
+        expired = []
+        for record in self.entries():
+            if record.is_expired(now):
+                expired.append(record)
+                self.remove(record)
+        return expired
+
+
+def _records(count):
+    """Return count records of count / 4 services."""
+    records = []
+    for index in range(count // 4):
+        service_type = SERVICE_TYPES[index % len(SERVICE_TYPES)]
+        name = "device-{0}.{1}".format(index, service_type)
+        host = "device-{0}.local.".format(index)
+        # A few records expire before the reaper runs
+        ttl = 1 if index % int(1 / EXPIRED_SHARE) == 0 else 4500
+        records.extend([
+            DNSPointer(service_type, _TYPE_PTR, _CLASS_IN, ttl, name),
+            DNSService(name, _TYPE_SRV, _CLASS_IN, ttl, 0, 0, 8009, host),
+            DNSText(name, _TYPE_TXT, _CLASS_IN, ttl, b"\x00"),
+            DNSAddress(host, _TYPE_A, _CLASS_IN, ttl,
+                       index.to_bytes(4, "big"))])
+    return records
+
+
+def _time(function, repeat):
+    """Return the mean duration of function in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def _measure(cache, count, lookup, reap, lookups):
+    records = _records(count)
+    start = time.perf_counter()
+    for record in records:
+        cache.add(record)
+    add_us = (time.perf_counter() - start) / len(records) * 1e6
+    probes = iter(records[::max(1, len(records) // lookups)] * 2)
+    lookup_us = _time(lambda: lookup(next(probes)), lookups)
+    now = current_time_millis() + 2000
+    start = time.perf_counter()
+    expired = reap(now)
+    reap_ms = (time.perf_counter() - start) * 1000
+    return add_us, lookup_us, reap_ms, len(expired)
+
+
+def main(counts=None):
+    """Run the measures and print the results."""
+    print("{0:>7} {1:>8} {2:>9} {3:>12} {4:>10} {5:>8}".format(
+        "records", "cache", "add (us)", "lookup (us)", "reap (ms)",
+        "expired"))
+    for count in counts or RECORD_COUNTS:
+        indexed = DNSCache()
+        legacy = _ListCache()
+        for name, result in [
+                ("indexed", _measure(indexed, count, indexed.get,
+                                     indexed.expire, 1000)),
+                ("list", _measure(legacy, count, legacy.handle_response,
+                                  legacy.reap, 20))]:
+            print("{0:>7} {1:>8} {2:>9.2f} {3:>12.1f} {4:>10.2f} "
+                  "{5:>8}".format(count, name, *result))
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]])
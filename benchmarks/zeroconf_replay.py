@@ -0,0 +1,109 @@
+"""Benchmark the zeroconf packet filter by replaying mDNS traffic.
+
+A synthetic capture of a busy network is built: responses and queries of
+printers, Chromecasts, AirPlay and HomeKit devices, and a few Dyson fans.
+The capture is replayed through the Listener of a Zeroconf instance
+browsing the Dyson service, with and without packet filtering.
+
+Run from the repository root::
+
+    python -m benchmarks.zeroconf_replay [packet count]
+"""
+
+import random
+import sys
+import time
+
+from libpurecool.dyson_discovery import DYSON_SERVICE_TYPE
+from libpurecool.zeroconf import Zeroconf, ServiceBrowser, DNSOutgoing, \
+    DNSQuestion, DNSPointer, DNSService, DNSText, DNSAddress, \
+    _FLAGS_QR_RESPONSE, _FLAGS_QR_QUERY, _FLAGS_AA, _TYPE_PTR, _TYPE_SRV, \
+    _TYPE_TXT, _TYPE_A, _CLASS_IN
+
+PACKET_COUNT = 20000
+# Service types of the network, with their share of the traffic
+SERVICE_TYPES = [("_googlecast._tcp.local.", 30), ("_ipp._tcp.local.", 20),
+                 ("_airplay._tcp.local.", 20), ("_hap._tcp.local.", 15),
+                 ("_spotify-connect._tcp.local.", 13),
+                 (DYSON_SERVICE_TYPE, 2)]
+DEVICES_PER_TYPE = 50
+
+
+def _response(service_type, index):
+    """Return the announce of a service, with its SRV, TXT and A."""
+    name = "device-{0}.{1}".format(index, service_type)
+    host = "host-{0}-{1}.local.".format(service_type.split(".")[0], index)
+    if service_type == DYSON_SERVICE_TYPE:
+        name = "475_NN2-EU-KKA{0:04d}A.{1}".format(index, service_type)
+    out = DNSOutgoing(_FLAGS_QR_RESPONSE | _FLAGS_AA)
+    out.add_answer_at_time(DNSPointer(service_type, _TYPE_PTR, _CLASS_IN,
+                                      4500, name), 0)
+    out.add_answer_at_time(DNSService(name, _TYPE_SRV, _CLASS_IN, 120, 0, 0,
+                                      8009, host), 0)
+    out.add_answer_at_time(DNSText(name, _TYPE_TXT, _CLASS_IN, 4500,
+                                   b"\x0bid=0123456789\x06ve=05\x07md=Model"),
+                           0)
+    out.add_answer_at_time(DNSAddress(host, _TYPE_A, _CLASS_IN, 120,
+                                      bytes([10, 0, index // 250,
+                                             index % 250])), 0)
+    return out.packet()
+
+
+def _query(service_type):
+    """Return a query of a service type."""
+    out = DNSOutgoing(_FLAGS_QR_QUERY)
+    out.add_question(DNSQuestion(service_type, _TYPE_PTR, _CLASS_IN))
+    return out.packet()
+
+
+def capture(count, seed=0):
+    """Return count (address, port, packet) of a busy network."""
+    rand = random.Random(seed)
+    types = [service_type for service_type, share in SERVICE_TYPES
+             for _ in range(share)]
+    packets = []
+    for _ in range(count):
+        service_type = rand.choice(types)
+        index = rand.randrange(DEVICES_PER_TYPE)
+        address = "10.0.{0}.{1}".format(index // 250, index % 250)
+        if rand.random() < 0.2:
+            packets.append((address, 5353, _query(service_type)))
+        else:
+            packets.append((address, 5353,
+                            _response(service_type, index)))
+    return packets
+
+
+def replay(packets, filter_packets):
+    """Replay packets, return the duration and the listener stats."""
+    zeroconf = Zeroconf(interfaces=["127.0.0.1"],
+                        filter_packets=filter_packets)
+    browser = ServiceBrowser(zeroconf, DYSON_SERVICE_TYPE,
+                             handlers=[lambda **kwargs: None])
+    try:
+        start = time.perf_counter()
+        for address, port, data in packets:
+            zeroconf.listener.handle_packet(data, address, port)
+        duration = time.perf_counter() - start
+        return (duration, zeroconf.listener.filtered, len(zeroconf.cache),
+                len(browser.services))
+    finally:
+        zeroconf.close()
+
+
+def main(count=PACKET_COUNT):
+    """Replay the capture and print the results."""
+    packets = capture(count)
+    print("{0:>8} {1:>8} {2:>10} {3:>10} {4:>9} {5:>8} {6:>8}".format(
+        "packets", "filter", "time (s)", "packets/s", "filtered", "cache",
+        "dyson"))
+    for filter_packets in (False, True):
+        duration, filtered, cached, found = replay(packets, filter_packets)
+        print("{0:>8} {1:>8} {2:>10.2f} {3:>10.0f} {4:>9} {5:>8} "
+              "{6:>8}".format(count, "on" if filter_packets else "off",
+                              duration, count / duration, filtered, cached,
+                              found))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -2,12 +2,20 @@
 
 # pylint: disable=too-many-public-methods,too-many-instance-attributes
 
+import json
 import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 import urllib3
+from urllib3.util.retry import Retry
 
 from .dyson_pure_cool import DysonPureCool
 from .dyson_pure_hotcool import DysonPureHotCool
@@ -24,29 +32,216 @@ _LOGGER = logging.getLogger(__name__)
 DYSON_API_URL = "appapi.cp.dyson.com"
 DYSON_API_URL_CN = "appapi.cp.dyson.cn"
 DYSON_API_USER_AGENT = "DysonLink/29019 CFNetwork/1188 Darwin/20.0.0"
+# Default retries of a failed request, and backoff factor in seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# Default timeout in seconds: connection, then each read
+HTTP_TIMEOUT = (5, 10)
+# Responses retried: rate limiting and server errors
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_RETRY_METHODS = ("GET", "POST")
+# Default time in seconds a cached manifest is used
+MANIFEST_TTL = 3600
+
+# Changes of the account devices found by a manifest refresh
+DevicesChange = namedtuple('DevicesChange', ['added', 'removed', 'updated'])
+# Cached manifests of an account, with their fetch time and ttl
+CachedManifest = namedtuple('CachedManifest',
+                            ['manifest', 'manifest_v2', 'fetched', 'ttl'])
+
+
+def _device_v1(device):
+    """Return the device of a v1 manifest entry."""
+    if is_360_eye_device(device):
+        return Dyson360Eye(device)
+    if is_heating_device(device):
+        return DysonPureHotCoolLink(device)
+    return DysonPureCoolLink(device)
+
+
+def _device_v2(device):
+    """Return the device of a v2 manifest entry, None if not supported."""
+    if is_dyson_pure_cool_device(device):
+        return DysonPureCool(device)
+    if is_heating_device_v2(device):
+        return DysonPureHotCool(device)
+    return None
+
+
+class ManifestCache:
+    """Device manifests of accounts, kept in memory and optionally on disk.
+
+    Each manifest is saved with the time it was fetched and is fresh for
+    ttl seconds. Manifests hold encrypted device credentials: the file is
+    only readable by its owner.
+    """
+
+    def __init__(self, path=None, ttl=MANIFEST_TTL):
+        """Create a new cache, loading the manifests already saved.
+
+        :param path: JSON file path (default: kept in memory only)
+        :param ttl: Time in seconds a manifest is fresh after it was fetched
+        """
+        self._path = os.path.expanduser(path) if path else None
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    @property
+    def path(self):
+        """JSON file path, None if kept in memory only."""
+        return self._path
+
+    def get(self, key):
+        """Return the cached manifests of an account, even if expired.
+
+        :param key: Account key
+        :return: CachedManifest, None if unknown
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return CachedManifest(entry["manifest"], entry["manifest_v2"],
+                              entry["fetched"], entry["ttl"])
+
+    @staticmethod
+    def is_fresh(cached):
+        """Return True if cached manifests can be used without refresh.
+
+        :param cached: CachedManifest
+        """
+        return time.time() <= cached.fetched + cached.ttl
+
+    def put(self, key, manifest, manifest_v2):
+        """Save the manifests of an account fetched now.
+
+        :param key: Account key
+        :param manifest: v1 manifest
+        :param manifest_v2: v2 manifest
+        """
+        with self._lock:
+            self._entries[key] = {
+                "manifest": manifest,
+                "manifest_v2": manifest_v2,
+                "fetched": time.time(),
+                "ttl": self._ttl
+            }
+            self._save()
+
+    def remove(self, key):
+        """Remove the manifests of an account.
+
+        :param key: Account key
+        :return: True if removed, False if unknown
+        """
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._save()
+        return True
+
+    def _load(self):
+        """Return the entries saved on disk."""
+        if self._path is None:
+            return {}
+        try:
+            with open(self._path, encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            _LOGGER.warning("Unable to read manifest cache %s: %s",
+                            self._path, error)
+            return {}
+
+    def _save(self):
+        """Write the entries on disk."""
+        if self._path is None:
+            return
+        directory = os.path.dirname(self._path)
+        temporary_path = self._path + ".tmp"
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            descriptor = os.open(temporary_path,
+                                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                 0o600)
+            with open(descriptor, "w", encoding="utf-8") as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(temporary_path, self._path)
+        except OSError as error:
+            _LOGGER.warning("Unable to write manifest cache %s: %s",
+                            self._path, error)
 
 
 class DysonAccount:
     """Dyson account."""
 
-    def __init__(self, email, password, country):
+    def __init__(self, email, password, country, *, retries=HTTP_RETRIES,
+                 backoff_factor=HTTP_BACKOFF_FACTOR, timeout=HTTP_TIMEOUT,
+                 manifest_cache=None):
+        # pylint: disable=too-many-arguments
         """Create a new Dyson account.
 
+        Requests to Dyson web services share one HTTP session, keeping the
+        connection alive between requests.
+
+        Options after country are keyword-only.
+
         :param email: User email
         :param password: User password
         :param country: 2 characters language code
+        :param retries: Max retries of a failed request
+        :param backoff_factor: Backoff factor in seconds between retries
+        :param timeout: Timeout in seconds, or (connect, read) timeouts
+        :param manifest_cache: ManifestCache of the device manifests
         """
+        self._manifest_cache = manifest_cache
+        self._devices = {}
+        self._devices_lock = threading.Lock()
+        self._refresh_thread = None
         self._email = email
         self._password = password
         self._country = country
         self._logged = False
         self._auth = None
         self._headers = {'User-Agent': DYSON_API_USER_AGENT}
+        self._timeout = timeout
+        self._session = self._create_session(retries, backoff_factor)
         if country == "CN":
             self._dyson_api_url = DYSON_API_URL_CN
         else:
             self._dyson_api_url = DYSON_API_URL
 
+    @staticmethod
+    def _create_session(retries, backoff_factor):
+        """Return a pooled HTTP session retrying failed requests.
+
+        :param retries: Max retries of a failed request
+        :param backoff_factor: Backoff factor in seconds between retries
+        """
+        session = requests.Session()
+        # Login is retried too: authenticating has no side effect
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=HTTP_RETRY_STATUSES,
+                      allowed_methods=HTTP_RETRY_METHODS,
+                      raise_on_status=False)
+        session.mount("https://", HTTPAdapter(max_retries=retry))
+        return session
+
+    def close(self):
+        """Close the connections to Dyson web services."""
+        self._session.close()
+
+    def __enter__(self):
+        """Return the account."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the connections."""
+        self.close()
+
     def login(self):
         """Login to dyson web services."""
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -57,12 +252,13 @@ class DysonAccount:
             "Email": self._email,
             "Password": self._password
         }
-        login = requests.post(
+        login = self._session.post(
             "https://{0}/v1/userregistration/authenticate?country={1}".format(
                 self._dyson_api_url, self._country),
             headers=self._headers,
             data=request_body,
-            verify=False
+            verify=False,
+            timeout=self._timeout
         )
         # pylint: disable=no-member
         if login.status_code == requests.codes.ok:
@@ -74,41 +270,157 @@ class DysonAccount:
             self._logged = False
         return self._logged
 
-    def devices(self):
-        """Return all devices linked to the account."""
-        if self._logged:
-            device_response = requests.get(
-                "https://{0}/v1/provisioningservice/manifest".format(
-                    self._dyson_api_url),
-                headers=self._headers,
-                verify=False,
-                auth=self._auth)
-            device_v2_response = requests.get(
-                "https://{0}/v2/provisioningservice/manifest".format(
-                    self._dyson_api_url),
-                headers=self._headers,
-                verify=False,
-                auth=self._auth)
-            devices = []
-            for device in device_response.json():
-                if is_360_eye_device(device):
-                    dyson_device = Dyson360Eye(device)
-                elif is_heating_device(device):
-                    dyson_device = DysonPureHotCoolLink(device)
-                else:
-                    dyson_device = DysonPureCoolLink(device)
-                devices.append(dyson_device)
-
-            for device_v2 in device_v2_response.json():
-                if is_dyson_pure_cool_device(device_v2):
-                    devices.append(DysonPureCool(device_v2))
-                elif is_heating_device_v2(device_v2):
-                    devices.append(DysonPureHotCool(device_v2))
-
-            return devices
-
-        _LOGGER.warning("Not logged to Dyson Web Services.")
-        raise DysonNotLoggedException()
+    @property
+    def manifest_cache(self):
+        """Cache of the device manifests, None if not cached."""
+        return self._manifest_cache
+
+    @manifest_cache.setter
+    def manifest_cache(self, value):
+        """Set the cache of the device manifests."""
+        self._manifest_cache = value
+
+    @property
+    def _account_key(self):
+        """Key of the account in the manifest cache."""
+        return "{0}/{1}".format(self._dyson_api_url, self._email.lower())
+
+    def devices(self, refresh_in_background=False):
+        """Return all devices linked to the account.
+
+        With a manifest cache, devices are built once and returned again
+        while the manifests are fresh. Expired manifests are refreshed:
+        added devices are built, removed devices are dropped and the other
+        devices are updated in place.
+
+        :param refresh_in_background: Return the devices of expired
+                                      manifests immediately, and refresh
+                                      them in a background thread
+        """
+        if self._manifest_cache is None:
+            return list(self.iter_devices())
+        if not self._logged:
+            _LOGGER.warning("Not logged to Dyson Web Services.")
+            raise DysonNotLoggedException()
+        cached = self._manifest_cache.get(self._account_key)
+        if cached is None:
+            self.refresh()
+        elif ManifestCache.is_fresh(cached) or refresh_in_background:
+            with self._devices_lock:
+                if not self._devices:
+                    self._reconcile(cached.manifest, cached.manifest_v2)
+            if not ManifestCache.is_fresh(cached):
+                self._refresh_in_background()
+        else:
+            self.refresh()
+        with self._devices_lock:
+            return list(self._devices.values())
+
+    def refresh(self):
+        """Fetch the manifests, and reconcile the devices already built.
+
+        :return: DevicesChange of the devices added, removed and updated
+        """
+        if not self._logged:
+            _LOGGER.warning("Not logged to Dyson Web Services.")
+            raise DysonNotLoggedException()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            manifest = executor.submit(self._manifest, "v1")
+            manifest_v2 = executor.submit(self._manifest, "v2")
+            manifest, manifest_v2 = manifest.result(), manifest_v2.result()
+        if self._manifest_cache is not None:
+            self._manifest_cache.put(self._account_key, manifest,
+                                     manifest_v2)
+        with self._devices_lock:
+            return self._reconcile(manifest, manifest_v2)
+
+    def _refresh_in_background(self):
+        """Refresh the manifests in a thread, if not already refreshing."""
+        with self._devices_lock:
+            if self._refresh_thread is not None:
+                return
+            self._refresh_thread = threading.Thread(
+                target=self._background_refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def _background_refresh(self):
+        try:
+            change = self.refresh()
+            _LOGGER.debug("Devices added: %s, removed: %s, updated: %s",
+                          len(change.added), len(change.removed),
+                          len(change.updated))
+        except Exception as error:  # pylint: disable=broad-except
+            _LOGGER.warning("Unable to refresh devices: %s", error)
+        finally:
+            with self._devices_lock:
+                self._refresh_thread = None
+
+    def _reconcile(self, manifest, manifest_v2):
+        """Update the devices built from new manifests.
+
+        Must be called with the devices lock held.
+
+        :param manifest: v1 manifest
+        :param manifest_v2: v2 manifest
+        :return: DevicesChange
+        """
+        entries = [(entry, _device_v1) for entry in manifest] + \
+            [(entry, _device_v2) for entry in manifest_v2]
+        devices = {}
+        added, updated = [], []
+        for entry, build in entries:
+            device = self._devices.get(entry['Serial'])
+            if device is not None and \
+                    device.product_type == entry['ProductType']:
+                if device.update_manifest(entry):
+                    updated.append(device)
+            else:
+                device = build(entry)
+                if device is None:
+                    continue
+                added.append(device)
+            devices[device.serial] = device
+        removed = [device for serial, device in self._devices.items()
+                   if serial not in devices]
+        self._devices = devices
+        return DevicesChange(added, removed, updated)
+
+    def iter_devices(self):
+        """Iterate over the devices linked to the account.
+
+        Both manifests are fetched concurrently, and devices are yielded as
+        soon as their manifest is received: v1 devices first, then v2.
+        Must be called once logged.
+        """
+        if not self._logged:
+            _LOGGER.warning("Not logged to Dyson Web Services.")
+            raise DysonNotLoggedException()
+        return self._iter_devices()
+
+    def _iter_devices(self):
+        """Fetch both manifests concurrently and yield their devices."""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            manifest = executor.submit(self._manifest, "v1")
+            manifest_v2 = executor.submit(self._manifest, "v2")
+            for device in manifest.result():
+                yield _device_v1(device)
+            for device_v2 in manifest_v2.result():
+                dyson_device = _device_v2(device_v2)
+                if dyson_device is not None:
+                    yield dyson_device
+
+    def _manifest(self, version):
+        """Return the JSON manifest of the devices.
+
+        :param version: Manifest version (v1 or v2)
+        """
+        return self._session.get(
+            "https://{0}/{1}/provisioningservice/manifest".format(
+                self._dyson_api_url, version),
+            headers=self._headers,
+            verify=False,
+            auth=self._auth,
+            timeout=self._timeout).json()
 
     @property
     def logged(self):
@@ -7,45 +7,79 @@ import datetime
 
 import paho.mqtt.client as mqtt
 
-from .dyson_device import DysonDevice, NetworkDevice, DEFAULT_PORT
-from .utils import printable_fields
+from .dyson_device import DysonDevice, NetworkDevice, DEFAULT_PORT, \
+    DEFAULT_CONNECT_TIMEOUTS
+from .exceptions import DysonConnectionException
+from .utils import printable_fields, load_message
 from .const import PowerMode, Dyson360EyeMode, Dyson360EyeCommand
 
 _LOGGER = logging.getLogger(__name__)
 
+# Message classes indexed by the "msg" field of the payload
+MESSAGE_TYPES = {}
+
+
+def register_message_type(*msg_types):
+    """Register a message class for the given message types.
+
+    Can be used as a class decorator. The class is built from the decoded
+    JSON message.
+
+    :param msg_types: Values of the "msg" field handled by the class
+    """
+    def register(message_class):
+        for msg_type in msg_types:
+            MESSAGE_TYPES[msg_type] = message_class
+        return message_class
+    return register
+
 
 class Dyson360Eye(DysonDevice):
     """Dyson 360 Eye device."""
 
-    def connect(self, device_ip, device_port=DEFAULT_PORT):
+    def connect(self, device_ip, device_port=DEFAULT_PORT, timeouts=None):
         """Try to connect to device.
 
         :param device_ip: Device IP address
         :param device_port: Device Port (default: 1883)
+        :param timeouts: ConnectTimeouts of the connection phases
         :return: True if connected, else False
         """
         self._network_device = NetworkDevice(self._name, device_ip,
                                              device_port)
+        try:
+            self._connect_phases(timeouts or DEFAULT_CONNECT_TIMEOUTS)
+        except (DysonConnectionException, OSError) as error:
+            _LOGGER.error("Unable to connect to device %s: %s",
+                          self.serial, error)
+        return self._device_available
 
-        self._mqtt = mqtt.Client(userdata=self, protocol=3)
-        self._mqtt.username_pw_set(self._serial, self._credentials)
-        self._mqtt.on_message = self.on_message
-        self._mqtt.on_connect = self.on_connect
-        self._mqtt.connect(self._network_device.address,
-                           self._network_device.port)
-        self._mqtt.loop_start()
-        if self._connection_queue.get(timeout=10):
-            self._connected = True
-            _LOGGER.info("Connected to device %s", self.serial)
-            self.request_current_state()
-
-            # Wait for first data
-            self._state_data_available.get()
-            self._device_available = True
-        else:
-            self._mqtt.loop_stop()
+    def _connect_phases(self, timeouts):
+        """Connect to the MQTT broker and wait for the first data.
 
-        return self._device_available
+        :param timeouts: ConnectTimeouts
+        :raise DysonConnectionException: if a phase fails
+        """
+        self._start_mqtt_client(timeouts)
+        self._connected = True
+        _LOGGER.info("Connected to device %s", self.serial)
+        self.request_current_state()
+
+        # Wait for first data
+        try:
+            self._wait_for(self._state_data_available, timeouts.state,
+                           "state")
+        except DysonConnectionException:
+            self._stop_mqtt_client()
+            raise
+        self._device_available = True
+
+    def _create_mqtt_client(self, protocol=mqtt.MQTTv31):
+        """Create the MQTT client used to communicate with the device.
+
+        :param protocol: MQTT protocol version
+        """
+        return super()._create_mqtt_client(protocol)
 
     @property
     def status_topic(self):
@@ -57,6 +91,7 @@ class Dyson360Eye(DysonDevice):
 
         :param command Command to send (const.Dyson360EyeCommand)
         :param data Data dictionary to send. Can be empty
+        :return: Publication info, None if not connected
         """
         if data is None:
             data = {}
@@ -68,36 +103,36 @@ class Dyson360Eye(DysonDevice):
             payload.update(data)
             _LOGGER.debug("Sending command to the device: %s",
                           json.dumps(payload))
-            self._mqtt.publish(self.command_topic, json.dumps(payload), 1)
-        else:
-            _LOGGER.warning(
-                "Not connected, can not send commands: %s",
-                self.serial)
+            return self._mqtt.publish(self.command_topic, json.dumps(payload),
+                                      1)
+        _LOGGER.warning("Not connected, can not send commands: %s",
+                        self.serial)
+        return None
 
     def set_power_mode(self, power_mode):
         """Set power mode.
 
         :param power_mode Power mode (const.PowerMode)
         """
-        self._send_command(Dyson360EyeCommand.STATE_SET.value, {
+        return self._send_command(Dyson360EyeCommand.STATE_SET.value, {
             "data": {"defaultVacuumPowerMode": power_mode.value}})
 
     def start(self):
         """Start cleaning."""
-        self._send_command(Dyson360EyeCommand.START.value,
-                           {"fullCleanType": "immediate"})
+        return self._send_command(Dyson360EyeCommand.START.value,
+                                  {"fullCleanType": "immediate"})
 
     def pause(self):
         """Pause cleaning."""
-        self._send_command(Dyson360EyeCommand.PAUSE.value)
+        return self._send_command(Dyson360EyeCommand.PAUSE.value)
 
     def resume(self):
         """Resume cleaning."""
-        self._send_command(Dyson360EyeCommand.RESUME.value)
+        return self._send_command(Dyson360EyeCommand.RESUME.value)
 
     def abort(self):
         """Abort cleaning."""
-        self._send_command(Dyson360EyeCommand.ABORT.value)
+        return self._send_command(Dyson360EyeCommand.ABORT.value)
 
     @staticmethod
     def call_callback_functions(functions, message):
@@ -110,28 +145,19 @@ class Dyson360Eye(DysonDevice):
         # pylint: disable=unused-argument
         """Set function Callback when message received."""
         payload = msg.payload.decode("utf-8")
-        device_msg = None
-        if Dyson360EyeState.is_state_message(payload):
-            device_msg = Dyson360EyeState(payload)
+        json_message = load_message(payload)
+        message_class = MESSAGE_TYPES.get(json_message.get('msg'))
+        if message_class is None:
+            _LOGGER.warning(payload)
+            return
+
+        device_msg = message_class(json_message)
+        if isinstance(device_msg, Dyson360EyeState):
             if not userdata.device_available:
                 userdata.state_data_available()
             userdata.state = device_msg
-        elif Dyson360EyeMapGlobal.is_map_global(payload):
-            device_msg = Dyson360EyeMapGlobal(payload)
-        elif Dyson360EyeTelemetryData.is_telemetry_data(payload):
-            device_msg = Dyson360EyeTelemetryData(payload)
-        elif Dyson360EyeMapGrid.is_map_grid(payload):
-            device_msg = Dyson360EyeMapGrid(payload)
-        elif Dyson360EyeMapData.is_map_data(payload):
-            device_msg = Dyson360EyeMapData(payload)
-        elif Dyson360Goodbye.is_goodbye_message(payload):
-            device_msg = Dyson360Goodbye(payload)
-        else:
-            _LOGGER.warning(payload)
-
-        if device_msg:
-            Dyson360Eye.call_callback_functions(userdata.callback_message,
-                                                device_msg)
+        Dyson360Eye.call_callback_functions(userdata.callback_message,
+                                            device_msg)
 
     def __repr__(self):
         """Return a String representation."""
@@ -139,17 +165,19 @@ class Dyson360Eye(DysonDevice):
         return 'Dyson360Eye(' + ",".join(printable_fields(fields)) + ')'
 
 
+@register_message_type("CURRENT-STATE", "STATE-CHANGE")
 class Dyson360EyeState:
     """Dyson 360 Eye state."""
 
     @staticmethod
     def is_state_message(payload):
         """Return true if this message is a Dyson 360 Eye state message."""
-        return json.loads(payload)['msg'] in ["CURRENT-STATE", "STATE-CHANGE"]
+        return load_message(payload)['msg'] in ["CURRENT-STATE",
+                                                "STATE-CHANGE"]
 
     def __init__(self, json_body):
         """Create a new Dyson 360 Eye state."""
-        data = json.loads(json_body)
+        data = load_message(json_body)
         try:
             self._state = Dyson360EyeMode(
                 data["state"] if "state" in data else data["newstate"])
@@ -214,18 +242,19 @@ class Dyson360EyeState:
         return 'Dyson360EyeState(' + ",".join(printable_fields(fields)) + ')'
 
 
+@register_message_type("TELEMETRY-DATA")
 class Dyson360EyeTelemetryData:
     """Dyson 360 Eye Telemetry Data."""
 
     @staticmethod
     def is_telemetry_data(payload):
         """Return true if this message is a telemetry data message."""
-        json_message = json.loads(payload)
+        json_message = load_message(payload)
         return json_message['msg'] in ["TELEMETRY-DATA"]
 
     def __init__(self, json_body):
         """Create a new Telemetry Data."""
-        data = json.loads(json_body)
+        data = load_message(json_body)
         self._telemetry_data_id = data["id"]
         self._field1 = data["field1"]
         self._field2 = data["field2"]
@@ -276,18 +305,19 @@ class Dyson360EyeTelemetryData:
             printable_fields(fields)) + ')'
 
 
+@register_message_type("MAP-DATA")
 class Dyson360EyeMapData:
     """Dyson 360 Eye map data."""
 
     @staticmethod
     def is_map_data(payload):
         """Return true if this message is a map data message."""
-        json_message = json.loads(payload)
+        json_message = load_message(payload)
         return json_message['msg'] in ["MAP-DATA"]
 
     def __init__(self, json_body):
         """Create a new Map Data."""
-        data = json.loads(json_body)
+        data = load_message(json_body)
         self._grid_id = data["gridID"]
         self._clean_id = data["cleanId"]
         self._content_type = data["data"]["content-type"]
@@ -337,18 +367,19 @@ class Dyson360EyeMapData:
         return 'Dyson360EyeMapData(' + ",".join(printable_fields(fields)) + ')'
 
 
+@register_message_type("MAP-GRID")
 class Dyson360EyeMapGrid:
     """Dyson 360 Eye map grid."""
 
     @staticmethod
     def is_map_grid(payload):
         """Return true if this message is a map grid message."""
-        json_message = json.loads(payload)
+        json_message = load_message(payload)
         return json_message['msg'] in ["MAP-GRID"]
 
     def __init__(self, json_body):
         """Create a new Map Grid."""
-        data = json.loads(json_body)
+        data = load_message(json_body)
         self._grid_id = data["gridID"]
         self._resolution = data["resolution"]
         self._width = data["width"]
@@ -406,18 +437,19 @@ class Dyson360EyeMapGrid:
         return 'Dyson360EyeMapGrid(' + ",".join(printable_fields(fields)) + ')'
 
 
+@register_message_type("MAP-GLOBAL")
 class Dyson360EyeMapGlobal:
     """Dyson 360Eye map global."""
 
     @staticmethod
     def is_map_global(payload):
         """Return true if this message is a map global message."""
-        json_message = json.loads(payload)
+        json_message = load_message(payload)
         return json_message['msg'] in ["MAP-GLOBAL"]
 
     def __init__(self, json_body):
         """Create a new Map Global."""
-        data = json.loads(json_body)
+        data = load_message(json_body)
         self._grid_id = data["gridID"]
         self._x = data["x"]
         self._y = data["y"]
@@ -468,18 +500,19 @@ class Dyson360EyeMapGlobal:
             printable_fields(fields)) + ')'
 
 
+@register_message_type("GOODBYE")
 class Dyson360Goodbye:
     """Dyson 360 Eye goodbye message."""
 
     @staticmethod
     def is_goodbye_message(payload):
         """Return true if this message is a goodbye message."""
-        json_message = json.loads(payload)
+        json_message = load_message(payload)
         return json_message['msg'] in ["GOODBYE"]
 
     def __init__(self, json_body):
         """Create a new Map Global."""
-        data = json.loads(json_body)
+        data = load_message(json_body)
         self._reason = data["reason"]
         self._time = datetime.datetime.strptime(data["time"],
                                                 "%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,530 @@
+"""Asyncio Dyson devices.
+
+Devices of this module are driven by the running asyncio event loop: the
+MQTT sockets of every device are watched by the loop instead of one paho
+network thread per device, and environmental sensor data are requested
+with loop timers.
+"""
+
+# pylint: disable=invalid-overridden-method,too-many-ancestors,no-member
+# pylint: disable=attribute-defined-outside-init,protected-access
+
+import asyncio
+import logging
+import socket
+import threading
+
+import paho.mqtt.client as mqtt
+
+from .dyson_device import NetworkDevice, DEFAULT_PORT, \
+    DEFAULT_CONNECT_TIMEOUTS, set_connect_timeout
+from .dyson_360_eye import Dyson360Eye
+from .dyson_discovery import default_discovery
+from .dyson_pure_cool import DysonPureCool
+from .dyson_pure_cool_link import DysonPureCoolLink
+from .dyson_pure_hotcool import DysonPureHotCool
+from .dyson_pure_hotcool_link import DysonPureHotCoolLink
+from .dyson_scheduler import jittered
+from .exceptions import DysonConnectionException
+
+_LOGGER = logging.getLogger(__name__)
+
+# Interval in seconds between two calls of the paho housekeeping (keepalive)
+MISC_LOOP_INTERVAL = 1
+
+_CLOSED = object()
+
+
+class DysonMessageIterator:
+    """Asynchronous iterator over the messages received from a device."""
+
+    def __init__(self, device, maxsize=0):
+        """Create a new message iterator.
+
+        :param device: Asynchronous device
+        :param maxsize: Max number of pending messages. Oldest messages are
+                        dropped when full. Unbounded if 0.
+        """
+        self._device = device
+        self._queue = asyncio.Queue(maxsize)
+        self._closed = False
+        device.add_message_listener(self._put)
+
+    def _put(self, message):
+        """Queue a message, dropping the oldest one if full."""
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(message)
+
+    def close(self):
+        """Stop the iteration."""
+        if not self._closed:
+            self._closed = True
+            self._device.remove_message_listener(self._put)
+            self._put(_CLOSED)
+
+    def __aiter__(self):
+        """Return the iterator."""
+        return self
+
+    async def __anext__(self):
+        """Return the next message."""
+        if self._closed and self._queue.empty():
+            raise StopAsyncIteration
+        message = await self._queue.get()
+        if message is _CLOSED:
+            raise StopAsyncIteration
+        return message
+
+
+class AsyncDysonDevice:
+    # pylint: disable=too-many-instance-attributes
+    """Asyncio behaviour shared by asynchronous devices.
+
+    Must be placed before the Dyson device class in the bases.
+    """
+
+    @classmethod
+    def from_device(cls, device):
+        """Create an asynchronous device from a not connected device.
+
+        :param device: Device returned by DysonAccount.devices()
+        """
+        instance = cls.__new__(cls)
+        instance.__dict__.update(device.__dict__)
+        instance._init_async()
+        return instance
+
+    def __init__(self, json_body):
+        """Create a new asynchronous Dyson device.
+
+        :param json_body: JSON message returned by the HTTPS API
+        """
+        super().__init__(json_body)
+        self._init_async()
+
+    def _init_async(self):
+        """Initialize the asyncio attributes."""
+        self._loop = None
+        self._loop_thread = None
+        self._connection_future = None
+        self._state_available = None
+        self._sensor_available = None
+        self._misc_handle = None
+        self._publish_futures = {}
+        self._iterators = []
+
+    def messages(self, maxsize=0):
+        """Return an asynchronous iterator over received messages.
+
+        The iteration stops when the device is disconnected.
+
+        :param maxsize: Max number of pending messages. Oldest messages are
+                        dropped when full. Unbounded if 0.
+        """
+        iterator = DysonMessageIterator(self, maxsize)
+        self._iterators.append(iterator)
+        return iterator
+
+    def _create_mqtt_client(self, *args, **kwargs):
+        """Create a MQTT client driven by the event loop."""
+        client = super()._create_mqtt_client(*args, **kwargs)
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_publish = self._on_publish
+        return client
+
+    def _call_in_loop(self, function, *args):
+        """Call function in the event loop thread."""
+        if threading.get_ident() == self._loop_thread:
+            function(*args)
+        else:
+            self._loop.call_soon_threadsafe(function, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Watch the MQTT socket."""
+        self._call_in_loop(self._watch_socket, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Stop watching the MQTT socket."""
+        self._call_in_loop(self._unwatch_socket, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Wait for the MQTT socket to be writable."""
+        self._call_in_loop(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Stop waiting for the MQTT socket to be writable."""
+        self._call_in_loop(self._loop.remove_writer, sock)
+
+    def _watch_socket(self, sock):
+        """Read the MQTT socket from the event loop."""
+        # Commands are small messages, do not wait to group them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._loop.add_reader(sock, self._mqtt.loop_read)
+        self._misc_handle = self._loop.call_later(MISC_LOOP_INTERVAL,
+                                                  self._loop_misc)
+
+    def _unwatch_socket(self, sock):
+        """Remove the MQTT socket from the event loop."""
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+        if self._misc_handle is not None:
+            self._misc_handle.cancel()
+            self._misc_handle = None
+
+    def _loop_misc(self):
+        """Run the paho housekeeping (keepalive, retries)."""
+        if self._mqtt.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            self._misc_handle = self._loop.call_later(MISC_LOOP_INTERVAL,
+                                                      self._loop_misc)
+
+    def _on_publish(self, client, userdata, mid):
+        # pylint: disable=unused-argument
+        """Resolve the future of a published message."""
+        future = self._publish_futures.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    def _publication_future(self, info):
+        """Return a future resolved when a message is published.
+
+        The future result is True when the message was acknowledged, False
+        if it could not be sent.
+
+        :param info: Publication info, None if the message was not sent
+        """
+        loop = self._loop or asyncio.get_event_loop()
+        future = loop.create_future()
+        if info is None or info.rc != mqtt.MQTT_ERR_SUCCESS:
+            future.set_result(False)
+        elif info.is_published():
+            future.set_result(True)
+        else:
+            self._publish_futures[info.mid] = future
+        return future
+
+    def connection_callback(self, connected):
+        """Set function called when device is connected."""
+        future = self._connection_future
+        if future is not None and not future.done():
+            future.set_result(connected)
+
+    def state_data_available(self):
+        """Call when first state data are available. Internal method."""
+        _LOGGER.debug("State data available for device %s", self._serial)
+        self._state_available.set()
+
+    def sensor_data_available(self):
+        """Call when first sensor data are available. Internal method."""
+        _LOGGER.debug("Sensor data available for device %s", self._serial)
+        self._sensor_available.set()
+
+    @staticmethod
+    async def _wait_phase(awaitable, timeout, phase):
+        """Wait for a connection phase.
+
+        :param awaitable: Awaitable completed at the end of the phase
+        :param timeout: Timeout in seconds, None to wait forever
+        :param phase: Connection phase, raised on timeout
+        """
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise DysonConnectionException(phase, "timeout") from None
+
+    async def _open_mqtt_connection(self, timeouts):
+        """Open the MQTT connection and wait for the broker answer.
+
+        :param timeouts: ConnectTimeouts
+        :raise DysonConnectionException: if the connection is refused
+        """
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._connection_future = self._loop.create_future()
+        self._state_available = asyncio.Event()
+        self._sensor_available = asyncio.Event()
+        self._mqtt = self._create_mqtt_client()
+        set_connect_timeout(self._mqtt, timeouts.tcp)
+        # Only the TCP connection is blocking, run it out of the loop
+        await self._loop.run_in_executor(None, self._mqtt.connect,
+                                         self._network_device.address,
+                                         self._network_device.port)
+        connected = False
+        try:
+            connected = await self._wait_phase(
+                self._connection_future, timeouts.connack, "connack")
+        finally:
+            if not connected:
+                self._mqtt.disconnect()
+        if not connected:
+            raise DysonConnectionException("connack", "refused")
+
+    def _close_mqtt_connection(self):
+        """Close the MQTT connection and stop message iterators."""
+        self._connected = False
+        self._device_available = False
+        if self._mqtt is not None:
+            self._mqtt.disconnect()
+        for future in self._publish_futures.values():
+            if not future.done():
+                future.set_result(False)
+        self._publish_futures.clear()
+        for iterator in self._iterators:
+            iterator.close()
+        self._iterators = []
+
+
+class AsyncDysonPureCoolLink(AsyncDysonDevice, DysonPureCoolLink):
+    """Asynchronous Dyson Pure Cool Link device."""
+
+    def _init_async(self):
+        """Initialize the asyncio attributes."""
+        super()._init_async()
+        self._sensor_handle = None
+
+    async def auto_connect(self, timeout=5, retry=15, timeouts=None,
+                           discovery=None):
+        """Try to connect to device using mDNS.
+
+        :param timeout: Timeout
+        :param retry: Max retry
+        :param timeouts: ConnectTimeouts of the connection phases
+        :param discovery: AsyncDysonDiscovery searching the device in the
+                          event loop (default: discovery session shared by
+                          the process, run in an executor)
+        :return: True if connected, else False
+        """
+        if not await self._search_network_device(discovery, timeout, retry):
+            return False
+        if await self._mqtt_connect(timeouts):
+            return True
+        if not (discovery or default_discovery()).forget_cached(self._serial):
+            return False
+        # Address outdated, search the device on the network again
+        _LOGGER.info("Address of device %s outdated", self._serial)
+        if not await self._search_network_device(discovery, timeout, retry):
+            return False
+        return await self._mqtt_connect(timeouts)
+
+    async def _search_network_device(self, discovery, timeout, retry):
+        """Set the network device of the device using mDNS.
+
+        :param discovery: AsyncDysonDiscovery, or None to use the
+                          discovery session shared by the process
+        :return: True if found, else False
+        """
+        if discovery is None:
+            loop = asyncio.get_event_loop()
+            self._network_device = await loop.run_in_executor(
+                None, self._find_network_device, timeout, retry)
+        else:
+            self._network_device = await self._resolve_network_device(
+                discovery, timeout, retry)
+        if self._network_device is None:
+            _LOGGER.error("Unable to connect to device %s", self._serial)
+            return False
+        return True
+
+    async def _resolve_network_device(self, discovery, timeout, retry):
+        """Search the device on the local network using an async discovery.
+
+        :param discovery: AsyncDysonDiscovery
+        :param timeout: Timeout
+        :param retry: Max retry
+        :return: NetworkDevice if found, else None
+        """
+        for i in range(retry):
+            try:
+                network_device = await discovery.resolve(self._serial,
+                                                         timeout)
+            except OSError as error:
+                _LOGGER.error("Unable to search device %s: %s",
+                              self._serial, error)
+                return None
+            if network_device is not None:
+                return network_device
+            # Unable to find device
+            _LOGGER.warning("Unable to find device %s, try %s",
+                            self._serial, i)
+        return None
+
+    async def connect(self, device_ip, device_port=DEFAULT_PORT,
+                      timeouts=None):
+        """Connect to the device using ip address.
+
+        :param device_ip: Device IP address
+        :param device_port: Device Port (default: 1883)
+        :param timeouts: ConnectTimeouts of the connection phases
+        :return: True if connected, else False
+        """
+        self._network_device = NetworkDevice(self._name, device_ip,
+                                             device_port)
+        return await self._mqtt_connect(timeouts)
+
+    async def _mqtt_connect(self, timeouts=None):
+        """Connect to the MQTT broker.
+
+        :param timeouts: ConnectTimeouts (default: DEFAULT_CONNECT_TIMEOUTS)
+        :return: True if connected, else False
+        """
+        try:
+            await self._connect_phases(timeouts or DEFAULT_CONNECT_TIMEOUTS)
+        except (DysonConnectionException, OSError) as error:
+            _LOGGER.error("Unable to connect to device %s: %s",
+                          self._serial, error)
+            return False
+        return True
+
+    async def _connect_phases(self, timeouts):
+        """Connect to the MQTT broker and wait for the first data.
+
+        :param timeouts: ConnectTimeouts
+        :raise DysonConnectionException: if a phase fails
+        """
+        await self._open_mqtt_connection(timeouts)
+        self._connected = True
+        self.request_current_state()
+        self.request_environmental_state()
+        self._schedule_sensor_data()
+
+        # Wait for first data
+        try:
+            await self._wait_phase(self._state_available.wait(),
+                                   timeouts.state, "state")
+            await self._wait_phase(self._sensor_available.wait(),
+                                   timeouts.sensor, "sensor")
+        except DysonConnectionException:
+            await self.disconnect()
+            raise
+        self._device_available = True
+
+    def _schedule_sensor_data(self):
+        """Schedule the next environmental data request."""
+        self._sensor_handle = self._loop.call_later(
+            jittered(self.sensor_interval), self._request_sensor_data)
+
+    def _request_sensor_data(self):
+        """Request environmental data, then schedule the next request."""
+        self.request_environmental_state()
+        self._schedule_sensor_data()
+
+    async def disconnect(self):
+        """Disconnect from the device."""
+        if self._sensor_handle is not None:
+            self._sensor_handle.cancel()
+            self._sensor_handle = None
+        self._flush_commands()
+        self._close_mqtt_connection()
+        self._fail_state_sets()
+
+    def _call_later(self, delay, callback):
+        """Call callback in delay seconds from the event loop."""
+        loop = self._loop or asyncio.get_event_loop()
+        return loop.call_later(delay, callback)
+
+    def _command_future(self, future):
+        """Return an asyncio future of a fan command.
+
+        Fan commands (set_fan_configuration(), set_configuration() and the
+        methods using them) are awaitable: resolved with True when the
+        device confirms the configuration, False if it is not connected or
+        does not confirm within command_timeout seconds.
+
+        :param future: CommandFuture of the command
+        """
+        return asyncio.wrap_future(future,
+                                   loop=self._loop or asyncio.get_event_loop())
+
+
+class AsyncDysonPureHotCoolLink(AsyncDysonPureCoolLink, DysonPureHotCoolLink):
+    """Asynchronous Dyson Pure Hot+Cool Link device."""
+
+
+class AsyncDysonPureCool(AsyncDysonPureCoolLink, DysonPureCool):
+    """Asynchronous Dyson Pure Cool device."""
+
+
+class AsyncDysonPureHotCool(AsyncDysonPureCool, DysonPureHotCool):
+    """Asynchronous Dyson Pure Hot+Cool device."""
+
+
+class AsyncDyson360Eye(AsyncDysonDevice, Dyson360Eye):
+    """Asynchronous Dyson 360 Eye device."""
+
+    async def connect(self, device_ip, device_port=DEFAULT_PORT,
+                      timeouts=None):
+        """Try to connect to device.
+
+        :param device_ip: Device IP address
+        :param device_port: Device Port (default: 1883)
+        :param timeouts: ConnectTimeouts of the connection phases
+        :return: True if connected, else False
+        """
+        self._network_device = NetworkDevice(self._name, device_ip,
+                                             device_port)
+        try:
+            await self._connect_phases(timeouts or DEFAULT_CONNECT_TIMEOUTS)
+        except (DysonConnectionException, OSError) as error:
+            _LOGGER.error("Unable to connect to device %s: %s",
+                          self.serial, error)
+        return self._device_available
+
+    async def _connect_phases(self, timeouts):
+        """Connect to the MQTT broker and wait for the first data.
+
+        :param timeouts: ConnectTimeouts
+        :raise DysonConnectionException: if a phase fails
+        """
+        await self._open_mqtt_connection(timeouts)
+        self._connected = True
+        _LOGGER.info("Connected to device %s", self.serial)
+        self.request_current_state()
+
+        # Wait for first data
+        try:
+            await self._wait_phase(self._state_available.wait(),
+                                   timeouts.state, "state")
+        except DysonConnectionException:
+            await self.disconnect()
+            raise
+        self._device_available = True
+
+    async def disconnect(self):
+        """Disconnect from the device."""
+        self._close_mqtt_connection()
+
+    def _send_command(self, command, data=None):
+        """Send command to the device.
+
+        :param command Command to send (const.Dyson360EyeCommand)
+        :param data Data dictionary to send. Can be empty
+        :return: Future resolved with True when the command is
+                 acknowledged, False if it can not be sent
+        """
+        return self._publication_future(
+            super()._send_command(command, data))
+
+
+# Asynchronous classes of the devices returned by DysonAccount.devices()
+ASYNC_DEVICE_CLASSES = {
+    DysonPureCoolLink: AsyncDysonPureCoolLink,
+    DysonPureHotCoolLink: AsyncDysonPureHotCoolLink,
+    DysonPureCool: AsyncDysonPureCool,
+    DysonPureHotCool: AsyncDysonPureHotCool,
+    Dyson360Eye: AsyncDyson360Eye
+}
+
+
+def async_device(device):
+    """Return the asynchronous version of a not connected device.
+
+    :param device: Device returned by DysonAccount.devices()
+    """
+    return ASYNC_DEVICE_CLASSES[type(device)].from_device(device)
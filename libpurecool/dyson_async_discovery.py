@@ -0,0 +1,437 @@
+"""Asyncio Dyson devices discovery.
+
+Dyson devices are discovered by the running asyncio event loop: mDNS
+packets are received by a datagram protocol, and queries and cache expiry
+are run by loop timers instead of zeroconf threads. Discovery shares the
+event loop with asynchronous devices.
+"""
+
+import asyncio
+import logging
+import socket
+from collections import namedtuple
+
+from .dyson_device import NetworkDevice
+from .dyson_discovery import DYSON_SERVICE_TYPE, forget_service_records, \
+    service_serial
+from .zeroconf import DNSCache, DNSIncoming, DNSOutgoing, DNSQuestion, \
+    InterfaceChoice, ServiceStateChange, current_time_millis, new_socket, \
+    normalize_interface_choice, packet_mentions, _MDNS_ADDR, _MDNS_PORT, \
+    _TYPE_PTR, _TYPE_SRV, _TYPE_A, _CLASS_IN, _FLAGS_QR_QUERY
+
+_LOGGER = logging.getLogger(__name__)
+
+# Delays in seconds between two browse queries: first and max
+QUERY_DELAY = 0.5
+MAX_QUERY_DELAY = 20
+# Delay in seconds before asking for the details of a new service
+RESOLVE_DELAY = 0.2
+# Interval in seconds between two removals of expired records
+REAP_INTERVAL = 10
+
+# Service added or removed: state_change is a ServiceStateChange
+ServiceEvent = namedtuple('ServiceEvent',
+                          ['state_change', 'serial', 'network_device'])
+
+_CLOSED = object()
+
+
+class _MdnsProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol receiving mDNS packets."""
+
+    def __init__(self, discovery):
+        """Create a new protocol.
+
+        :param discovery: AsyncDysonDiscovery handling the packets
+        """
+        self._discovery = discovery
+
+    def datagram_received(self, data, addr):
+        """Handle a received packet."""
+        self._discovery._handle_packet(data)  # pylint: disable=W0212
+
+    def error_received(self, exc):
+        """Log socket errors."""
+        _LOGGER.debug("mDNS socket error: %s", exc)
+
+
+class ServiceEventIterator:
+    """Asynchronous iterator over the services added and removed."""
+
+    def __init__(self, discovery):
+        """Create a new event iterator.
+
+        :param discovery: AsyncDysonDiscovery
+        """
+        self._discovery = discovery
+        self._queue = asyncio.Queue()
+        self._closed = False
+
+    def _put(self, event):
+        """Queue an event."""
+        self._queue.put_nowait(event)
+
+    def close(self):
+        """Stop the iteration."""
+        if not self._closed:
+            self._closed = True
+            self._discovery._remove_iterator(self)  # pylint: disable=W0212
+            self._put(_CLOSED)
+
+    def __aiter__(self):
+        """Return the iterator."""
+        return self
+
+    async def __anext__(self):
+        """Return the next ServiceEvent."""
+        if self._closed and self._queue.empty():
+            raise StopAsyncIteration
+        event = await self._queue.get()
+        if event is _CLOSED:
+            raise StopAsyncIteration
+        return event
+
+
+class AsyncDysonDiscovery:
+    # pylint: disable=too-many-instance-attributes
+    """mDNS discovery of Dyson devices running on the asyncio event loop.
+
+    The Dyson MQTT service is browsed once started, and every service seen
+    is resolved to a NetworkDevice indexed by serial.
+    """
+
+    def __init__(self, service_type=DYSON_SERVICE_TYPE,
+                 interfaces=InterfaceChoice.All, cache=None):
+        """Create a new discovery.
+
+        :param service_type: mDNS service type of the devices
+        :param interfaces: InterfaceChoice or sequence of IP addresses
+        :param cache: DiscoveryCache saving the devices found
+        """
+        self._service_type = service_type
+        self._interfaces = interfaces
+        self._cache = cache
+        self._records = DNSCache()
+        self._unresolved = set()
+        self._services = {}
+        self._devices = {}
+        self._waiters = {}
+        self._iterators = []
+        self._loop = None
+        self._transport = None
+        self._starting = None
+        self._senders = []
+        self._handles = {}
+        self._query_delay = QUERY_DELAY
+        self._resolve_delay = RESOLVE_DELAY
+
+    @property
+    def devices(self):
+        """Network devices found, by serial."""
+        return dict(self._devices)
+
+    @property
+    def started(self):
+        """True if the service is being browsed."""
+        return self._transport is not None
+
+    async def start(self):
+        """Start browsing the service if not already started.
+
+        Concurrent calls share the same start.
+
+        :raise OSError: if no interface joined the mDNS multicast group
+        """
+        if self._transport is not None:
+            return
+        if self._starting is None:
+            self._loop = asyncio.get_event_loop()
+            self._starting = self._loop.create_task(self._open())
+            self._starting.add_done_callback(self._started)
+        await asyncio.shield(self._starting)
+
+    def _started(self, task):
+        """Forget the start task once done, successful or not."""
+        if self._starting is task:
+            self._starting = None
+
+    async def _open(self):
+        """Open the mDNS sockets and send the first query."""
+        interfaces = normalize_interface_choice(self._interfaces,
+                                                socket.AF_INET)
+        listen_socket = new_socket()
+        senders = []
+        try:
+            for interface in interfaces:
+                try:
+                    listen_socket.setsockopt(
+                        socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                        socket.inet_aton(_MDNS_ADDR) +
+                        socket.inet_aton(interface))
+                except OSError as error:
+                    _LOGGER.info("Unable to add %s to multicast group: %s",
+                                 interface, error)
+                    continue
+                sender = new_socket()
+                senders.append(sender)
+                sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                  socket.inet_aton(interface))
+                sender.setblocking(False)
+            if not senders:
+                raise OSError("No interface joined the mDNS multicast group")
+            transport, _ = await self._loop.create_datagram_endpoint(
+                lambda: _MdnsProtocol(self), sock=listen_socket)
+        except BaseException:
+            listen_socket.close()
+            for sender in senders:
+                sender.close()
+            raise
+        self._transport = transport
+        self._senders = senders
+        self._query()
+        self._schedule("reap", REAP_INTERVAL, self._reap)
+
+    def close(self):
+        """Stop browsing, forget the devices found and stop iterators."""
+        if self._starting is not None:
+            self._starting.cancel()
+            self._starting = None
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles.clear()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for sender in self._senders:
+            sender.close()
+        self._senders = []
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        self._waiters.clear()
+        for iterator in list(self._iterators):
+            iterator.close()
+        self._records = DNSCache()
+        self._unresolved.clear()
+        self._services.clear()
+        self._devices.clear()
+
+    async def __aenter__(self):
+        """Start browsing."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        """Stop browsing."""
+        self.close()
+
+    async def resolve(self, serial, timeout=None):
+        """Return the network device of a serial.
+
+        Devices seen by this discovery are returned first, then devices of
+        the cache. Other devices are searched on the network.
+
+        :param serial: Device serial
+        :param timeout: Max time in seconds to wait for the device if not
+                        already found (None: wait forever)
+        :return: NetworkDevice if found, else None
+        """
+        network_device = self._devices.get(serial)
+        if network_device is None and self._cache is not None:
+            network_device = self._cache.get(serial)
+        if network_device is not None:
+            return network_device
+        await self.start()
+        waiter = self._loop.create_future()
+        waiters = self._waiters.setdefault(serial, [])
+        waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+
+    def forget_cached(self, serial):
+        """Forget the address of a device, once found outdated.
+
+        The device is forgotten by this discovery and by the cache. A device
+        seen by this discovery is resolved again on the network: its
+        address may have changed since.
+
+        :param serial: Device serial
+        :return: True if an address was forgotten
+        """
+        forgotten = self._devices.pop(serial, None) is not None
+        if self._cache is not None:
+            forgotten = self._cache.remove(serial) or forgotten
+        names = [record.alias for record
+                 in self._records.entries_with_name(self._service_type)
+                 if self._is_service_pointer(record) and
+                 self._services.get(record.alias.lower()) == serial]
+        for name in names:
+            del self._services[name.lower()]
+            forget_service_records(self._records, name)
+            self._unresolved.add(name)
+        if names:
+            _LOGGER.info("Resolving device %s again", serial)
+            self._resolve_delay = RESOLVE_DELAY
+            self._schedule("resolve", 0, self._query_unresolved)
+        return forgotten
+
+    def services(self):
+        """Return an asynchronous iterator of ServiceEvent.
+
+        Services already found are iterated first, as added services. The
+        iteration stops when the discovery is closed.
+        """
+        iterator = ServiceEventIterator(self)
+        for serial, network_device in self._devices.items():
+            iterator._put(ServiceEvent(  # pylint: disable=W0212
+                ServiceStateChange.Added, serial, network_device))
+        self._iterators.append(iterator)
+        return iterator
+
+    def _remove_iterator(self, iterator):
+        if iterator in self._iterators:
+            self._iterators.remove(iterator)
+
+    def _notify(self, event):
+        for iterator in self._iterators:
+            iterator._put(event)  # pylint: disable=W0212
+
+    def _schedule(self, name, delay, callback):
+        handle = self._handles.get(name)
+        if handle is not None:
+            handle.cancel()
+        self._handles[name] = self._loop.call_later(delay, callback)
+
+    def _send(self, out):
+        packet = out.packet()
+        for sender in self._senders:
+            try:
+                sender.sendto(packet, (_MDNS_ADDR, _MDNS_PORT))
+            except OSError as error:
+                _LOGGER.debug("Unable to send mDNS query: %s", error)
+
+    def _add_resolve_questions(self, out):
+        """Ask for the details of the services not resolved yet."""
+        for name in self._unresolved:
+            service = self._records.get_by_details(name, _TYPE_SRV, _CLASS_IN)
+            if service is None:
+                out.add_question(DNSQuestion(name, _TYPE_SRV, _CLASS_IN))
+            else:
+                out.add_question(DNSQuestion(service.server, _TYPE_A,
+                                             _CLASS_IN))
+
+    def _query(self):
+        """Browse the service, with the services already known."""
+        now = current_time_millis()
+        out = DNSOutgoing(_FLAGS_QR_QUERY)
+        out.add_question(DNSQuestion(self._service_type, _TYPE_PTR,
+                                     _CLASS_IN))
+        for record in self._records.entries_with_name(self._service_type):
+            if record.type == _TYPE_PTR and not record.is_expired(now):
+                out.add_answer_at_time(record, now)
+        self._add_resolve_questions(out)
+        self._send(out)
+        self._schedule("query", self._query_delay, self._query)
+        self._query_delay = min(self._query_delay * 2, MAX_QUERY_DELAY)
+
+    def _query_unresolved(self):
+        """Ask again for the details of the services not resolved yet."""
+        self._handles.pop("resolve", None)
+        if not self._unresolved:
+            return
+        out = DNSOutgoing(_FLAGS_QR_QUERY)
+        self._add_resolve_questions(out)
+        self._send(out)
+        self._resolve_delay = min(self._resolve_delay * 2, MAX_QUERY_DELAY)
+        self._schedule("resolve", self._resolve_delay,
+                       self._query_unresolved)
+
+    def _is_service_pointer(self, record):
+        return record.type == _TYPE_PTR and \
+            record.key == self._service_type.lower()
+
+    def _interesting_names(self):
+        names = [self._service_type]
+        for name in self._unresolved:
+            names.append(name)
+            service = self._records.get_by_details(name, _TYPE_SRV, _CLASS_IN)
+            if service is not None:
+                names.append(service.server)
+        return names
+
+    def _handle_packet(self, data):
+        """Cache the records of a response and update the services."""
+        if not packet_mentions(data, self._interesting_names()):
+            return
+        msg = DNSIncoming(data)
+        if not msg.valid or msg.is_query():
+            return
+        now = current_time_millis()
+        for record in msg.answers:
+            cached = self._records.get(record)
+            if record.is_expired(now):
+                if cached is not None:
+                    self._records.remove(cached)
+                if self._is_service_pointer(record):
+                    self._remove_service(record.alias)
+            elif cached is not None:
+                cached.reset_ttl(record)
+            else:
+                self._records.add(record)
+                if self._is_service_pointer(record) and \
+                        record.alias.lower() not in self._services:
+                    self._unresolved.add(record.alias)
+        self._resolve_services()
+
+    def _resolve_services(self):
+        """Add the services whose address is known."""
+        for name in list(self._unresolved):
+            service = self._records.get_by_details(name, _TYPE_SRV, _CLASS_IN)
+            if service is None:
+                continue
+            address = self._records.get_by_details(service.server, _TYPE_A,
+                                                   _CLASS_IN)
+            if address is None:
+                continue
+            self._unresolved.discard(name)
+            serial = service_serial(name)
+            network_device = NetworkDevice(
+                serial, socket.inet_ntoa(address.address), service.port)
+            _LOGGER.debug("Device %s found at %s:%s", serial,
+                          network_device.address, network_device.port)
+            self._services[name.lower()] = serial
+            self._devices[serial] = network_device
+            if self._cache is not None:
+                self._cache.put(network_device)
+            for waiter in self._waiters.pop(serial, []):
+                if not waiter.done():
+                    waiter.set_result(network_device)
+            self._notify(ServiceEvent(ServiceStateChange.Added, serial,
+                                      network_device))
+        if self._unresolved and "resolve" not in self._handles:
+            self._resolve_delay = RESOLVE_DELAY
+            self._schedule("resolve", self._resolve_delay,
+                           self._query_unresolved)
+
+    def _remove_service(self, name):
+        """Forget a service no longer on the network."""
+        _LOGGER.info("Service %s removed", name)
+        self._unresolved.discard(name)
+        serial = self._services.pop(name.lower(), None)
+        if serial is not None:
+            network_device = self._devices.pop(serial, None)
+            self._notify(ServiceEvent(ServiceStateChange.Removed, serial,
+                                      network_device))
+
+    def _reap(self):
+        """Remove the expired records."""
+        for record in self._records.expire(current_time_millis()):
+            if self._is_service_pointer(record):
+                self._remove_service(record.alias)
+        self._schedule("reap", REAP_INTERVAL, self._reap)
@@ -0,0 +1,221 @@
+"""Fan configuration commands.
+
+Configurations sent within a short window are merged and published as one
+STATE-SET message, and the messages published to a device are rate
+limited. Automations changing several settings at once send one message
+instead of one per setting.
+
+Commands return a CommandFuture, resolved when the device confirms the
+configuration.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+_LOGGER = logging.getLogger(__name__)
+
+# Default time in seconds configurations are merged before being published
+COALESCE_WINDOW = 0.05
+# Default time in seconds commands wait for the confirmation of the device
+COMMAND_TIMEOUT = 10
+
+
+class CommandFuture(Future):
+    """Future of a fan configuration.
+
+    Resolved with True when a STATE-CHANGE message reports the new values,
+    False if the configuration could not be sent or was not confirmed in
+    time. info is the MQTT publication info, None until published.
+    """
+
+    def __init__(self):
+        """Create a new command future."""
+        super().__init__()
+        self.info = None
+
+
+class _Handle:
+    # pylint: disable=too-few-public-methods
+    """Callback scheduled by call_later."""
+
+    __slots__ = ('callback', 'cancelled')
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the call."""
+        self.cancelled = True
+
+
+class _TimerThread:
+    # pylint: disable=too-few-public-methods
+    """One thread calling every callback scheduled by call_later."""
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, callback):
+        """Schedule a callback, starting the thread on first use."""
+        handle = _Handle(callback)
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay,
+                                        next(self._sequence), handle))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="DysonTimer", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return handle
+
+    def _next_handle(self):
+        """Wait for the next callback due."""
+        with self._condition:
+            while True:
+                timeout = None
+                if self._heap:
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        return heapq.heappop(self._heap)[2]
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            handle = self._next_handle()
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error in timer callback")
+
+
+_TIMER = _TimerThread()
+
+
+def call_later(delay, callback):
+    """Call callback from the timer thread in delay seconds.
+
+    Callbacks of every device are called by one thread: they must not
+    block.
+
+    :param delay: Delay in seconds
+    :param callback: Function without argument
+    :return: Handle, cancelled with cancel()
+    """
+    return _TIMER.call_later(delay, callback)
+
+
+class CommandBuffer:
+    # pylint: disable=too-many-instance-attributes
+    """Pending configurations of a device, merged and rate limited.
+
+    The first configuration buffered starts a window of window seconds:
+    configurations buffered until its end are merged, later values of a
+    field replacing earlier ones, and published together. With max_rate,
+    publications are also spaced by at least 1 / max_rate seconds, pending
+    configurations being merged meanwhile.
+    """
+
+    def __init__(self, publish, window=COALESCE_WINDOW, max_rate=None,
+                 timer=call_later):
+        """Create a new command buffer.
+
+        :param publish: Function publishing a configuration (data dict)
+                        confirmed by expected values (dict), returning
+                        its CommandFuture, resolved when a STATE-CHANGE
+                        message confirms the configuration
+        :param window: Time in seconds configurations are merged
+        :param max_rate: Max publications per second (None: no limit)
+        :param timer: Function calling a callback in a delay in seconds,
+                      returning a handle with cancel()
+        """
+        self._publish = publish
+        self._window = window
+        self._interval = 1.0 / max_rate if max_rate else 0
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._data = {}
+        self._expected = {}
+        self._futures = []
+        self._handle = None
+        self._last_publication = None
+
+    @property
+    def pending(self):
+        """Configuration waiting to be published."""
+        with self._lock:
+            return dict(self._data)
+
+    def submit(self, data, expected=None):
+        """Buffer a configuration.
+
+        Values of data not expected, like values completed from the
+        current state, do not replace values expected by a previous
+        configuration.
+
+        :param data: Configuration fields
+        :param expected: Values confirming the configuration (default: data)
+        :return: Future resolved with the CommandFuture returned by
+                 publish for the merged configuration, failed with the
+                 exception raised by publish, cancelled by cancel()
+        """
+        if expected is None:
+            expected = data
+        future = Future()
+        with self._lock:
+            for key, value in data.items():
+                if key in expected or key not in self._expected:
+                    self._data[key] = value
+            self._expected.update(expected)
+            self._futures.append(future)
+            if self._handle is None:
+                now = time.monotonic()
+                delay = self._window
+                if self._last_publication is not None:
+                    delay = max(delay, self._last_publication +
+                                self._interval - now)
+                self._handle = self._timer(delay, self.flush)
+        return future
+
+    def flush(self):
+        """Publish the pending configuration now."""
+        with self._lock:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            data, self._data = self._data, {}
+            expected, self._expected = self._expected, {}
+            futures, self._futures = self._futures, []
+            if not futures:
+                return
+            self._last_publication = time.monotonic()
+        try:
+            info = self._publish(data, expected)
+        except Exception as error:  # pylint: disable=broad-except
+            _LOGGER.exception("Unable to publish configuration %s", data)
+            for future in futures:
+                future.set_exception(error)
+            return
+        for future in futures:
+            future.set_result(info)
+
+    def cancel(self):
+        """Drop the pending configuration."""
+        with self._lock:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+            self._data = {}
+            self._expected = {}
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
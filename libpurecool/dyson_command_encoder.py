@@ -0,0 +1,245 @@
+"""STATE-SET payloads encoding.
+
+set_configuration() sends a full configuration of the fan: every field is
+either given or taken from the current state. A CommandEncoder is compiled
+once per device model: the JSON of the keys and of the enumeration values
+is rendered in advance, and payloads are rendered as bytes by joining these
+pieces, without building the configuration dict nor calling json.dumps.
+"""
+
+# pylint: disable=too-few-public-methods
+
+import json
+import time
+from functools import lru_cache
+
+STET = "STET"
+
+_PREFIX = b'{"msg": "STATE-SET", "time": "'
+_DATA = b'", "mode-reason": "LAPP", "data": '
+_SUFFIX = b'}'
+
+_MESSAGE_TIME = (None, b"")
+
+
+def message_time():
+    """Return the time of the messages sent now, as bytes.
+
+    Rendered once per second.
+    """
+    global _MESSAGE_TIME  # pylint: disable=global-statement
+    second = int(time.time())
+    cached = _MESSAGE_TIME
+    if cached[0] != second:
+        cached = (second, time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                        time.gmtime(second)).encode("ascii"))
+        _MESSAGE_TIME = cached
+    return cached[1]
+
+
+@lru_cache(maxsize=1024, typed=True)
+def encode_value(value):
+    """Return the JSON of a field value, as bytes."""
+    return json.dumps(value).encode("utf-8")
+
+
+def state_set_payload(data, timestamp=None):
+    """Return the JSON payload of a STATE-SET message, as bytes.
+
+    :param data: Data to send
+    :param timestamp: Message time as returned by message_time()
+                      (default: now)
+    """
+    return b"".join((_PREFIX, timestamp or message_time(), _DATA,
+                     json.dumps(data).encode("utf-8"), _SUFFIX))
+
+
+class EnumField:
+    """Field set with an enumeration member, else taken from the state."""
+
+    __slots__ = ('key', 'argument', 'state', '_enum', '_values',
+                 '_rendered')
+
+    def __init__(self, key, argument, enum, state=None):
+        """Create a new enumeration field.
+
+        :param key: Product-state field (ex. "fnsp")
+        :param argument: set_configuration() argument (ex. "fan_speed")
+        :param enum: Enumeration of the argument values
+        :param state: State property used when the argument is missing
+                      ("STET" if None)
+        """
+        self.key = key
+        self.argument = argument
+        self.state = state
+        self._enum = enum
+        # Validated and rendered once
+        self._values = {member: member.value for member in enum}
+        self._rendered = {member.value: encode_value(member.value)
+                          for member in enum}
+
+    def given(self, kwargs):
+        """Return True if the arguments set the field.
+
+        :param kwargs: set_configuration() arguments
+        """
+        return bool(kwargs.get(self.argument))
+
+    def value(self, kwargs, state):
+        """Return the field value.
+
+        :param kwargs: set_configuration() arguments
+        :param state: Current state of the device
+        """
+        argument = kwargs.get(self.argument)
+        if argument:
+            value = self._values.get(argument)
+            if value is None:
+                raise TypeError("{0} must be a {1} enumeration".format(
+                    self.argument, self._enum.__name__))
+            return value
+        if self.state is None:
+            return STET
+        return getattr(state, self.state)
+
+    def render(self, value):
+        """Return the JSON of a value."""
+        return self._rendered.get(value) or encode_value(value)
+
+
+class ValueField:
+    """Field set with a free value, else taken from the state."""
+
+    __slots__ = ('key', 'argument', 'state', '_convert', '_zero')
+
+    def __init__(self, key, argument, state=None, convert=None, zero=False):
+        """Create a new value field.
+
+        :param key: Product-state field (ex. "sltm")
+        :param argument: set_configuration() argument (ex. "sleep_timer")
+        :param state: State property used when the argument is missing
+                      ("STET" if None)
+        :param convert: Function converting the argument to the value
+        :param zero: True if integer 0 is a value instead of missing
+        """
+        self.key = key
+        self.argument = argument
+        self.state = state
+        self._convert = convert
+        self._zero = zero
+
+    def given(self, kwargs):
+        """Return True if the arguments set the field.
+
+        :param kwargs: set_configuration() arguments
+        """
+        argument = kwargs.get(self.argument)
+        return bool(argument) or (self._zero and isinstance(argument, int))
+
+    def value(self, kwargs, state):
+        """Return the field value.
+
+        :param kwargs: set_configuration() arguments
+        :param state: Current state of the device
+        """
+        if self.given(kwargs):
+            argument = kwargs[self.argument]
+            return self._convert(argument) if self._convert else argument
+        if self.state is None:
+            return STET
+        return getattr(state, self.state)
+
+    @staticmethod
+    def render(value):
+        """Return the JSON of a value."""
+        return encode_value(value)
+
+
+class ConstantField:
+    """Field always sent with the same value."""
+
+    __slots__ = ('key', '_value', '_rendered')
+
+    def __init__(self, key, value):
+        """Create a new constant field.
+
+        :param key: Product-state field (ex. "ancp")
+        :param value: Field value
+        """
+        self.key = key
+        self._value = value
+        self._rendered = encode_value(value)
+
+    @staticmethod
+    def given(kwargs):
+        # pylint: disable=unused-argument
+        """Return False: the field is not set by arguments."""
+        return False
+
+    def value(self, kwargs, state):
+        # pylint: disable=unused-argument
+        """Return the field value."""
+        return self._value
+
+    def render(self, value):
+        # pylint: disable=unused-argument
+        """Return the JSON of the value."""
+        return self._rendered
+
+
+class CommandEncoder:
+    """STATE-SET payloads of set_configuration() for a device model."""
+
+    def __init__(self, fields):
+        """Compile an encoder.
+
+        :param fields: EnumField, ValueField and ConstantField in payload
+                       order
+        """
+        self.fields = tuple(fields)
+        # Keys rendered with their separators: '{"fmod": ', ', "fnsp": '...
+        self._keys = tuple(
+            (b"{" if index == 0 else b", ") + encode_value(field.key) +
+            b": " for index, field in enumerate(self.fields))
+
+    def data(self, kwargs, state):
+        """Return the configuration as a dict.
+
+        :param kwargs: set_configuration() arguments
+        :param state: Current state of the device
+        """
+        return {field.key: field.value(kwargs, state)
+                for field in self.fields}
+
+    def given(self, kwargs, data):
+        """Return the values of a configuration set by the arguments.
+
+        Other values are taken from the current state: they do not tell
+        whether the device applied the configuration.
+
+        :param kwargs: set_configuration() arguments
+        :param data: Configuration returned by data()
+        """
+        return {field.key: data[field.key] for field in self.fields
+                if field.given(kwargs)}
+
+    def encode(self, kwargs, state, timestamp=None):
+        """Return the payload of a configuration and its values.
+
+        :param kwargs: set_configuration() arguments
+        :param state: Current state of the device
+        :param timestamp: Message time as returned by message_time()
+                          (default: now)
+        :return: (payload bytes, (field, value) pairs set by the
+                 arguments)
+        """
+        parts = [_PREFIX, timestamp or message_time(), _DATA]
+        values = []
+        for key, field in zip(self._keys, self.fields):
+            value = field.value(kwargs, state)
+            parts.append(key)
+            parts.append(field.render(value))
+            if field.given(kwargs):
+                values.append((field.key, value))
+        parts.append(b"}}")
+        return b"".join(parts), values
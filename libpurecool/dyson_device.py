@@ -2,14 +2,18 @@
 
 # pylint: disable=too-many-public-methods,too-many-instance-attributes
 
-from queue import Queue
+from collections import namedtuple
+from queue import Queue, Empty
 import logging
 import json
 import abc
 import time
 
+import paho.mqtt.client as mqtt
+
 from .utils import printable_fields
-from .utils import decrypt_password
+from .utils import decrypt_passwords
+from .exceptions import DysonConnectionException
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -24,6 +28,42 @@ MQTT_RETURN_CODES = {
 
 DEFAULT_PORT = 1883
 
+# Timeouts in seconds of the connection phases: TCP connection, MQTT
+# connection answer, first state and first environmental data
+ConnectTimeouts = namedtuple('ConnectTimeouts',
+                             ['tcp', 'connack', 'state', 'sensor'])
+DEFAULT_CONNECT_TIMEOUTS = ConnectTimeouts(tcp=10, connack=10, state=30,
+                                           sensor=30)
+
+
+def set_connect_timeout(client, timeout):
+    """Set the TCP connection timeout of a MQTT client.
+
+    :param client: paho MQTT client, not connected
+    :param timeout: Timeout in seconds
+    """
+    if hasattr(type(client), "connect_timeout"):
+        client.connect_timeout = timeout
+    else:
+        # paho-mqtt < 2.0 has no public accessor
+        client._connect_timeout = timeout  # pylint: disable=protected-access
+
+
+def decrypt_credentials(devices):
+    """Decrypt the credentials of many devices at once.
+
+    Devices whose credentials are already decrypted are skipped. The
+    credentials of a device stay None if they cannot be decrypted.
+
+    :param devices: Devices returned by DysonAccount.devices()
+    """
+    # pylint: disable=protected-access
+    devices = [device for device in devices if device._credentials is None]
+    passwords = decrypt_passwords([device._encrypted_credentials
+                                   for device in devices])
+    for device, password in zip(devices, passwords):
+        device._credentials = password
+
 
 class NetworkDevice:
     """Network device."""
@@ -90,7 +130,9 @@ class DysonDevice:
         self._serial = json_body['Serial']
         self._name = json_body['Name']
         self._version = json_body['Version']
-        self._credentials = decrypt_password(json_body['LocalCredentials'])
+        # Decrypted when first used, usually when connecting
+        self._encrypted_credentials = json_body['LocalCredentials']
+        self._credentials = None
         self._auto_update = json_body['AutoUpdate']
         self._new_version_available = json_body['NewVersionAvailable']
         self._product_type = json_body['ProductType']
@@ -98,6 +140,7 @@ class DysonDevice:
         self._connected = False
         self._mqtt = None
         self._callback_message = []
+        self._state_change_listeners = []
         self._device_available = False
         self._current_state = None
         self._state_data_available = Queue()
@@ -105,10 +148,60 @@ class DysonDevice:
         self._search_device_queue = Queue()
         self._connection_queue = Queue()
 
+    def _create_mqtt_client(self, protocol=mqtt.MQTTv311):
+        """Create the MQTT client used to communicate with the device.
+
+        :param protocol: MQTT protocol version
+        """
+        client = mqtt.Client(userdata=self, protocol=protocol)
+        client.username_pw_set(self._serial, self.credentials)
+        client.on_message = self.on_message  # pylint: disable=no-member
+        client.on_connect = self.on_connect
+        return client
+
     def connection_callback(self, connected):
         """Set function called when device is connected."""
         self._connection_queue.put_nowait(connected)
 
+    def _start_mqtt_client(self, timeouts):
+        """Connect the MQTT client and wait for the connection answer.
+
+        :param timeouts: ConnectTimeouts
+        """
+        self._mqtt = self._create_mqtt_client()
+        set_connect_timeout(self._mqtt, timeouts.tcp)
+        self._mqtt.connect(self._network_device.address,
+                           self._network_device.port)
+        self._mqtt.loop_start()
+        connected = False
+        try:
+            connected = self._wait_for(self._connection_queue,
+                                       timeouts.connack, "connack")
+        finally:
+            if not connected:
+                self._mqtt.loop_stop()
+        if not connected:
+            raise DysonConnectionException("connack", "refused")
+
+    def _stop_mqtt_client(self):
+        """Stop the MQTT client after a failed connection."""
+        self._connected = False
+        self._mqtt.loop_stop()
+        self._mqtt.disconnect()
+
+    @staticmethod
+    def _wait_for(queue, timeout, phase):
+        """Return the next value of queue.
+
+        :param queue: Queue
+        :param timeout: Timeout in seconds, None to wait forever
+        :param phase: Connection phase, raised on timeout
+        """
+        try:
+            return queue.get(timeout=timeout)
+        except Empty:
+            raise DysonConnectionException(phase, "timeout") from None
+
     @abc.abstractmethod
     def connect(self, device_ip, device_port=DEFAULT_PORT):
         """Connect to the device using ip address.
@@ -143,6 +236,30 @@ class DysonDevice:
                 "Unable to send commands because device %s is not connected",
                 self.serial)
 
+    def update_manifest(self, json_body):
+        """Update the device with a newer entry of the account manifest.
+
+        Only the fields the cloud changes are updated: activity, name,
+        version, auto update and credentials.
+
+        :param json_body: JSON message returned by the HTTPS API
+        :return: True if a field changed, else False
+        """
+        fields = (json_body.get('Active'), json_body['Name'],
+                  json_body['Version'], json_body['AutoUpdate'],
+                  json_body['NewVersionAvailable'],
+                  json_body['LocalCredentials'])
+        current = (self._active, self._name, self._version,
+                   self._auto_update, self._new_version_available,
+                   self._encrypted_credentials)
+        if fields == current:
+            return False
+        if self._encrypted_credentials != json_body['LocalCredentials']:
+            self._credentials = None
+        self._active, self._name, self._version, self._auto_update, \
+            self._new_version_available, self._encrypted_credentials = fields
+        return True
+
     @property
     def state(self):
         """Device state."""
@@ -175,7 +292,12 @@ class DysonDevice:
 
     @property
     def credentials(self):
-        """Device encrypted credentials."""
+        """Device credentials, decrypted when first used.
+
+        None if the credentials cannot be decrypted.
+        """
+        if self._credentials is None:
+            decrypt_credentials([self])
         return self._credentials
 
     @property
@@ -223,6 +345,41 @@ class DysonDevice:
         """Clear all message listener."""
         self.callback_message.clear()
 
+    def add_state_change_listener(self, callback, fields=None):
+        """Add a listener called when state fields change.
+
+        The callback is called with the new state and the list of
+        dyson_state.StateChange (field, old, new) of the watched fields.
+
+        :param callback: Callback function
+        :param fields: Product-state fields to watch (ex. ["fnsp", "hmod"]).
+                       Every field if None.
+        """
+        self._state_change_listeners.append(
+            (callback, frozenset(fields) if fields is not None else None))
+
+    def remove_state_change_listener(self, callback):
+        """Remove a state change listener."""
+        self._state_change_listeners = [
+            listener for listener in self._state_change_listeners
+            if listener[0] != callback]
+
+    def notify_state_changes(self, state, changes):
+        """Call state change listeners. Internal method.
+
+        :param state: New state
+        :param changes: List of dyson_state.StateChange
+        """
+        if not changes:
+            return
+        for callback, fields in self._state_change_listeners:
+            if fields is None:
+                callback(state, changes)
+                continue
+            watched = [change for change in changes if change.field in fields]
+            if watched:
+                callback(state, watched)
+
     @property
     def device_available(self):
         """Return True if device is fully available, else false."""
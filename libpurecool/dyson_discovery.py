@@ -0,0 +1,345 @@
+"""Dyson devices discovery on the local network.
+
+One mDNS session browses the Dyson MQTT service for every device of the
+process and indexes discovered devices by serial. Addresses found can be
+saved on disk to find devices without mDNS after a restart.
+"""
+
+import json
+import logging
+import os
+import socket
+import time
+from functools import partial
+from threading import Condition, Lock
+
+from .dyson_device import NetworkDevice
+from .zeroconf import DNSAddress, DNSService, ServiceBrowser, Zeroconf
+
+_LOGGER = logging.getLogger(__name__)
+
+DYSON_SERVICE_TYPE = "_dyson_mqtt._tcp.local."
+# Default time in seconds a saved device address is used
+CACHE_TTL = 24 * 3600
+# Time in seconds services added are collected before being resolved
+RESOLVE_DELAY = 0.2
+
+_DEFAULT_DISCOVERY = None
+_DEFAULT_DISCOVERY_LOCK = Lock()
+
+
+def default_discovery():
+    """Return the discovery session shared by devices of the process."""
+    global _DEFAULT_DISCOVERY  # pylint: disable=global-statement
+    with _DEFAULT_DISCOVERY_LOCK:
+        if _DEFAULT_DISCOVERY is None:
+            _DEFAULT_DISCOVERY = DysonDiscovery()
+        return _DEFAULT_DISCOVERY
+
+
+def service_serial(name):
+    """Return the device serial of a service name.
+
+    :param name: Service name (<product type>_<serial>.<service type>)
+    """
+    return (name.split(".")[0]).split("_")[1]
+
+
+def forget_service_records(cache, name):
+    """Remove the records of a service and of its host from a DNS cache.
+
+    The service is then resolved again by queries instead of the cache.
+
+    :param cache: zeroconf DNSCache
+    :param name: Service name
+    """
+    for record in list(cache.entries_with_name(name)):
+        if isinstance(record, DNSService):
+            for address in list(cache.entries_with_name(record.server)):
+                if isinstance(address, DNSAddress):
+                    cache.remove(address)
+        cache.remove(record)
+
+
+class DiscoveryCache:
+    """Device addresses saved on disk.
+
+    Each address is saved with the time it was last seen on the network
+    and is used for ttl seconds.
+    """
+
+    def __init__(self, path, ttl=CACHE_TTL):
+        """Create a new cache, loading the addresses already saved.
+
+        :param path: JSON file path
+        :param ttl: Time in seconds an address is used after it was seen
+        """
+        self._path = os.path.expanduser(path)
+        self._ttl = ttl
+        self._lock = Lock()
+        self._entries = self._load()
+
+    @property
+    def path(self):
+        """JSON file path."""
+        return self._path
+
+    def get(self, serial):
+        """Return the saved network device of a serial.
+
+        :param serial: Device serial
+        :return: NetworkDevice, None if unknown or expired
+        """
+        with self._lock:
+            entry = self._entries.get(serial)
+        if entry is None or \
+                time.time() > entry["last_seen"] + entry["ttl"]:
+            return None
+        return NetworkDevice(serial, entry["address"], entry["port"])
+
+    def put(self, network_device):
+        """Save the network device of a device seen now.
+
+        :param network_device: NetworkDevice named after the device serial
+        """
+        with self._lock:
+            self._entries[network_device.name] = {
+                "address": network_device.address,
+                "port": network_device.port,
+                "last_seen": time.time(),
+                "ttl": self._ttl
+            }
+            self._save()
+
+    def remove(self, serial):
+        """Remove the saved network device of a serial.
+
+        :param serial: Device serial
+        :return: True if removed, False if unknown
+        """
+        with self._lock:
+            if self._entries.pop(serial, None) is None:
+                return False
+            self._save()
+        return True
+
+    def _load(self):
+        """Return the entries saved on disk, without the expired ones."""
+        try:
+            with open(self._path, encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            _LOGGER.warning("Unable to read discovery cache %s: %s",
+                            self._path, error)
+            return {}
+        now = time.time()
+        return {serial: entry for serial, entry in entries.items()
+                if now <= entry["last_seen"] + entry["ttl"]}
+
+    def _save(self):
+        """Write the entries on disk."""
+        directory = os.path.dirname(self._path)
+        temporary_path = self._path + ".tmp"
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(temporary_path, self._path)
+        except OSError as error:
+            _LOGGER.warning("Unable to write discovery cache %s: %s",
+                            self._path, error)
+
+
+class DysonDiscovery:
+    # pylint: disable=too-many-instance-attributes
+    """Long-lived mDNS discovery session.
+
+    The Dyson MQTT service is browsed once, when the first device is
+    searched, and every device seen on the network is indexed by serial:
+    devices already seen are found without waiting. With a cache, devices
+    seen by a previous session are found without browsing.
+    """
+
+    def __init__(self, service_type=DYSON_SERVICE_TYPE, cache=None):
+        """Create a new discovery session.
+
+        :param service_type: mDNS service type of the devices
+        :param cache: DiscoveryCache saving the devices found
+        """
+        self._service_type = service_type
+        self._cache = cache
+        self._devices = {}
+        self._names = {}
+        self._unresolved = []
+        self._condition = Condition()
+        self._zeroconf = None
+        self._browser = None
+
+    @property
+    def cache(self):
+        """Cache saving the devices found, None if not saved."""
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        """Set the cache saving the devices found."""
+        self._cache = value
+
+    @property
+    def devices(self):
+        """Network devices found, by serial."""
+        with self._condition:
+            return dict(self._devices)
+
+    @property
+    def browsing(self):
+        """True if the service is being browsed."""
+        return self._browser is not None
+
+    def start(self):
+        """Start browsing the service if not already started."""
+        with self._condition:
+            if self._browser is None:
+                # Packets without Dyson services are dropped undecoded
+                self._zeroconf = Zeroconf(filter_packets=True)
+                self._browser = ServiceBrowser(
+                    self._zeroconf, self._service_type, listener=self)
+
+    def close(self):
+        """Stop browsing and forget the devices found."""
+        with self._condition:
+            zeroconf, self._zeroconf = self._zeroconf, None
+            self._browser = None
+            self._devices.clear()
+            self._names.clear()
+            self._unresolved = []
+        if zeroconf is not None:
+            zeroconf.close()
+
+    def find(self, serial, timeout=None):
+        """Return the network device of a serial.
+
+        Devices seen by this session are returned first, then devices of
+        the cache. Other devices are searched on the network.
+
+        :param serial: Device serial
+        :param timeout: Max time in seconds to wait for the device if not
+                        already found (None: wait forever)
+        :return: NetworkDevice if found, else None
+        """
+        with self._condition:
+            network_device = self._devices.get(serial)
+            if network_device is not None:
+                return network_device
+            if self._cache is not None:
+                network_device = self._cache.get(serial)
+                if network_device is not None:
+                    return network_device
+        self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while serial not in self._devices:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                self._condition.wait(remaining)
+            return self._devices[serial]
+
+    def forget_cached(self, serial):
+        """Forget the address of a device, once found outdated.
+
+        The device is forgotten by this session and by the cache. A device
+        seen by this session is resolved again on the network: its address
+        may have changed since.
+
+        :param serial: Device serial
+        :return: True if an address was forgotten
+        """
+        with self._condition:
+            forgotten = self._devices.pop(serial, None) is not None
+            name = self._names.pop(serial, None)
+            zeroconf = self._zeroconf
+            if self._cache is not None:
+                forgotten = self._cache.remove(serial) or forgotten
+        if name is not None and zeroconf is not None:
+            _LOGGER.info("Resolving device %s again", serial)
+            forget_service_records(zeroconf.cache, name)
+            self.add_service(zeroconf, self._service_type, name)
+        return forgotten
+
+    def add_service(self, zeroconf, service_type, name):
+        """Index a discovered device.
+
+        Services added within RESOLVE_DELAY seconds, like the answers of
+        many devices to one query, are resolved at once by the zeroconf
+        engine thread.
+
+        :param zeroconf: MSDNS object
+        :param service_type: Service type
+        :param name: Service name
+        """
+        with self._condition:
+            self._unresolved.append(name)
+            if len(self._unresolved) > 1:
+                # Already scheduled
+                return
+        zeroconf.engine.call_later(
+            RESOLVE_DELAY * 1000,
+            partial(self._resolve_services, zeroconf, service_type))
+
+    def _resolve_services(self, zeroconf, service_type):
+        """Resolve the services added and index their devices.
+
+        :param zeroconf: MSDNS object
+        :param service_type: Service type
+        """
+        with self._condition:
+            names, self._unresolved = self._unresolved, []
+        zeroconf.request_service_infos(service_type, names,
+                                       self._resolved_services,
+                                       handler=self._index_service)
+
+    @staticmethod
+    def _resolved_services(infos):
+        """Log the services which could not be resolved.
+
+        :param infos: Service information by name, None if not resolved
+        """
+        for name, info in infos.items():
+            if info is None:
+                _LOGGER.warning("Unable to resolve service %s", name)
+
+    def _index_service(self, info):
+        """Index the device of a resolved service.
+
+        :param info: Service information
+        """
+        serial = service_serial(info.name)
+        network_device = NetworkDevice(serial, socket.inet_ntoa(info.address),
+                                       info.port)
+        _LOGGER.debug("Device %s found at %s:%s", serial,
+                      network_device.address, network_device.port)
+        with self._condition:
+            self._devices[serial] = network_device
+            self._names[serial] = info.name
+            if self._cache is not None:
+                self._cache.put(network_device)
+            self._condition.notify_all()
+
+    def remove_service(self, zeroconf, service_type, name):
+        # pylint: disable=unused-argument
+        """Forget a device no longer on the network.
+
+        :param zeroconf: MSDNS object
+        :param service_type: Service type
+        :param name: Service name
+        """
+        _LOGGER.info("Service %s removed", name)
+        with self._condition:
+            self._devices.pop(service_serial(name), None)
+            self._names.pop(service_serial(name), None)
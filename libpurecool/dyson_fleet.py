@@ -0,0 +1,571 @@
+"""Dyson fleet.
+
+Manage the MQTT connections of many devices with a single network thread
+and a bounded pool of threads running the message callbacks, instead of
+one paho network thread per device.
+"""
+
+# pylint: disable=protected-access,too-few-public-methods
+# pylint: disable=too-many-instance-attributes
+
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from threading import Thread, Lock, get_ident
+
+import paho.mqtt.client as mqtt
+
+from .dyson_device import NetworkDevice, DEFAULT_PORT, \
+    DEFAULT_CONNECT_TIMEOUTS, decrypt_credentials, set_connect_timeout
+from .dyson_discovery import default_discovery
+from .dyson_command_encoder import message_time, state_set_payload
+from .dyson_pure_cool_link import DysonPureCoolLink
+from .dyson_scheduler import default_scheduler
+from .exceptions import DysonConnectionException
+
+_LOGGER = logging.getLogger(__name__)
+
+# Interval in seconds between two calls of the paho housekeeping (keepalive)
+MISC_LOOP_INTERVAL = 1
+# Max number of messages handled for a device before yielding the worker
+MESSAGE_BATCH_SIZE = 10
+# Default time in seconds broadcast configurations wait for confirmation
+BROADCAST_TIMEOUT = 10
+
+
+class _Timer:
+    """Function call scheduled by the network loop."""
+
+    __slots__ = ('when', 'function', 'args', 'cancelled')
+
+    def __init__(self, when, function, args):
+        self.when = when
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the call."""
+        self.cancelled = True
+
+
+class NetworkLoop(Thread):
+    """Selector loop driving the sockets of many MQTT clients."""
+
+    def __init__(self):
+        """Create a new network loop thread."""
+        super().__init__(name="DysonNetworkLoop", daemon=True)
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._calls = deque()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._running = True
+        self._stop_deadline = None
+
+    def call(self, function, *args):
+        """Call function in the loop thread.
+
+        The function is called immediately if already in the loop thread.
+        """
+        if get_ident() == self.ident:
+            function(*args)
+        else:
+            self._calls.append((function, args))
+            self._wakeup()
+
+    def call_later(self, delay, function, *args):
+        """Call function in the loop thread after delay seconds.
+
+        :return: Timer which can be cancelled
+        """
+        timer = _Timer(time.monotonic() + delay, function, args)
+        self.call(self._push_timer, timer)
+        return timer
+
+    def _push_timer(self, timer):
+        heapq.heappush(self._timers,
+                       (timer.when, next(self._sequence), timer))
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def add_reader(self, sock, callback):
+        """Call callback when sock is readable. Loop thread only."""
+        self._set_callback(sock, 0, callback)
+
+    def remove_reader(self, sock):
+        """Stop watching sock for reading. Loop thread only."""
+        self._set_callback(sock, 0, None)
+
+    def add_writer(self, sock, callback):
+        """Call callback when sock is writable. Loop thread only."""
+        self._set_callback(sock, 1, callback)
+
+    def remove_writer(self, sock):
+        """Stop watching sock for writing. Loop thread only."""
+        self._set_callback(sock, 1, None)
+
+    def _set_callback(self, sock, index, callback):
+        try:
+            key = self._selector.get_key(sock)
+            callbacks = list(key.data)
+        except (KeyError, ValueError):
+            key = None
+            callbacks = [None, None]
+        callbacks[index] = callback
+        events = (selectors.EVENT_READ if callbacks[0] else 0) | \
+            (selectors.EVENT_WRITE if callbacks[1] else 0)
+        if key is None:
+            if events:
+                self._selector.register(sock, events, callbacks)
+        elif events:
+            self._selector.modify(sock, events, callbacks)
+        else:
+            self._selector.unregister(sock)
+
+    @property
+    def socket_count(self):
+        """Number of watched sockets."""
+        return len(self._selector.get_map()) - 1
+
+    def stop(self, timeout=1):
+        """Stop the loop once every socket is closed or after timeout."""
+        self.call(self._set_stop_deadline, time.monotonic() + timeout)
+        self.join()
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def _set_stop_deadline(self, deadline):
+        self._stop_deadline = deadline
+
+    def _stopped(self):
+        return self._stop_deadline is not None and (
+            not self.socket_count or time.monotonic() >= self._stop_deadline)
+
+    def run(self):
+        """Run the loop."""
+        while not self._stopped():
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            if self._stop_deadline is not None:
+                timeout = min(timeout if timeout is not None else 1,
+                              max(0, self._stop_deadline - time.monotonic()))
+            for key, events in self._selector.select(timeout):
+                if key.data is None:
+                    self._wakeup_r.recv(4096)
+                    continue
+                reader, writer = key.data
+                if events & selectors.EVENT_READ and reader:
+                    self._run_callback(reader)
+                if events & selectors.EVENT_WRITE and writer:
+                    self._run_callback(writer)
+            self._run_calls()
+            self._run_timers()
+
+    def _run_calls(self):
+        while self._calls:
+            function, args = self._calls.popleft()
+            self._run_callback(function, *args)
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                self._run_callback(timer.function, *timer.args)
+
+    @staticmethod
+    def _run_callback(function, *args):
+        try:
+            function(*args)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error in network loop callback")
+
+
+# Result of the connection of a device: phase is the connection phase which
+# failed and error the DysonConnectionException or OSError, None if connected
+ConnectResult = namedtuple('ConnectResult',
+                           ['device', 'connected', 'phase', 'error',
+                            'duration'])
+
+
+def set_network_device(device, device_ip=None, device_port=DEFAULT_PORT):
+    """Set the network device used to connect a device.
+
+    :param device: Device returned by DysonAccount.devices()
+    :param device_ip: Device IP address. Discovered using mDNS if None
+                      and the device has no network device yet.
+    :param device_port: Device Port (default: 1883)
+    :raise DysonConnectionException: if the device is not found
+    """
+    if device_ip is not None:
+        device._network_device = NetworkDevice(device.name, device_ip,
+                                               device_port)
+    elif device.network_device is None and \
+            isinstance(device, DysonPureCoolLink):
+        device._network_device = device._find_network_device(5, 15)
+    if device.network_device is None:
+        raise DysonConnectionException("discovery", "device not found")
+
+
+def _connect_device(device, device_ip, device_port, connect_phases):
+    """Set the network device of a device and connect it.
+
+    A device found at an outdated cached address is searched again.
+
+    :param connect_phases: Function connecting the device
+    :raise DysonConnectionException: if a phase fails
+    :raise OSError: if the TCP connection fails
+    """
+    discovered = device_ip is None and device.network_device is None
+    set_network_device(device, device_ip, device_port)
+    try:
+        connect_phases()
+    except (DysonConnectionException, OSError):
+        if not discovered or \
+                not default_discovery().forget_cached(device.serial):
+            raise
+        _LOGGER.info("Cached address of device %s outdated", device.serial)
+        device._network_device = None
+        set_network_device(device)
+        connect_phases()
+
+
+def connect_devices(devices, addresses=None, concurrency=16, timeouts=None,
+                    fleet=None):
+    """Connect many devices concurrently.
+
+    :param devices: Devices returned by DysonAccount.devices()
+    :param addresses: Device IP addresses, or (address, port) tuples,
+                      indexed by serial. Devices without address are
+                      discovered using mDNS.
+    :param concurrency: Max number of devices connecting at the same time
+    :param timeouts: ConnectTimeouts of the connection phases
+    :param fleet: DysonFleet managing the connections. Each device runs
+                  its own network thread if None.
+    :return: List of ConnectResult, in the order of devices
+    """
+    addresses = addresses or {}
+    timeouts = timeouts or DEFAULT_CONNECT_TIMEOUTS
+    decrypt_credentials(devices)
+
+    def connect(device):
+        start = time.monotonic()
+        address = addresses.get(device.serial)
+        if isinstance(address, str):
+            address = (address, DEFAULT_PORT)
+        try:
+            if device.credentials is None:
+                raise DysonConnectionException("credentials",
+                                               "cannot be decrypted")
+            if fleet is not None:
+                connect_phases = partial(fleet._connect_phases, device,
+                                         timeouts)
+            else:
+                connect_phases = partial(device._connect_phases, timeouts)
+            _connect_device(device, *(address or (None, DEFAULT_PORT)),
+                            connect_phases=connect_phases)
+        except DysonConnectionException as error:
+            failure = (error.phase, error)
+        except OSError as error:
+            failure = ("tcp", error)
+        else:
+            return ConnectResult(device, True, None, None,
+                                 time.monotonic() - start)
+        _LOGGER.error("Unable to connect to device %s: %s", device.serial,
+                      failure[1])
+        return ConnectResult(device, False, failure[0], failure[1],
+                             time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(connect, devices))
+
+
+# Result of a configuration broadcast to a device: published is False if the
+# device is not a connected fan, acknowledged True once the configuration is
+# confirmed by a STATE-CHANGE message
+BroadcastResult = namedtuple('BroadcastResult',
+                             ['device', 'published', 'acknowledged'])
+
+
+def broadcast_configuration(devices, data, timeout=BROADCAST_TIMEOUT):
+    # pylint: disable=too-many-locals
+    """Send the same configuration to many fans.
+
+    The STATE-SET payload is serialized once per product type and published
+    to every device without waiting, then acknowledgements are awaited
+    together. Only the given fields are sent: unlike set_configuration(),
+    fields are not completed with the current state of each device.
+
+    :param devices: Connected fans
+    :param data: Data to send, or function called with a product type
+                 returning the data sent to the devices of this type
+    :param timeout: Time in seconds to wait for the acknowledgements
+    :return: List of BroadcastResult, in the order of devices
+    """
+    groups = {}
+    for index, device in enumerate(devices):
+        if isinstance(device, DysonPureCoolLink) and device.connected:
+            groups.setdefault(device.product_type, []).append(index)
+    timestamp = message_time()
+    futures = {}
+    for product_type, indexes in groups.items():
+        fields = data(product_type) if callable(data) else data
+        payload = state_set_payload(fields, timestamp)
+        for index in indexes:
+            futures[index] = devices[index].publish_state_set(
+                payload, fields, timeout)
+    wait(futures.values(), timeout)
+    results = []
+    for index, device in enumerate(devices):
+        future = futures.get(index)
+        published = future is not None and future.info is not None and \
+            future.info.rc == mqtt.MQTT_ERR_SUCCESS
+        # Futures not resolved yet are resolved with False on timeout
+        acknowledged = published and future.done() and future.result()
+        results.append(BroadcastResult(device, published, acknowledged))
+    return results
+
+
+class _Session:
+    """MQTT session of a device managed by the fleet."""
+
+    def __init__(self, device, client, max_pending):
+        self.device = device
+        self.client = client
+        self.pending = deque(maxlen=max_pending)
+        self.lock = Lock()
+        self.scheduled = False
+        self.dropped = 0
+        self.misc_timer = None
+
+
+class DysonFleet:
+    """Connections of many devices sharing one network thread.
+
+    Devices returned by DysonAccount.devices() are connected with
+    connect() instead of their own connect() method. Received messages are
+    handled by a pool of worker threads: each device has at most
+    max_pending messages waiting, the oldest ones are dropped when a device
+    sends faster than its listeners consume.
+    """
+
+    def __init__(self, workers=4, max_pending=100, scheduler=None):
+        """Create a new fleet.
+
+        :param workers: Number of threads calling the message listeners
+        :param max_pending: Max number of messages waiting per device
+        :param scheduler: SensorScheduler requesting environmental data
+                          (default: scheduler shared by the process)
+        """
+        self._loop = NetworkLoop()
+        self._loop.start()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._max_pending = max_pending
+        self._scheduler = scheduler or default_scheduler()
+        self._sessions = {}
+
+    @property
+    def devices(self):
+        """Connected devices."""
+        return [session.device for session in self._sessions.values()]
+
+    def dropped_messages(self, device):
+        """Return the number of messages dropped for a device."""
+        return self._sessions[device.serial].dropped
+
+    def connect(self, device, device_ip=None, device_port=DEFAULT_PORT,
+                timeouts=None):
+        """Connect a device.
+
+        :param device: Device returned by DysonAccount.devices()
+        :param device_ip: Device IP address. Discovered using mDNS if None
+                          and the device has not been connected yet.
+        :param device_port: Device Port (default: 1883)
+        :param timeouts: ConnectTimeouts of the connection phases
+        :return: True if connected, else False
+        """
+        try:
+            _connect_device(device, device_ip, device_port,
+                            partial(self._connect_phases, device,
+                                    timeouts or DEFAULT_CONNECT_TIMEOUTS))
+        except (DysonConnectionException, OSError) as error:
+            _LOGGER.error("Unable to connect to device %s: %s",
+                          device.serial, error)
+            return False
+        return True
+
+    def connect_all(self, devices, addresses=None, concurrency=16,
+                    timeouts=None):
+        """Connect many devices concurrently.
+
+        See connect_devices().
+        """
+        return connect_devices(devices, addresses, concurrency, timeouts,
+                               self)
+
+    def broadcast(self, data, devices=None, timeout=BROADCAST_TIMEOUT):
+        """Send the same configuration to many fans.
+
+        See broadcast_configuration().
+
+        :param devices: Connected fans (default: every fan of the fleet)
+        """
+        if devices is None:
+            devices = [device for device in self.devices
+                       if isinstance(device, DysonPureCoolLink)]
+        return broadcast_configuration(devices, data, timeout)
+
+    def _connect_phases(self, device, timeouts):
+        """Connect a device and wait for its first data.
+
+        :param device: Device with a network device
+        :param timeouts: ConnectTimeouts
+        :raise DysonConnectionException: if a phase fails
+        """
+        client = device._create_mqtt_client()
+        session = _Session(device, client, self._max_pending)
+        client.on_message = partial(self._on_message, session)
+        client.on_socket_open = partial(self._on_socket_open, session)
+        client.on_socket_close = partial(self._on_socket_close, session)
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = \
+            self._on_socket_unregister_write
+        set_connect_timeout(client, timeouts.tcp)
+        device._mqtt = client
+        client.connect(device.network_device.address,
+                       device.network_device.port)
+        connected = False
+        try:
+            connected = device._wait_for(device._connection_queue,
+                                         timeouts.connack, "connack")
+        finally:
+            if not connected:
+                client.disconnect()
+        if not connected:
+            raise DysonConnectionException("connack", "refused")
+
+        device._connected = True
+        self._sessions[device.serial] = session
+        device.request_current_state()
+        is_fan = isinstance(device, DysonPureCoolLink)
+        if is_fan:
+            device.request_environmental_state()
+            self._scheduler.add(device)
+
+        # Wait for first data
+        try:
+            device._wait_for(device._state_data_available, timeouts.state,
+                             "state")
+            if is_fan:
+                device._wait_for(device._sensor_data_available,
+                                 timeouts.sensor, "sensor")
+        except DysonConnectionException:
+            self.disconnect(device)
+            raise
+        device._device_available = True
+
+    def disconnect(self, device):
+        """Disconnect a device."""
+        session = self._sessions.pop(device.serial, None)
+        if session is None:
+            return
+        device._connected = False
+        device._device_available = False
+        session.client.disconnect()
+        if isinstance(device, DysonPureCoolLink):
+            self._scheduler.remove(device)
+            device._fail_state_sets()
+
+    def close(self):
+        """Disconnect every device and stop the fleet threads."""
+        for device in self.devices:
+            self.disconnect(device)
+        self._loop.stop()
+        self._executor.shutdown(wait=True)
+
+    def _on_socket_open(self, session, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Watch the MQTT socket of a device."""
+        self._loop.call(self._watch_socket, session, sock)
+
+    def _on_socket_close(self, session, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Stop watching the MQTT socket of a device."""
+        self._loop.call(self._unwatch_socket, session, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Wait for a MQTT socket to be writable."""
+        self._loop.call(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        # pylint: disable=unused-argument
+        """Stop waiting for a MQTT socket to be writable."""
+        self._loop.call(self._loop.remove_writer, sock)
+
+    def _watch_socket(self, session, sock):
+        # Commands are small messages, do not wait to group them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._loop.add_reader(sock, session.client.loop_read)
+        session.misc_timer = self._loop.call_later(
+            MISC_LOOP_INTERVAL, self._loop_misc, session)
+
+    def _unwatch_socket(self, session, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+        if session.misc_timer is not None:
+            session.misc_timer.cancel()
+            session.misc_timer = None
+
+    def _loop_misc(self, session):
+        """Run the paho housekeeping (keepalive, retries) of a device."""
+        if session.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            session.misc_timer = self._loop.call_later(
+                MISC_LOOP_INTERVAL, self._loop_misc, session)
+
+    def _on_message(self, session, client, userdata, msg):
+        # pylint: disable=unused-argument
+        """Queue a message received from a device."""
+        with session.lock:
+            if len(session.pending) == session.pending.maxlen:
+                session.dropped += 1
+                _LOGGER.debug("Too many pending messages, drop oldest "
+                              "message of device %s", session.device.serial)
+            session.pending.append(msg)
+            if session.scheduled:
+                return
+            session.scheduled = True
+        self._executor.submit(self._handle_messages, session)
+
+    def _handle_messages(self, session):
+        """Handle pending messages of a device. Worker thread."""
+        device = session.device
+        for _ in range(MESSAGE_BATCH_SIZE):
+            with session.lock:
+                if not session.pending:
+                    session.scheduled = False
+                    return
+                msg = session.pending.popleft()
+            try:
+                device.on_message(session.client, device, msg)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error handling message of device %s",
+                                  device.serial)
+        # Yield the worker to other devices
+        self._executor.submit(self._handle_messages, session)
@@ -4,7 +4,9 @@
 
 from .const import FanPower, \
     SLEEP_TIMER_OFF, FanSpeed, FrontalDirection, AutoMode, \
-    NightMode, OscillationV2
+    NightMode, OscillationV2, ContinuousMonitoring, ResetFilter
+from .dyson_command_encoder import CommandEncoder, EnumField, ValueField, \
+    ConstantField
 from .dyson_pure_cool_link import DysonPureCoolLink
 from .utils import printable_fields
 
@@ -12,79 +14,38 @@ from .utils import printable_fields
 class DysonPureCool(DysonPureCoolLink):
     """Dyson pure cool device."""
 
-    def _parse_command_args(self, **kwargs):
-        """Parse command arguments.
-
-        :param kwargs Arguments
-        :return payload dictionary
-        """
-        fan_power = kwargs.get('fan_power')
-        front_direction = kwargs.get('front_direction')
-        auto_mode = kwargs.get('auto_mode')
-        oscillation = kwargs.get('oscillation')
-        night_mode = kwargs.get('night_mode')
-        continuous_monitoring = kwargs.get('continuous_monitoring')
-        fan_speed = kwargs.get('fan_speed')
-        sleep_timer = kwargs.get('sleep_timer')
-        oscillation_angle_low = kwargs.get('oscillation_angle_low')
-        oscillation_angle_high = kwargs.get('oscillation_angle_high')
-        reset_filter = kwargs.get('reset_filter')
-
-        f_power = fan_power.value if fan_power \
-            else self._current_state.fan_power
-        f_front_direction = front_direction.value if front_direction \
-            else self._current_state.front_direction
-        f_auto_mode = auto_mode.value if auto_mode \
-            else self._current_state.auto_mode
-        f_oscillation = oscillation.value if oscillation \
-            else self._current_state.oscillation
-        f_night_mode = night_mode.value if night_mode \
-            else self._current_state.night_mode
-        f_continuous_monitoring = continuous_monitoring.value if \
-            continuous_monitoring \
-            else self._current_state.continuous_monitoring
-        f_speed = fan_speed.value if fan_speed \
-            else self._current_state.speed
-        f_sleep_timer = str(sleep_timer) if sleep_timer or isinstance(
-            sleep_timer, int) else "STET"
-        f_oscillation_angle_low = str(oscillation_angle_low) \
-            if oscillation_angle_low \
-            else self._current_state.oscillation_angle_low
-        f_oscillation_angle_high = str(oscillation_angle_high) \
-            if oscillation_angle_high \
-            else self._current_state.oscillation_angle_high
-        f_reset_filter = reset_filter.value if reset_filter \
-            else "STET"
-
-        return {
-            "fpwr": f_power,
-            "fdir": f_front_direction,
-            "auto": f_auto_mode,  # sleep timer
-            "oson": f_oscillation,  # monitor air quality
-            "nmod": f_night_mode,  # monitor air quality
-            "rhtm": f_continuous_monitoring,  # monitor air quality
-            "fnsp": f_speed,  # monitor air quality
-            "sltm": f_sleep_timer,  # monitor air quality
-            "ancp": "CUST",
-            "osal": f_oscillation_angle_low,  # monitor air quality
-            "osau": f_oscillation_angle_high,  # monitor air quality
-            # when inactive
-            "rstf": f_reset_filter,  # reset filter lifecycle
-        }
+    _COMMAND_ENCODER = CommandEncoder((
+        EnumField("fpwr", "fan_power", FanPower, "fan_power"),
+        EnumField("fdir", "front_direction", FrontalDirection,
+                  "front_direction"),
+        EnumField("auto", "auto_mode", AutoMode, "auto_mode"),
+        EnumField("oson", "oscillation", OscillationV2, "oscillation"),
+        EnumField("nmod", "night_mode", NightMode, "night_mode"),
+        # monitor air quality when inactive
+        EnumField("rhtm", "continuous_monitoring", ContinuousMonitoring,
+                  "continuous_monitoring"),
+        EnumField("fnsp", "fan_speed", FanSpeed, "speed"),
+        ValueField("sltm", "sleep_timer", convert=str, zero=True),
+        ConstantField("ancp", "CUST"),
+        ValueField("osal", "oscillation_angle_low", "oscillation_angle_low",
+                   convert=str),
+        ValueField("osau", "oscillation_angle_high",
+                   "oscillation_angle_high", convert=str),
+        EnumField("rstf", "reset_filter", ResetFilter)))  # reset filter
 
     def turn_on(self):
         """Turn off the fan."""
         data = {
             "fpwr": FanPower.POWER_ON.value
         }
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def turn_off(self):
         """Turn on the fan."""
         data = {
             "fpwr": FanPower.POWER_OFF.value
         }
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def enable_oscillation(self,
                            oscillation_angle_low=None,
@@ -137,14 +98,14 @@ class DysonPureCool(DysonPureCoolLink):
             "osal": str(oscillation_angle_low).rjust(4, '0'),
             "osau": str(oscillation_angle_high).rjust(4, '0'),
         }
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def disable_oscillation(self):
         """Disable oscillation."""
         data = {
             "oson": OscillationV2.OSCILLATION_OFF.value
         }
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def enable_sleep_timer(self, duration):
         """Enable the sleep timer.
@@ -160,7 +121,7 @@ class DysonPureCool(DysonPureCoolLink):
             "sltm": str(duration).rjust(4, '0')
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def disable_sleep_timer(self):
         """Disable the sleep timer."""
@@ -168,7 +129,7 @@ class DysonPureCool(DysonPureCoolLink):
             "sltm": SLEEP_TIMER_OFF
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def set_fan_speed(self, fan_speed):
         """Set the fan speed.
@@ -182,7 +143,7 @@ class DysonPureCool(DysonPureCoolLink):
             "fnsp": fan_speed.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def enable_frontal_direction(self):
         """Enable frontal direction."""
@@ -190,7 +151,7 @@ class DysonPureCool(DysonPureCoolLink):
             "fdir": FrontalDirection.FRONTAL_ON.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def disable_frontal_direction(self):
         """Disable frontal direction."""
@@ -198,7 +159,7 @@ class DysonPureCool(DysonPureCoolLink):
             "fdir": FrontalDirection.FRONTAL_OFF.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def enable_auto_mode(self):
         """Enable auto mode."""
@@ -206,7 +167,7 @@ class DysonPureCool(DysonPureCoolLink):
             "auto": AutoMode.AUTO_ON.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def disable_auto_mode(self):
         """Disable auto mode."""
@@ -214,7 +175,7 @@ class DysonPureCool(DysonPureCoolLink):
             "auto": AutoMode.AUTO_OFF.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def enable_night_mode(self):
         """Enable night mode."""
@@ -222,7 +183,7 @@ class DysonPureCool(DysonPureCoolLink):
             "nmod": NightMode.NIGHT_MODE_ON.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def disable_night_mode(self):
         """Disable night mode."""
@@ -230,7 +191,7 @@ class DysonPureCool(DysonPureCoolLink):
             "nmod": NightMode.NIGHT_MODE_OFF.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def __repr__(self):
         """Return a String representation."""
@@ -5,62 +5,53 @@
 import json
 import logging
 import time
-import socket
-from threading import Thread
+import threading
+from functools import partial
 from queue import Queue, Empty
 
-
 import paho.mqtt.client as mqtt
 
 from .dyson_pure_state_v2 import \
     DysonEnvironmentalSensorV2State, DysonPureCoolV2State, \
     DysonPureHotCoolV2State
-from .dyson_device import DysonDevice, NetworkDevice, DEFAULT_PORT
+from .const import FanMode, FanSpeed, Oscillation, NightMode, \
+    QualityTarget, StandbyMonitoring, ResetFilter
+from .dyson_command_buffer import CommandBuffer, CommandFuture, \
+    COALESCE_WINDOW, COMMAND_TIMEOUT, call_later
+from .dyson_command_encoder import CommandEncoder, EnumField, ValueField, \
+    STET, state_set_payload
+from .dyson_device import DysonDevice, NetworkDevice, DEFAULT_PORT, \
+    DEFAULT_CONNECT_TIMEOUTS
+from .exceptions import DysonConnectionException
+from .dyson_discovery import default_discovery
+from .dyson_scheduler import default_scheduler, SENSOR_INTERVAL
+from .dyson_state import product_state_changes
 from .utils import printable_fields, support_heating, is_pure_cool_v2, \
     support_heating_v2
 from .dyson_pure_state import DysonPureHotCoolState, DysonPureCoolState, \
     DysonEnvironmentalSensorState
-from .zeroconf import ServiceBrowser, Zeroconf
 
 _LOGGER = logging.getLogger(__name__)
 
+# Fields reported counting down, never equal to the value sent
+_COUNTDOWN_FIELDS = frozenset(("sltm",))
+
 
 class DysonPureCoolLink(DysonDevice):
+    # pylint: disable=too-many-instance-attributes
     """Dyson device (fan)."""
 
-    class DysonDeviceListener:
-        """Message listener."""
-
-        def __init__(self, serial, add_device_function):
-            """Create a new message listener.
-
-            :param serial: Device serial
-            :param add_device_function: Callback function
-            """
-            self._serial = serial
-            self.add_device_function = add_device_function
-
-        def remove_service(self, zeroconf, device_type, name):
-            # pylint: disable=unused-argument,no-self-use
-            """Remove listener."""
-            _LOGGER.info("Service %s removed", name)
-
-        def add_service(self, zeroconf, device_type, name):
-            """Add device.
-
-            :param zeroconf: MSDNS object
-            :param device_type: Service type
-            :param name: Device name
-            """
-            device_serial = (name.split(".")[0]).split("_")[1]
-            if device_serial == self._serial:
-                # Find searched device
-                info = zeroconf.get_service_info(device_type, name)
-                address = socket.inet_ntoa(info.address)
-                network_device = NetworkDevice(device_serial, address,
-                                               info.port)
-                self.add_device_function(network_device)
-                zeroconf.close()
+    _COMMAND_ENCODER = CommandEncoder((
+        EnumField("fmod", "fan_mode", FanMode, "fan_mode"),
+        EnumField("fnsp", "fan_speed", FanSpeed, "speed"),
+        EnumField("oson", "oscillation", Oscillation, "oscillation"),
+        ValueField("sltm", "sleep_timer", zero=True),  # sleep timer
+        # monitor air quality when inactive
+        EnumField("rhtm", "standby_monitoring", StandbyMonitoring,
+                  "standby_monitoring"),
+        EnumField("rstf", "reset_filter", ResetFilter),  # reset filter
+        EnumField("qtar", "quality_target", QualityTarget, "quality_target"),
+        EnumField("nmod", "night_mode", NightMode, "night_mode")))
 
     def __init__(self, json_body):
         """Create a new Pure Cool Link device.
@@ -71,7 +62,11 @@ class DysonPureCoolLink(DysonDevice):
 
         self._sensor_data_available = Queue()
         self._environmental_state = None
-        self._request_thread = None
+        self._sensor_interval = SENSOR_INTERVAL
+        self._command_buffer = None
+        self._command_timeout = COMMAND_TIMEOUT
+        self._state_set_lock = threading.Lock()
+        self._state_set_waiters = []
 
     @property
     def status_topic(self):
@@ -81,100 +76,115 @@ class DysonPureCoolLink(DysonDevice):
 
     @staticmethod
     def on_message(client, userdata, msg):
-        # pylint: disable=unused-argument, too-many-branches
+        # pylint: disable=unused-argument
         """Set function Callback when message received."""
         payload = msg.payload.decode("utf-8")
-        if DysonPureCoolState.is_state_message(payload):
-            if support_heating(userdata.product_type):
-                device_msg = DysonPureHotCoolState(payload)
-            elif support_heating_v2(userdata.product_type):
-                device_msg = DysonPureHotCoolV2State(payload)
-            elif is_pure_cool_v2(userdata.product_type):
-                device_msg = DysonPureCoolV2State(payload)
-            else:
-                device_msg = DysonPureCoolState(payload)
-            if not userdata.device_available:
-                userdata.state_data_available()
-            userdata.state = device_msg
-            for function in userdata.callback_message:
-                function(device_msg)
-        elif DysonEnvironmentalSensorState.is_environmental_state_message(
-                payload):
-            if is_pure_cool_v2(userdata.product_type):
-                device_msg = DysonEnvironmentalSensorV2State(payload)
-            else:
-                device_msg = DysonEnvironmentalSensorState(payload)
-            if not userdata.device_available:
-                userdata.sensor_data_available()
-            userdata.environmental_state = device_msg
-            for function in userdata.callback_message:
-                function(device_msg)
+        json_message = json.loads(payload)
+        handler = MESSAGE_HANDLERS.get(json_message.get('msg'))
+        if handler:
+            handler(userdata, json_message)
         else:
             _LOGGER.warning("Unknown message: %s", payload)
 
-    def auto_connect(self, timeout=5, retry=15):
+    def auto_connect(self, timeout=5, retry=15, timeouts=None):
         """Try to connect to device using mDNS.
 
         :param timeout: Timeout
         :param retry: Max retry
+        :param timeouts: ConnectTimeouts of the connection phases
         :return: True if connected, else False
         """
-        for i in range(retry):
-            zeroconf = Zeroconf()
-            listener = self.DysonDeviceListener(self._serial,
-                                                self._add_network_device)
-            ServiceBrowser(zeroconf, "_dyson_mqtt._tcp.local.", listener)
-            try:
-                self._network_device = self._search_device_queue.get(
-                    timeout=timeout)
-            except Empty:
-                # Unable to find device
-                _LOGGER.warning("Unable to find device %s, try %s",
-                                self._serial, i)
-                zeroconf.close()
-            else:
-                break
+        self._network_device = self._find_network_device(timeout, retry)
+        if self._network_device is None:
+            _LOGGER.error("Unable to connect to device %s", self._serial)
+            return False
+        if self._mqtt_connect(timeouts):
+            return True
+        if not default_discovery().forget_cached(self._serial):
+            return False
+        # Address outdated, search the device on the network again
+        _LOGGER.info("Address of device %s outdated", self._serial)
+        self._network_device = self._find_network_device(timeout, retry)
         if self._network_device is None:
             _LOGGER.error("Unable to connect to device %s", self._serial)
             return False
-        return self._mqtt_connect()
+        return self._mqtt_connect(timeouts)
+
+    def _find_network_device(self, timeout, retry):
+        """Search the device on the local network using mDNS.
 
-    def connect(self, device_ip, device_port=DEFAULT_PORT):
+        Devices are searched by the discovery session shared by the
+        process: a device already seen is found immediately.
+
+        :param timeout: Timeout
+        :param retry: Max retry
+        :return: NetworkDevice if found, else None
+        """
+        try:
+            # Network device already given by _add_network_device
+            return self._search_device_queue.get_nowait()
+        except Empty:
+            pass
+        discovery = default_discovery()
+        for i in range(retry):
+            network_device = discovery.find(self._serial, timeout)
+            if network_device is not None:
+                return network_device
+            # Unable to find device
+            _LOGGER.warning("Unable to find device %s, try %s",
+                            self._serial, i)
+        return None
+
+    def connect(self, device_ip, device_port=DEFAULT_PORT, timeouts=None):
         """Connect to the device using ip address.
 
         :param device_ip: Device IP address
         :param device_port: Device Port (default: 1883)
+        :param timeouts: ConnectTimeouts of the connection phases
         :return: True if connected, else False
         """
         self._network_device = NetworkDevice(self._name, device_ip,
                                              device_port)
 
-        return self._mqtt_connect()
-
-    def _mqtt_connect(self):
-        """Connect to the MQTT broker."""
-        self._mqtt = mqtt.Client(userdata=self)
-        self._mqtt.on_message = self.on_message
-        self._mqtt.on_connect = self.on_connect
-        self._mqtt.username_pw_set(self._serial, self._credentials)
-        self._mqtt.connect(self._network_device.address,
-                           self._network_device.port)
-        self._mqtt.loop_start()
-        self._connected = self._connection_queue.get(timeout=10)
-        if self._connected:
-            self.request_current_state()
-            # Start Environmental thread
-            self._request_thread = EnvironmentalSensorThread(
-                self.request_environmental_state)
-            self._request_thread.start()
-
-            # Wait for first data
-            self._state_data_available.get()
-            self._sensor_data_available.get()
-            self._device_available = True
-        else:
-            self._mqtt.loop_stop()
-        return self._connected
+        return self._mqtt_connect(timeouts)
+
+    def _mqtt_connect(self, timeouts=None):
+        """Connect to the MQTT broker.
+
+        :param timeouts: ConnectTimeouts (default: DEFAULT_CONNECT_TIMEOUTS)
+        :return: True if connected, else False
+        """
+        try:
+            self._connect_phases(timeouts or DEFAULT_CONNECT_TIMEOUTS)
+        except (DysonConnectionException, OSError) as error:
+            _LOGGER.error("Unable to connect to device %s: %s",
+                          self._serial, error)
+            return False
+        return True
+
+    def _connect_phases(self, timeouts):
+        """Connect to the MQTT broker and wait for the first data.
+
+        :param timeouts: ConnectTimeouts
+        :raise DysonConnectionException: if a phase fails
+        """
+        self._start_mqtt_client(timeouts)
+        self._connected = True
+        self.request_current_state()
+        self.request_environmental_state()
+        default_scheduler().add(self)
+
+        # Wait for first data
+        try:
+            self._wait_for(self._state_data_available, timeouts.state,
+                           "state")
+            self._wait_for(self._sensor_data_available, timeouts.sensor,
+                           "sensor")
+        except DysonConnectionException:
+            default_scheduler().remove(self)
+            self._stop_mqtt_client()
+            raise
+        self._device_available = True
 
     def sensor_data_available(self):
         """Call when first sensor data are available. Internal method."""
@@ -183,8 +193,10 @@ class DysonPureCoolLink(DysonDevice):
 
     def disconnect(self):
         """Disconnect from the device."""
-        self._request_thread.stop()
+        self._flush_commands()
+        default_scheduler().remove(self)
         self._connected = False
+        self._fail_state_sets()
 
     def request_environmental_state(self):
         """Request new state message."""
@@ -201,23 +213,182 @@ class DysonPureCoolLink(DysonDevice):
                 "Unable to send commands because device %s is not connected",
                 self.serial)
 
+    def enable_command_buffer(self, window=COALESCE_WINDOW, max_rate=None):
+        """Merge the configurations sent within a window of time.
+
+        Configurations sent within window seconds are merged and published
+        as one message. Their futures are resolved when the merged
+        configuration is confirmed.
+
+        :param window: Time in seconds configurations are merged
+        :param max_rate: Max messages published per second (None: no limit)
+        """
+        self._flush_commands()
+        self._command_buffer = CommandBuffer(self._send_configuration,
+                                             window, max_rate,
+                                             self._call_later)
+
+    def disable_command_buffer(self):
+        """Publish the pending configuration and stop merging them."""
+        self._flush_commands()
+        self._command_buffer = None
+
+    def _flush_commands(self):
+        """Publish the configuration pending in the command buffer."""
+        if self._command_buffer is not None:
+            self._command_buffer.flush()
+
+    def _call_later(self, delay, callback):
+        # pylint: disable=no-self-use
+        """Call callback in delay seconds from a timer thread."""
+        return call_later(delay, callback)
+
     def set_fan_configuration(self, data):
         # pylint: disable=too-many-arguments,too-many-locals
         """Configure Fan.
 
         :param data: Data to send
+        :return: CommandFuture resolved with True when the device confirms
+                 the configuration, False if it is not connected or does
+                 not confirm within command_timeout seconds
         """
-        if self._connected:
-            payload = {
-                "msg": "STATE-SET",
-                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-                "mode-reason": "LAPP",
-                "data": data
-            }
-            self._mqtt.publish(self.command_topic, json.dumps(payload), 1)
+        if self._command_buffer is None:
+            return self._command_future(self._send_configuration(data))
+        return self._buffer_configuration(data, data)
+
+    def _buffer_configuration(self, data, expected):
+        """Send a configuration through the command buffer.
+
+        :param data: Data to send
+        :param expected: Values confirming the configuration
+        :return: CommandFuture, see set_fan_configuration()
+        """
+        future = CommandFuture()
+        self._command_buffer.submit(data, expected).add_done_callback(
+            partial(_chain_buffered, future))
+        return self._command_future(future)
+
+    def _command_future(self, future):
+        # pylint: disable=no-self-use
+        """Return the future returned to the caller of a fan command.
+
+        :param future: CommandFuture of the command
+        """
+        return future
+
+    def _send_configuration(self, data, expected=None):
+        """Publish a configuration and wait for its confirmation.
+
+        :param data: Data to send
+        :param expected: Values confirming the configuration (default: data)
+        :return: CommandFuture
+        """
+        return self._send_payload(state_set_payload(data),
+                                  data if expected is None else expected)
+
+    def publish_state_set(self, payload, data, timeout=None):
+        """Publish a serialized STATE-SET message. Internal method.
+
+        :param payload: STATE-SET message returned by state_set_payload()
+        :param data: Data of the message
+        :param timeout: Time in seconds to wait for the confirmation
+                        (default: command_timeout)
+        :return: CommandFuture, see set_fan_configuration()
+        """
+        return self._send_payload(payload, data, timeout)
+
+    def _send_payload(self, payload, expected, timeout=None):
+        """Publish a STATE-SET payload and wait for its confirmation.
+
+        :param payload: STATE-SET message
+        :param expected: Values sent, dict or (field, value) pairs
+        :param timeout: Confirmation timeout (default: command_timeout)
+        :return: CommandFuture
+        """
+        # Waiting before publishing, the answer can be received first
+        future = self._state_set_future(expected)
+        future.info = self._publish_payload(payload)
+        if future.info is None or future.info.rc != mqtt.MQTT_ERR_SUCCESS:
+            if self._forget_state_set(future):
+                future.set_result(False)
         else:
-            _LOGGER.warning("Not connected, can not set configuration: %s",
-                            self.serial)
+            self._call_later(
+                self._command_timeout if timeout is None else timeout,
+                partial(self._expire_state_set, future))
+        return future
+
+    def _publish_payload(self, payload):
+        """Publish a STATE-SET message.
+
+        :param payload: STATE-SET message
+        :return: Publication info, None if not connected
+        """
+        if self._connected:
+            return self._mqtt.publish(self.command_topic, payload, 1)
+        _LOGGER.warning("Not connected, can not set configuration: %s",
+                        self.serial)
+        return None
+
+    def _state_set_future(self, data):
+        """Return a CommandFuture resolved with True when data are confirmed.
+
+        A configuration is confirmed by a STATE-CHANGE message reporting
+        its fields with the new values. "STET" values, the sleep timer and
+        fields missing from the message are not compared.
+
+        :param data: Values sent, dict or (field, value) pairs
+        """
+        if isinstance(data, dict):
+            data = data.items()
+        expected = [(field, value) for field, value in data
+                    if value != STET and field not in _COUNTDOWN_FIELDS]
+        future = CommandFuture()
+        with self._state_set_lock:
+            self._state_set_waiters.append((expected, future))
+        return future
+
+    def _forget_state_set(self, future):
+        """Stop waiting for the confirmation of a configuration.
+
+        :return: True if the future was waiting: the caller resolves it
+        """
+        with self._state_set_lock:
+            waiters = [waiter for waiter in self._state_set_waiters
+                       if waiter[1] is not future]
+            forgotten = len(waiters) != len(self._state_set_waiters)
+            self._state_set_waiters = waiters
+        return forgotten
+
+    def _expire_state_set(self, future):
+        """Resolve with False a configuration not confirmed in time."""
+        if self._forget_state_set(future):
+            _LOGGER.debug("Configuration not confirmed by device %s",
+                          self.serial)
+            future.set_result(False)
+
+    def _fail_state_sets(self):
+        """Resolve with False every configuration waiting a confirmation."""
+        with self._state_set_lock:
+            waiters, self._state_set_waiters = self._state_set_waiters, []
+        for _, future in waiters:
+            future.set_result(False)
+
+    def confirm_state_set(self, product_state):
+        """Call when a STATE-CHANGE is received. Internal method.
+
+        :param product_state: product-state of the STATE-CHANGE message
+        """
+        with self._state_set_lock:
+            if not self._state_set_waiters:
+                return
+            confirmed = [future for expected, future
+                         in self._state_set_waiters
+                         if _confirms(product_state, expected)]
+            self._state_set_waiters = [
+                waiter for waiter in self._state_set_waiters
+                if waiter[1] not in confirmed]
+        for future in confirmed:
+            future.set_result(True)
 
     def _parse_command_args(self, **kwargs):
         """Parse command arguments.
@@ -225,51 +396,23 @@ class DysonPureCoolLink(DysonDevice):
         :param kwargs Arguments
         :return payload dictionary
         """
-        fan_mode = kwargs.get('fan_mode')
-        oscillation = kwargs.get('oscillation')
-        fan_speed = kwargs.get('fan_speed')
-        night_mode = kwargs.get('night_mode')
-        quality_target = kwargs.get('quality_target')
-        standby_monitoring = kwargs.get('standby_monitoring')
-        sleep_timer = kwargs.get('sleep_timer')
-        reset_filter = kwargs.get('reset_filter')
-
-        f_mode = fan_mode.value if fan_mode \
-            else self._current_state.fan_mode
-        f_speed = fan_speed.value if fan_speed \
-            else self._current_state.speed
-        f_oscillation = oscillation.value if oscillation \
-            else self._current_state.oscillation
-        f_night_mode = night_mode.value if night_mode \
-            else self._current_state.night_mode
-        f_quality_target = quality_target.value if quality_target \
-            else self._current_state.quality_target
-        f_standby_monitoring = standby_monitoring.value if \
-            standby_monitoring else self._current_state.standby_monitoring
-        f_sleep_timer = sleep_timer if sleep_timer or isinstance(
-            sleep_timer, int) else "STET"
-        f_reset_filter = reset_filter.value if reset_filter \
-            else "STET"
-
-        return {
-            "fmod": f_mode,
-            "fnsp": f_speed,
-            "oson": f_oscillation,
-            "sltm": f_sleep_timer,  # sleep timer
-            "rhtm": f_standby_monitoring,  # monitor air quality
-            # when inactive
-            "rstf": f_reset_filter,  # reset filter lifecycle
-            "qtar": f_quality_target,
-            "nmod": f_night_mode
-        }
+        return self._COMMAND_ENCODER.data(kwargs, self._current_state)
 
     def set_configuration(self, **kwargs):
         """Configure fan.
 
+        Fields not given are sent with their current value. Only the
+        fields given are compared to confirm the configuration.
+
         :param kwargs: Parameters
+        :return: CommandFuture, see set_fan_configuration()
         """
-        data = self._parse_command_args(**kwargs)
-        self.set_fan_configuration(data)
+        if self._command_buffer is not None:
+            data = self._parse_command_args(**kwargs)
+            return self._buffer_configuration(
+                data, self._COMMAND_ENCODER.given(kwargs, data))
+        return self._command_future(self._send_payload(
+            *self._COMMAND_ENCODER.encode(kwargs, self._current_state)))
 
     @property
     def environmental_state(self):
@@ -281,6 +424,26 @@ class DysonPureCoolLink(DysonDevice):
         """Set Environmental Device state."""
         self._environmental_state = value
 
+    @property
+    def command_timeout(self):
+        """Time in seconds commands wait for the device confirmation."""
+        return self._command_timeout
+
+    @command_timeout.setter
+    def command_timeout(self, value):
+        """Set time commands wait for the device confirmation."""
+        self._command_timeout = value
+
+    @property
+    def sensor_interval(self):
+        """Interval in seconds between two environmental data requests."""
+        return self._sensor_interval
+
+    @sensor_interval.setter
+    def sensor_interval(self, value):
+        """Set interval between two environmental data requests."""
+        self._sensor_interval = value
+
     @property
     def connected(self):
         """Device connected."""
@@ -297,30 +460,100 @@ class DysonPureCoolLink(DysonDevice):
         return 'DysonPureCoolLink(' + ",".join(printable_fields(fields)) + ')'
 
 
-class EnvironmentalSensorThread(Thread):
-    """Environmental Sensor thread.
+def _chain_buffered(future, buffered):
+    """Resolve the future of a buffered configuration.
 
-    The device don't send environmental data if not asked.
+    :param future: CommandFuture returned to the caller
+    :param buffered: Future of the command buffer, resolved with the
+                     CommandFuture of the merged configuration
     """
+    if buffered.cancelled() or buffered.exception() is not None:
+        future.set_result(False)
+        return
+    sent = buffered.result()
+    future.info = sent.info
+    sent.add_done_callback(lambda done: future.set_result(done.result()))
+
+
+def _confirms(product_state, expected):
+    """Return True if a STATE-CHANGE reports the expected values.
 
-    def __init__(self, request_data_method, interval=30):
-        """Create new Environmental Sensor thread."""
-        Thread.__init__(self)
-        self._interval = interval
-        self._request_data_method = request_data_method
-        self._stop_queue = Queue()
-
-    def stop(self):
-        """Stop the thread."""
-        self._stop_queue.put_nowait(True)
-
-    def run(self):
-        """Start Refresh sensor state thread."""
-        stopped = False
-        while not stopped:
-            self._request_data_method()
-            try:
-                stopped = self._stop_queue.get(timeout=self._interval)
-            except Empty:
-                # Thread has not been stopped
-                pass
+    :param product_state: product-state of the STATE-CHANGE message
+    :param expected: Expected (field, value) pairs
+    """
+    reported = False
+    for field, value in expected:
+        change = product_state.get(field)
+        if change is None:
+            continue
+        if (change[1] if isinstance(change, list) else change) != value:
+            return False
+        reported = True
+    return reported
+
+
+def _state_class(product_type):
+    """Return the state class used by the given product type."""
+    if support_heating(product_type):
+        return DysonPureHotCoolState
+    if support_heating_v2(product_type):
+        return DysonPureHotCoolV2State
+    if is_pure_cool_v2(product_type):
+        return DysonPureCoolV2State
+    return DysonPureCoolState
+
+
+def _environmental_state_class(product_type):
+    """Return the environmental state class used by the given product type."""
+    if is_pure_cool_v2(product_type):
+        return DysonEnvironmentalSensorV2State
+    return DysonEnvironmentalSensorState
+
+
+def _on_state_message(device, json_message):
+    """Handle a CURRENT-STATE or STATE-CHANGE message.
+
+    :param device: Device receiving the message
+    :param json_message: Decoded message
+    """
+    state_class = _state_class(device.product_type)
+    previous = device.state if isinstance(device.state, state_class) \
+        else None
+    device_msg = state_class(json_message, previous)
+    if previous is not None:
+        changes = device_msg.diff(previous)
+    elif json_message['msg'] == "STATE-CHANGE":
+        changes = product_state_changes(json_message['product-state'])
+    else:
+        changes = device_msg.diff(None)
+    if not device.device_available:
+        device.state_data_available()
+    device.state = device_msg
+    if json_message['msg'] == "STATE-CHANGE":
+        device.confirm_state_set(json_message['product-state'])
+    for function in device.callback_message:
+        function(device_msg)
+    device.notify_state_changes(device_msg, changes)
+
+
+def _on_environmental_state_message(device, json_message):
+    """Handle an ENVIRONMENTAL-CURRENT-SENSOR-DATA message.
+
+    :param device: Device receiving the message
+    :param json_message: Decoded message
+    """
+    device_msg = _environmental_state_class(device.product_type)(
+        json_message)
+    if not device.device_available:
+        device.sensor_data_available()
+    device.environmental_state = device_msg
+    for function in device.callback_message:
+        function(device_msg)
+
+
+# Message handlers indexed by the "msg" field of the payload
+MESSAGE_HANDLERS = {
+    "CURRENT-STATE": _on_state_message,
+    "STATE-CHANGE": _on_state_message,
+    "ENVIRONMENTAL-CURRENT-SENSOR-DATA": _on_environmental_state_message
+}
@@ -3,6 +3,7 @@
 import logging
 
 from .const import HeatMode
+from .dyson_command_encoder import CommandEncoder, EnumField, ValueField
 from .dyson_pure_cool import DysonPureCool
 from .utils import printable_fields
 
@@ -12,26 +13,10 @@ _LOGGER = logging.getLogger(__name__)
 class DysonPureHotCool(DysonPureCool):
     """Dyson new Pure Hot+Cool device."""
 
-    def _parse_command_args(self, **kwargs):
-        """Parse command arguments.
-
-        :param kwargs Arguments
-        :return payload dictionary
-        """
-        data = super()._parse_command_args(**kwargs)
-
-        heat_target = kwargs.get('heat_target')
-        heat_mode = kwargs.get('heat_mode')
-
-        f_heat_target = heat_target if heat_target \
-            else self._current_state.heat_target
-        f_heat_mode = heat_mode.value if heat_mode \
-            else self._current_state.heat_mode
-
-        data["hmax"] = f_heat_target
-        data["hmod"] = f_heat_mode
-
-        return data
+    _COMMAND_ENCODER = CommandEncoder(
+        DysonPureCool._COMMAND_ENCODER.fields + (
+            ValueField("hmax", "heat_target", "heat_target"),
+            EnumField("hmod", "heat_mode", HeatMode, "heat_mode")))
 
     def enable_heat_mode(self):
         """Turn on head mode."""
@@ -39,7 +24,7 @@ class DysonPureHotCool(DysonPureCool):
             "hmod": HeatMode.HEAT_ON.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def disable_heat_mode(self):
         """Turn off head mode."""
@@ -47,7 +32,7 @@ class DysonPureHotCool(DysonPureCool):
             "hmod": HeatMode.HEAT_OFF.value
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def set_heat_target(self, heat_target):
         """Set temperature target.
@@ -63,7 +48,7 @@ class DysonPureHotCool(DysonPureCool):
             "hmax": heat_target
         }
 
-        self.set_fan_configuration(data)
+        return self.set_fan_configuration(data)
 
     def __repr__(self):
         """Return a String representation."""
@@ -2,6 +2,8 @@
 
 import logging
 
+from .const import HeatMode, FocusMode
+from .dyson_command_encoder import CommandEncoder, EnumField, ValueField
 from .dyson_pure_cool_link import DysonPureCoolLink
 from .utils import printable_fields
 
@@ -11,34 +13,11 @@ _LOGGER = logging.getLogger(__name__)
 class DysonPureHotCoolLink(DysonPureCoolLink):
     """Dyson Pure Hot+Cool device."""
 
-    def _parse_command_args(self, **kwargs):
-        """Parse command arguments.
-
-        :param kwargs Arguments
-        :return payload dictionary
-        """
-        data = super()._parse_command_args(**kwargs)
-        heat_mode = kwargs.get('heat_mode')
-        heat_target = kwargs.get('heat_target')
-        focus_mode = kwargs.get('focus_mode')
-        f_heat_mode = heat_mode.value if heat_mode \
-            else self._current_state.heat_mode
-        f_heat_target = heat_target if heat_target \
-            else self._current_state.heat_target
-        f_fan_focus = focus_mode.value if focus_mode \
-            else self._current_state.focus_mode
-        data["hmod"] = f_heat_mode
-        data["ffoc"] = f_fan_focus
-        data["hmax"] = f_heat_target
-        return data
-
-    def set_configuration(self, **kwargs):
-        """Configure fan.
-
-        :param kwargs: Parameters
-        """
-        data = self._parse_command_args(**kwargs)
-        self.set_fan_configuration(data)
+    _COMMAND_ENCODER = CommandEncoder(
+        DysonPureCoolLink._COMMAND_ENCODER.fields + (
+            EnumField("hmod", "heat_mode", HeatMode, "heat_mode"),
+            EnumField("ffoc", "focus_mode", FocusMode, "focus_mode"),
+            ValueField("hmax", "heat_target", "heat_target")))
 
     def __repr__(self):
         """Return a String representation."""
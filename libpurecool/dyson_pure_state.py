@@ -2,80 +2,64 @@
 
 # pylint: disable=too-many-public-methods,too-many-instance-attributes
 
-import json
-from .utils import printable_fields
+from .dyson_state import DysonProductState
+from .utils import printable_fields, load_message
 
 
-class DysonPureCoolState:
-    """Dyson device state."""
+class DysonPureCoolState(DysonProductState):
+    """Dyson device state.
+
+    Fields are resolved from the product-state of the message, with their
+    strings interned, when the state is built.
+    """
+
+    __slots__ = ()
 
     @staticmethod
     def is_state_message(payload):
         """Return true if this message is a Dyson Pure state message."""
-        return json.loads(payload)['msg'] in ["CURRENT-STATE", "STATE-CHANGE"]
-
-    @staticmethod
-    def _get_field_value(state, field):
-        """Get field value."""
-        return state[field][1] if isinstance(state[field], list) else state[
-            field]
-
-    def __init__(self, payload):
-        """Create a new state.
-
-        :param product_type: Product type
-        :param payload: Message payload
-        """
-        json_message = json.loads(payload)
-        self._state = json_message['product-state']
-        self._fan_mode = self._get_field_value(self._state, 'fmod')
-        self._fan_state = self._get_field_value(self._state, 'fnst')
-        self._night_mode = self._get_field_value(self._state, 'nmod')
-        self._speed = self._get_field_value(self._state, 'fnsp')
-        self._oscilation = self._get_field_value(self._state, 'oson')
-        self._filter_life = self._get_field_value(self._state, 'filf')
-        self._quality_target = self._get_field_value(self._state, 'qtar')
-        self._standby_monitoring = self._get_field_value(self._state, 'rhtm')
+        return load_message(payload)['msg'] in ["CURRENT-STATE",
+                                                "STATE-CHANGE"]
 
     @property
     def fan_mode(self):
         """Fan mode."""
-        return self._fan_mode
+        return self._state['fmod']
 
     @property
     def fan_state(self):
         """Fan state."""
-        return self._fan_state
+        return self._state['fnst']
 
     @property
     def night_mode(self):
         """Night mode."""
-        return self._night_mode
+        return self._state['nmod']
 
     @property
     def speed(self):
         """Fan speed."""
-        return self._speed
+        return self._state['fnsp']
 
     @property
     def oscillation(self):
         """Oscillation mode."""
-        return self._oscilation
+        return self._state['oson']
 
     @property
     def filter_life(self):
         """Filter life."""
-        return self._filter_life
+        return self._state['filf']
 
     @property
     def quality_target(self):
         """Air quality target."""
-        return self._quality_target
+        return self._state['qtar']
 
     @property
     def standby_monitoring(self):
         """Monitor when inactive (standby)."""
-        return self._standby_monitoring
+        return self._state['rhtm']
 
     def __repr__(self):
         """Return a String representation."""
@@ -90,12 +74,17 @@ class DysonPureCoolState:
 
 
 class DysonEnvironmentalSensorState:
-    """Environmental sensor state."""
+    """Environmental sensor state.
+
+    Sensor values are decoded from the message data when accessed.
+    """
+
+    __slots__ = ('_data',)
 
     @staticmethod
     def is_environmental_state_message(payload):
         """Return true if this message is a state message."""
-        json_message = json.loads(payload)
+        json_message = load_message(payload)
         return json_message['msg'] in ["ENVIRONMENTAL-CURRENT-SENSOR-DATA"]
 
     @staticmethod
@@ -107,46 +96,39 @@ class DysonEnvironmentalSensorState:
     def __init__(self, payload):
         """Create a new Environmental sensor state.
 
-        :param payload: Message payload
+        :param payload: Message payload or decoded message
         """
-        json_message = json.loads(payload)
-        data = json_message['data']
-        humidity = self.__get_field_value(data, 'hact')
-        self._humidity = 0 if humidity == 'OFF' else int(humidity)
-        volatil_copounds = self.__get_field_value(data, 'vact')
-        self._volatil_compounds = 0 if volatil_copounds == 'INIT' else int(
-            volatil_copounds)
-        temperature = self.__get_field_value(data, 'tact')
-        self._temperature = 0 if temperature == 'OFF' else float(
-            temperature) / 10
-        self._dust = int(self.__get_field_value(data, 'pact'))
-        sltm = self.__get_field_value(data, 'sltm')
-        self._sleep_timer = 0 if sltm == 'OFF' else int(sltm)
+        json_message = load_message(payload)
+        self._data = json_message['data']
 
     @property
     def humidity(self):
         """Humidity in percent."""
-        return self._humidity
+        humidity = self.__get_field_value(self._data, 'hact')
+        return 0 if humidity == 'OFF' else int(humidity)
 
     @property
     def volatil_organic_compounds(self):
         """Volatil organic compounds level."""
-        return self._volatil_compounds
+        volatil_copounds = self.__get_field_value(self._data, 'vact')
+        return 0 if volatil_copounds == 'INIT' else int(volatil_copounds)
 
     @property
     def temperature(self):
         """Temperature in Kelvin."""
-        return self._temperature
+        temperature = self.__get_field_value(self._data, 'tact')
+        return 0 if temperature == 'OFF' else float(temperature) / 10
 
     @property
     def dust(self):
         """Dust level."""
-        return self._dust
+        return int(self.__get_field_value(self._data, 'pact'))
 
     @property
     def sleep_timer(self):
         """Sleep timer."""
-        return self._sleep_timer
+        sltm = self.__get_field_value(self._data, 'sltm')
+        return 0 if sltm == 'OFF' else int(sltm)
 
     def __repr__(self):
         """Return a String representation."""
@@ -154,7 +136,7 @@ class DysonEnvironmentalSensorState:
                   ("air quality", str(self.volatil_organic_compounds)),
                   ("temperature", str(self.temperature)),
                   ("dust", str(self.dust)),
-                  ("sleep_timer", str(self._sleep_timer))]
+                  ("sleep_timer", str(self.sleep_timer))]
         return 'DysonEnvironmentalSensorState(' + ",".join(
             printable_fields(fields)) + ')'
 
@@ -162,48 +144,32 @@ class DysonEnvironmentalSensorState:
 class DysonPureHotCoolState(DysonPureCoolState):
     """Dyson device state."""
 
-    def __init__(self, payload):
-        """Create a new Dyson Hot+Cool state.
-
-        :param product_type: Product type
-        :param payload: Message payload
-        """
-        super().__init__(payload)
-
-        self._tilt = DysonPureCoolState._get_field_value(self._state, 'tilt')
-        self._fan_focus = DysonPureCoolState._get_field_value(self._state,
-                                                              'ffoc')
-        self._heat_target = DysonPureCoolState._get_field_value(self._state,
-                                                                'hmax')
-        self._heat_mode = DysonPureCoolState._get_field_value(self._state,
-                                                              'hmod')
-        self._heat_state = DysonPureCoolState._get_field_value(self._state,
-                                                               'hsta')
+    __slots__ = ()
 
     @property
     def tilt(self):
         """Return tilt status."""
-        return self._tilt
+        return self._state['tilt']
 
     @property
     def focus_mode(self):
         """Focus the fan on one stream or spread."""
-        return self._fan_focus
+        return self._state['ffoc']
 
     @property
     def heat_target(self):
         """Heat target of the temperature."""
-        return self._heat_target
+        return self._state['hmax']
 
     @property
     def heat_mode(self):
         """Heat mode on or off."""
-        return self._heat_mode
+        return self._state['hmod']
 
     @property
     def heat_state(self):
         """Return heat state."""
-        return self._heat_state
+        return self._state['hsta']
 
     def __repr__(self):
         """Return a String representation."""
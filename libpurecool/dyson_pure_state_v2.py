@@ -2,115 +2,100 @@
 
 # pylint: disable=too-many-public-methods,too-many-instance-attributes
 
-import json
-
 from .const import SENSOR_INIT_STATES
-from .utils import printable_fields, get_field_value
+from .dyson_state import DysonProductState
+from .utils import printable_fields, get_field_value, load_message
 
 
-class DysonPureCoolV2State:
-    """Dyson device state."""
+def _sensor_value(data, field):
+    """Return the integer value of a sensor field, 0 while not available."""
+    value = get_field_value(data, field)
+    return 0 if value in SENSOR_INIT_STATES else int(value)
 
-    def __init__(self, payload):
-        """Create a new state.
 
-        :param payload: Message payload
-        """
-        json_message = json.loads(payload)
-        self._state = json_message['product-state']
-        self._fan_power = get_field_value(self._state, 'fpwr')
-        self._front_direction = get_field_value(self._state, 'fdir')
-        self._auto_mode = get_field_value(self._state, 'auto')
-        self._oscillation_status = get_field_value(self._state, 'oscs')
-        self._oscillation = get_field_value(self._state, 'oson')
-        self._night_mode = get_field_value(self._state, 'nmod')
-        self._continuous_monitoring = \
-            get_field_value(self._state, 'rhtm')
-        self._fan_state = get_field_value(self._state, 'fnst')
-        self._night_mode_speed = get_field_value(self._state, 'nmdv')
-        self._speed = get_field_value(self._state, 'fnsp')
-        self._carbon_filter_state = get_field_value(self._state, 'cflr')
-        self._hepa_filter_state = get_field_value(self._state, 'hflr')
-        self._sleep_timer = get_field_value(self._state, 'sltm')
-        self._oscillation_angle_low = \
-            get_field_value(self._state, 'osal')
-        self._oscillation_angle_high = \
-            get_field_value(self._state, 'osau')
+class DysonPureCoolV2State(DysonProductState):
+    """Dyson device state.
+
+    Fields are resolved from the product-state of the message, with their
+    strings interned, when the state is built.
+    """
+
+    __slots__ = ()
 
     @property
     def fan_power(self):
         """Fan on/off."""
-        return self._fan_power
+        return self._state['fpwr']
 
     @property
     def front_direction(self):
         """Airflow front/back direction."""
-        return self._front_direction
+        return self._state['fdir']
 
     @property
     def auto_mode(self):
         """Auto mode."""
-        return self._auto_mode
+        return self._state['auto']
 
     @property
     def oscillation_status(self):
         """Oscillation. Can be IDLE if auto mode is on."""
-        return self._oscillation_status
+        return self._state['oscs']
 
     @property
     def oscillation(self):
         """Oscillation mode."""
-        return self._oscillation
+        return self._state['oson']
 
     @property
     def night_mode(self):
         """Night mode."""
-        return self._night_mode
+        return self._state['nmod']
 
     @property
     def continuous_monitoring(self):
         """Monitor when inactive (standby)."""
-        return self._continuous_monitoring
+        return self._state['rhtm']
 
     @property
     def fan_state(self):
         """Fan state."""
-        return self._fan_state
+        return self._state['fnst']
 
     @property
     def night_mode_speed(self):
         """Night mode fan speed."""
-        return self._night_mode_speed
+        return self._state['nmdv']
 
     @property
     def speed(self):
         """Fan speed."""
-        return self._speed
+        return self._state['fnsp']
 
     @property
     def carbon_filter_state(self):
         """State of crabon filter in percentage."""
-        return self._carbon_filter_state
+        return self._state['cflr']
 
     @property
     def hepa_filter_state(self):
         """State of crabon filter in percentage."""
-        return self._hepa_filter_state
+        return self._state['hflr']
 
     @property
     def sleep_timer(self):
         """Sleep timer."""
-        return self._sleep_timer
+        return self._state['sltm']
 
     @property
     def oscillation_angle_low(self):
         """Lower oscillation angle."""
-        return self._oscillation_angle_low
+        return self._state['osal']
 
     @property
     def oscillation_angle_high(self):
         """Higher oscillation angle."""
-        return self._oscillation_angle_high
+        return self._state['osau']
 
     def __repr__(self):
         """Return a String representation."""
@@ -134,98 +119,67 @@ class DysonPureCoolV2State:
 
 
 class DysonEnvironmentalSensorV2State:
-    """Environmental sensor state."""
+    """Environmental sensor state.
+
+    Sensor values are decoded from the message data when accessed.
+    """
+
+    __slots__ = ('_data',)
 
     def __init__(self, payload):
         """Create a new Environmental sensor state.
 
-        :param payload: Message payload
+        :param payload: Message payload or decoded message
         """
-        json_message = json.loads(payload)
-        data = json_message['data']
-
-        temperature = get_field_value(data, 'tact')
-        self._temperature = 0 if temperature in SENSOR_INIT_STATES else float(
-            temperature) / 10
-
-        humidity = get_field_value(data, 'hact')
-        self._humidity = 0 if humidity in SENSOR_INIT_STATES else int(humidity)
-
-        particulate_matter_25 = get_field_value(data, 'pm25')
-        self._particulate_matter_25 = 0 \
-            if particulate_matter_25 in SENSOR_INIT_STATES \
-            else int(particulate_matter_25)
-
-        particulate_matter_10 = get_field_value(data, 'pm10')
-        self._particulate_matter_10 = 0 \
-            if particulate_matter_10 in SENSOR_INIT_STATES \
-            else int(particulate_matter_10)
-
-        volatile_organic_compounds = get_field_value(data, 'va10')
-        self._volatile_organic_compounds = 0 \
-            if volatile_organic_compounds in SENSOR_INIT_STATES \
-            else int(volatile_organic_compounds)
-
-        nitrogen_dioxide = get_field_value(data, 'noxl')
-        self._nitrogen_dioxide = 0 if nitrogen_dioxide in SENSOR_INIT_STATES \
-            else int(nitrogen_dioxide)
-
-        p25r = get_field_value(data, 'p25r')
-        self._p25r = 0 if p25r in SENSOR_INIT_STATES \
-            else int(p25r)
-
-        p10r = get_field_value(data, 'p10r')
-        self._p10r = 0 if p10r in SENSOR_INIT_STATES \
-            else int(p10r)
-
-        sleep_timer = get_field_value(data, 'sltm')
-        self._sleep_timer = 0 if sleep_timer in SENSOR_INIT_STATES \
-            else int(sleep_timer)
+        json_message = load_message(payload)
+        self._data = json_message['data']
 
     @property
     def temperature(self):
         """Temperature in Kelvin."""
-        return self._temperature
+        temperature = get_field_value(self._data, 'tact')
+        return 0 if temperature in SENSOR_INIT_STATES else float(
+            temperature) / 10
 
     @property
     def humidity(self):
         """Humidity in percent."""
-        return self._humidity
+        return _sensor_value(self._data, 'hact')
 
     @property
     def particulate_matter_25(self):
         """Particulate matter under 2.5microns."""
-        return self._particulate_matter_25
+        return _sensor_value(self._data, 'pm25')
 
     @property
     def particulate_matter_10(self):
         """Particulate matter under 10microns."""
-        return self._particulate_matter_10
+        return _sensor_value(self._data, 'pm10')
 
     @property
     def volatile_organic_compounds(self):
         """Volatile organic compounds level."""
-        return self._volatile_organic_compounds
+        return _sensor_value(self._data, 'va10')
 
     @property
     def nitrogen_dioxide(self):
         """Nitrogen dioxide level."""
-        return self._nitrogen_dioxide
+        return _sensor_value(self._data, 'noxl')
 
     @property
     def p25r(self):
         """Unknown."""
-        return self._p25r
+        return _sensor_value(self._data, 'p25r')
 
     @property
     def p10r(self):
         """Unknown."""
-        return self._p10r
+        return _sensor_value(self._data, 'p10r')
 
     @property
     def sleep_timer(self):
         """Sleep timer."""
-        return self._sleep_timer
+        return _sensor_value(self._data, 'sltm')
 
     def __repr__(self):
         """Return a String representation."""
@@ -246,37 +200,27 @@ class DysonEnvironmentalSensorV2State:
 class DysonPureHotCoolV2State(DysonPureCoolV2State):
     """Dyson device state."""
 
-    def __init__(self, payload):
-        """Create a new Dyson Hot+Cool state.
-
-        :param payload: Message payload
-        """
-        super().__init__(payload)
-
-        self._tilt = get_field_value(self._state, 'tilt')
-        self._heat_target = get_field_value(self._state, 'hmax')
-        self._heat_mode = get_field_value(self._state, 'hmod')
-        self._heat_state = get_field_value(self._state, 'hsta')
+    __slots__ = ()
 
     @property
     def heat_state(self):
         """Return heat state."""
-        return self._heat_state
+        return self._state['hsta']
 
     @property
     def heat_target(self):
         """Heat target of the temperature."""
-        return self._heat_target
+        return self._state['hmax']
 
     @property
     def tilt(self):
         """Return tilt status."""
-        return self._tilt
+        return self._state['tilt']
 
     @property
     def heat_mode(self):
         """Heat mode on or off."""
-        return self._heat_mode
+        return self._state['hmod']
 
     def __repr__(self):
         """Return a String representation."""
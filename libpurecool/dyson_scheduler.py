@@ -0,0 +1,165 @@
+"""Environmental sensor data scheduler.
+
+Fans only send environmental data when asked: one scheduler thread
+requests them periodically for every connected fan.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import time
+from threading import Thread, Condition, Lock
+
+_LOGGER = logging.getLogger(__name__)
+
+# Default interval in seconds between two environmental data requests
+SENSOR_INTERVAL = 30
+# Max delay in seconds between two checks of a disconnected device
+MAX_BACKOFF = 300
+# Default max relative variation of the intervals
+JITTER = 0.1
+
+_DEFAULT_SCHEDULER = None
+_DEFAULT_SCHEDULER_LOCK = Lock()
+
+
+def default_scheduler():
+    """Return the scheduler shared by devices of the process."""
+    global _DEFAULT_SCHEDULER  # pylint: disable=global-statement
+    with _DEFAULT_SCHEDULER_LOCK:
+        if _DEFAULT_SCHEDULER is None:
+            _DEFAULT_SCHEDULER = SensorScheduler()
+        return _DEFAULT_SCHEDULER
+
+
+def jittered(interval, jitter=JITTER):
+    """Return interval randomly spread by jitter.
+
+    :param interval: Interval in seconds
+    :param jitter: Max relative variation (0.1: +-10%)
+    """
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+class _Entry:
+    # pylint: disable=too-few-public-methods
+    """Device polled by the scheduler."""
+
+    __slots__ = ('device', 'cancelled', 'backoff')
+
+    def __init__(self, device):
+        self.device = device
+        self.cancelled = False
+        self.backoff = None
+
+
+class SensorScheduler:
+    """Request environmental data of many devices from one thread.
+
+    Each device is polled every device.sensor_interval seconds, randomly
+    spread by jitter to avoid requesting every device at the same time.
+    Disconnected devices are checked less and less often, up to
+    max_backoff seconds.
+    """
+
+    def __init__(self, jitter=JITTER, max_backoff=MAX_BACKOFF):
+        """Create a new scheduler.
+
+        :param jitter: Max relative variation of the intervals (0.1: +-10%)
+        :param max_backoff: Max delay in seconds between two checks of a
+                            disconnected device
+        """
+        self._jitter = jitter
+        self._max_backoff = max_backoff
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._thread = None
+
+    @property
+    def devices(self):
+        """Polled devices."""
+        with self._condition:
+            return [entry.device for entry in self._entries.values()]
+
+    def add(self, device):
+        """Request environmental data of a device periodically.
+
+        The first request is sent after one interval: the device is expected
+        to have requested data when connecting. A device already polled is
+        rescheduled.
+
+        :param device: Fan device
+        """
+        with self._condition:
+            self._cancel(device)
+            entry = _Entry(device)
+            self._entries[device.serial] = entry
+            self._push(entry, jittered(device.sensor_interval, self._jitter))
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name="DysonSensorScheduler",
+                                      daemon=True)
+                self._thread.start()
+
+    def remove(self, device):
+        """Stop requesting environmental data of a device."""
+        with self._condition:
+            self._cancel(device)
+
+    def _cancel(self, device):
+        entry = self._entries.pop(device.serial, None)
+        if entry is not None:
+            entry.cancelled = True
+
+    def _push(self, entry, delay):
+        heapq.heappush(self._heap, (time.monotonic() + delay,
+                                    next(self._sequence), entry))
+        self._condition.notify()
+
+    def _next_entry(self):
+        """Wait for the next device to poll."""
+        with self._condition:
+            while True:
+                if self._heap:
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        return heapq.heappop(self._heap)[2]
+                else:
+                    delay = None
+                self._condition.wait(delay)
+
+    def _poll(self, entry):
+        """Request environmental data of a device.
+
+        :return: Delay in seconds before polling the device again
+        """
+        device = entry.device
+        if device.connected:
+            entry.backoff = None
+            try:
+                device.request_environmental_state()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Unable to request environmental data of "
+                                  "device %s", device.serial)
+            return jittered(device.sensor_interval, self._jitter)
+        # Device disconnected, wait longer before checking it again
+        entry.backoff = min(
+            entry.backoff * 2 if entry.backoff else device.sensor_interval,
+            self._max_backoff)
+        _LOGGER.debug("Device %s disconnected, check again in %ss",
+                      device.serial, entry.backoff)
+        return jittered(entry.backoff, self._jitter)
+
+    def _run(self):
+        """Poll devices when they are due."""
+        while True:
+            entry = self._next_entry()
+            if entry.cancelled:
+                continue
+            delay = self._poll(entry)
+            with self._condition:
+                if not entry.cancelled:
+                    self._push(entry, delay)
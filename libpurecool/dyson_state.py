@@ -0,0 +1,119 @@
+"""Base Dyson states."""
+
+import sys
+from collections import namedtuple
+
+from .utils import load_message
+
+_MISSING = object()
+
+# Change of a product-state field between two states
+StateChange = namedtuple('StateChange', ['field', 'old', 'new'])
+
+
+def intern_value(value):
+    """Return the interned value when it is a string, else the value.
+
+    :param value: Field value
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def resolve_product_state(product_state, previous_state=None):
+    """Return the product-state with every field resolved to its value.
+
+    STATE-CHANGE [old, new] pairs are reduced to the new value and strings
+    are interned. Values that did not change are taken from the previous
+    resolved state, which is returned as is if no field changed.
+
+    :param product_state: product-state of a decoded message
+    :param previous_state: Previous resolved product-state (can be None)
+    """
+    if previous_state is None:
+        previous_state = {}
+    changed = len(product_state) != len(previous_state)
+    resolved = {}
+    for field, value in product_state.items():
+        if isinstance(value, list):
+            value = value[1]
+        old_value = previous_state.get(field, _MISSING)
+        if old_value == value:
+            resolved[field] = old_value
+        else:
+            resolved[field] = intern_value(value)
+            changed = True
+    return resolved if changed else previous_state
+
+
+def product_state_changes(product_state):
+    """Return the changes listed in a STATE-CHANGE product-state.
+
+    :param product_state: product-state of a decoded message
+    """
+    return [StateChange(field, value[0], value[1])
+            for field, value in product_state.items()
+            if isinstance(value, list) and value[0] != value[1]]
+
+
+class DysonProductState:
+    """Immutable snapshot of the product-state of a Dyson fan.
+
+    Snapshots are hashable and compare equal when they have the same type
+    and field values.
+    """
+
+    __slots__ = ('_state', '_hash')
+
+    def __init__(self, payload, previous=None):
+        """Create a new state.
+
+        :param payload: Message payload or decoded message
+        :param previous: Previous state of the device. Unchanged values are
+                         shared with it instead of being decoded again.
+        """
+        json_message = load_message(payload)
+        previous_state = previous._state if previous is not None else None
+        self._state = resolve_product_state(json_message['product-state'],
+                                            previous_state)
+        self._hash = None
+
+    def diff(self, previous):
+        """Return the list of changes from the previous state.
+
+        Fields missing from one of the states have a None value.
+
+        :param previous: Previous state (can be None)
+        """
+        # pylint: disable=protected-access
+        previous_state = previous._state if previous is not None else {}
+        if previous_state is self._state:
+            return []
+        changes = [StateChange(field, previous_state.get(field), value)
+                   for field, value in self._state.items()
+                   if previous_state.get(field, _MISSING) != value]
+        changes.extend(StateChange(field, value, None)
+                       for field, value in previous_state.items()
+                       if field not in self._state)
+        return changes
+
+    def __setattr__(self, name, value):
+        """Prevent state modification once a value is set."""
+        if getattr(self, name, None) is not None:
+            raise AttributeError(
+                "{0} is immutable".format(type(self).__name__))
+        super().__setattr__(name, value)
+
+    def __eq__(self, other):
+        """Return True if both states have the same values."""
+        if type(self) is not type(other):
+            return NotImplemented
+        # pylint: disable=protected-access
+        return self._state is other._state or self._state == other._state
+
+    def __hash__(self):
+        """Return the hash of the state values."""
+        if self._hash is None:
+            self._hash = hash((type(self), frozenset(self._state.items())))
+        return self._hash
@@ -45,3 +45,28 @@ class DysonNotLoggedException(Exception):
     def __init__(self):
         """Dyson Not Logged Exception."""
         super(DysonNotLoggedException, self).__init__()
+
+
+class DysonConnectionException(Exception):
+    """Device connection Exception."""
+
+    def __init__(self, phase, reason):
+        """Dyson connection exception.
+
+        :param phase Connection phase which failed (ex. "connack")
+        :param reason Failure reason
+        """
+        super(DysonConnectionException, self).__init__(
+            "{0}: {1}".format(phase, reason))
+        self._phase = phase
+        self._reason = reason
+
+    @property
+    def phase(self):
+        """Connection phase which failed."""
+        return self._phase
+
+    @property
+    def reason(self):
+        """Failure reason."""
+        return self._reason
@@ -1,11 +1,19 @@
 """Utilities for Dyson Pure Hot+Cool link devices."""
 import json
 import base64
+import logging
 from Crypto.Cipher import AES
 from .const import DYSON_PURE_HOT_COOL_LINK_TOUR, \
     DYSON_360_EYE, DYSON_PURE_COOL, DYSON_PURE_COOL_DESKTOP, \
     DYSON_PURE_HOT_COOL, DYSON_PURE_COOL_HUMIDIFY
 
+# AES key and initialization vector of the devices local credentials
+_KEY = b'\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f\x10' \
+       b'\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f '
+_INIT_VECTOR = b'\x00' * AES.block_size
+
+_LOGGER = logging.getLogger(__name__)
+
 
 def support_heating(product_type):
     """Return True if device_model support heating mode, else False.
@@ -66,19 +74,59 @@ def unpad(string):
     return string[:-ord(string[len(string) - 1:])]
 
 
+def _decrypt_password(cipher, encrypted_password):
+    """Decrypt a password (CBC mode, null initialization vector).
+
+    The blocks are decrypted by an ECB cipher, which can be shared by many
+    passwords, then XORed with the previous encrypted block as in CBC.
+
+    :param cipher: AES cipher in ECB mode with the credentials key
+    :param encrypted_password: Encrypted password (LocalCredentials)
+    :raise ValueError: if the password cannot be decrypted
+    """
+    encrypted = base64.b64decode(encrypted_password)
+    if not encrypted:
+        raise ValueError("Invalid credentials: empty")
+    chained = _INIT_VECTOR + encrypted[:-AES.block_size]
+    padded = (int.from_bytes(cipher.decrypt(encrypted), "big") ^
+              int.from_bytes(chained, "big")).to_bytes(len(encrypted), "big")
+    try:
+        return json.loads(padded[:len(padded) - padded[-1]].decode(
+            "utf-8"))["apPasswordHash"]
+    except (IndexError, KeyError, TypeError) as error:
+        raise ValueError("Invalid credentials: {0!r}".format(error)) \
+            from error
+
+
+def decrypt_passwords(encrypted_passwords):
+    """Decrypt the local credentials of many devices.
+
+    One cipher is set up for the whole batch. Each password is decrypted
+    on its own: an invalid password does not prevent the decryption of
+    the others.
+
+    :param encrypted_passwords: Encrypted passwords (LocalCredentials)
+    :return: List of passwords, in the same order. None for the passwords
+             which cannot be decrypted.
+    """
+    cipher = AES.new(_KEY, AES.MODE_ECB)
+    passwords = []
+    for encrypted_password in encrypted_passwords:
+        try:
+            passwords.append(_decrypt_password(cipher, encrypted_password))
+        except ValueError as error:
+            _LOGGER.warning("Unable to decrypt credentials: %s", error)
+            passwords.append(None)
+    return passwords
+
+
 def decrypt_password(encrypted_password):
     """Decrypt password.
 
     :param encrypted_password: Encrypted password
+    :raise ValueError: if the password cannot be decrypted
     """
-    key = b'\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f\x10' \
-          b'\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f '
-    init_vector = b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' \
-                  b'\x00\x00\x00\x00'
-    cipher = AES.new(key, AES.MODE_CBC, init_vector)
-    json_password = json.loads(unpad(
-        cipher.decrypt(base64.b64decode(encrypted_password)).decode('utf-8')))
-    return json_password["apPasswordHash"]
+    return _decrypt_password(AES.new(_KEY, AES.MODE_ECB), encrypted_password)
 
 
 def is_360_eye_device(json_payload):
@@ -97,6 +145,16 @@ def is_dyson_pure_cool_device(json_payload):
     return False
 
 
+def load_message(payload):
+    """Return the decoded JSON message.
+
+    :param payload: Raw message payload or an already decoded message
+    """
+    if isinstance(payload, dict):
+        return payload
+    return json.loads(payload)
+
+
 def get_field_value(state, field):
     """Get field value."""
     return state[field][1] if isinstance(state[field], list) else state[
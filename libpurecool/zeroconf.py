@@ -25,15 +25,16 @@ from __future__ import (
 
 import enum
 import errno
+import heapq
+import itertools
 import logging
 import re
-import select
+import selectors
 import socket
 import struct
 import sys
 import threading
 import time
-from functools import reduce
 
 import netifaces
 from six import binary_type, indexbytes, int2byte, iteritems, text_type
@@ -73,7 +74,7 @@ _MDNS_PORT = 5353
 _DNS_PORT = 53
 _DNS_TTL = 60 * 60  # one hour default TTL
 
-_MAX_MSG_TYPICAL = 1460  # unused
+_MAX_MSG_TYPICAL = 1460
 _MAX_MSG_ABSOLUTE = 8966
 
 _FLAGS_QR_MASK = 0x8000  # query response mask
@@ -596,14 +597,35 @@ class DNSService(DNSRecord):
         return self.to_string("%s:%s" % (self.server, self.port))
 
 
+_HEADER = struct.Struct(b'!6H')
+_QUESTION = struct.Struct(b'!HH')
+_RECORD = struct.Struct(b'!HHiH')
+_UNSIGNED_SHORT = struct.Struct(b'!H')
+_SERVICE = struct.Struct(b'!3H')
+_STRUCTS = {}
+
+
+def _struct(format_):
+    """Returns the compiled struct of a format"""
+    try:
+        return _STRUCTS[format_]
+    except KeyError:
+        return _STRUCTS.setdefault(format_, struct.Struct(format_))
+
+
 class DNSIncoming(QuietLogger):
 
-    """Object representation of an incoming DNS packet"""
+    """Object representation of an incoming DNS packet
+
+    The packet is read through a memoryview: only the values kept by the
+    records are copied. Names are decoded once per packet, compression
+    pointers reuse the names already decoded."""
 
     def __init__(self, data):
         """Constructor from string holding bytes of packet"""
         self.offset = 0
         self.data = data
+        self.view = memoryview(data)
         self.questions = []
         self.answers = []
         self.id = 0
@@ -613,6 +635,8 @@ class DNSIncoming(QuietLogger):
         self.num_authorities = 0
         self.num_additionals = 0
         self.valid = False
+        # Names decoded from each label offset
+        self._names = {}
 
         try:
             self.read_header()
@@ -625,22 +649,24 @@ class DNSIncoming(QuietLogger):
                 'Choked at offset %d while unpacking %r', self.offset, data))
 
     def unpack(self, format_):
-        length = struct.calcsize(format_)
-        info = struct.unpack(
-            format_, self.data[self.offset:self.offset + length])
-        self.offset += length
+        return self.unpack_struct(_struct(format_))
+
+    def unpack_struct(self, struct_):
+        info = struct_.unpack_from(self.view, self.offset)
+        self.offset += struct_.size
         return info
 
     def read_header(self):
         """Reads header portion of packet"""
         (self.id, self.flags, self.num_questions, self.num_answers,
-         self.num_authorities, self.num_additionals) = self.unpack(b'!6H')
+         self.num_authorities, self.num_additionals) = \
+            self.unpack_struct(_HEADER)
 
     def read_questions(self):
         """Reads questions section of packet"""
         for i in xrange(self.num_questions):
             name = self.read_name()
-            type_, class_ = self.unpack(b'!HH')
+            type_, class_ = self.unpack_struct(_QUESTION)
 
             question = DNSQuestion(name, type_, class_)
             self.questions.append(question)
@@ -651,19 +677,22 @@ class DNSIncoming(QuietLogger):
 
     def read_character_string(self):
         """Reads a character string from the packet"""
-        length = indexbytes(self.data, self.offset)
+        length = self.view[self.offset]
         self.offset += 1
         return self.read_string(length)
 
     def read_string(self, length):
         """Reads a string of a given length from the packet"""
-        info = self.data[self.offset:self.offset + length]
+        if self.offset + length > len(self.view):
+            raise IncomingDecodeError(
+                "String out of packet at %s" % (self.offset,))
+        info = self.view[self.offset:self.offset + length].tobytes()
         self.offset += length
         return info
 
     def read_unsigned_short(self):
         """Reads an unsigned short from the packet"""
-        return self.unpack(b'!H')[0]
+        return self.unpack_struct(_UNSIGNED_SHORT)[0]
 
     def read_others(self):
         """Reads the answers, authorities and additionals section of the
@@ -671,7 +700,8 @@ class DNSIncoming(QuietLogger):
         n = self.num_answers + self.num_authorities + self.num_additionals
         for i in xrange(n):
             domain = self.read_name()
-            type_, class_, ttl, length = self.unpack(b'!HHiH')
+            type_, class_, ttl, length = self.unpack_struct(_RECORD)
+            end = self.offset + length
 
             rec = None
             if type_ == _TYPE_A:
@@ -684,10 +714,10 @@ class DNSIncoming(QuietLogger):
                 rec = DNSText(
                     domain, type_, class_, ttl, self.read_string(length))
             elif type_ == _TYPE_SRV:
+                priority, weight, port = self.unpack_struct(_SERVICE)
                 rec = DNSService(
                     domain, type_, class_, ttl,
-                    self.read_unsigned_short(), self.read_unsigned_short(),
-                    self.read_unsigned_short(), self.read_name())
+                    priority, weight, port, self.read_name())
             elif type_ == _TYPE_HINFO:
                 rec = DNSHinfo(
                     domain, type_, class_, ttl,
@@ -695,11 +725,10 @@ class DNSIncoming(QuietLogger):
             elif type_ == _TYPE_AAAA:
                 rec = DNSAddress(
                     domain, type_, class_, ttl, self.read_string(16))
-            else:
-                # Try to ignore types we don't know about
-                # Skip the payload for the resource record so the next
-                # records can be parsed correctly
-                self.offset += length
+            # Skip the rest of the payload, or the payload of the types
+            # we don't know about, so the next records can be parsed
+            # correctly
+            self.offset = end
 
             if rec is not None:
                 self.answers.append(rec)
@@ -714,32 +743,39 @@ class DNSIncoming(QuietLogger):
 
     def read_utf(self, offset, length):
         """Reads a UTF-8 string of a given length from the packet"""
-        return text_type(self.data[offset:offset + length], 'utf-8', 'replace')
+        return text_type(self.view[offset:offset + length], 'utf-8', 'replace')
 
     def read_name(self):
         """Reads a domain name from the packet"""
-        result = ''
+        view = self.view
+        names = self._names
+        labels = []
+        suffix = ''
         off = self.offset
         next_ = -1
         first = off
 
         while True:
-            length = indexbytes(self.data, off)
-            off += 1
+            length = view[off]
             if length == 0:
+                off += 1
                 break
             t = length & 0xC0
             if t == 0x00:
-                result = ''.join((result, self.read_utf(off, length) + '.'))
-                off += length
+                labels.append((off, self.read_utf(off + 1, length)))
+                off += 1 + length
             elif t == 0xC0:
                 if next_ < 0:
-                    next_ = off + 1
-                off = ((length & 0x3F) << 8) | indexbytes(self.data, off)
+                    next_ = off + 2
+                off = ((length & 0x3F) << 8) | view[off + 1]
                 if off >= first:
                     raise IncomingDecodeError(
                         "Bad domain name (circular) at %s" % (off,))
                 first = off
+                if off in names:
+                    # Name already decoded from this label
+                    suffix = names[off]
+                    break
             else:
                 raise IncomingDecodeError("Bad domain name at %s" % (off,))
 
@@ -748,6 +784,10 @@ class DNSIncoming(QuietLogger):
         else:
             self.offset = off
 
+        result = suffix
+        for label_offset, label in reversed(labels):
+            result = ''.join((label, '.', result))
+            names[label_offset] = result
         return result
 
 
@@ -1007,33 +1047,87 @@ class DNSOutgoing(object):
 
 class DNSCache(object):
 
-    """A cache of DNS entries"""
+    """A cache of DNS entries
+
+    Entries are indexed by name, and by (name, type, class) and the value
+    compared by their __eq__ method. Expiration times are kept in a heap,
+    so that only the entries which are due are looked at when expiring
+    entries."""
 
     def __init__(self):
         self.cache = {}
+        self._index = {}
+        self._expirations = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _details(entry):
+        return entry.key, entry.type, entry.class_
+
+    @staticmethod
+    def _value(entry):
+        """Returns the value compared by the __eq__ method of a record"""
+        if isinstance(entry, DNSPointer):
+            return entry.alias
+        if isinstance(entry, DNSAddress):
+            return entry.address
+        if isinstance(entry, DNSText):
+            return entry.text
+        if isinstance(entry, DNSService):
+            return entry.priority, entry.weight, entry.port, entry.server
+        if isinstance(entry, DNSHinfo):
+            return entry.cpu, entry.os
+        return None
+
+    def _cached(self, entry):
+        """Returns the list of cached entries comparable with an entry"""
+        return self._index.get(self._details(entry), {}).get(
+            self._value(entry), ())
 
     def add(self, entry):
         """Adds an entry"""
-        self.cache.setdefault(entry.key, []).append(entry)
+        with self._lock:
+            self.cache.setdefault(entry.key, []).append(entry)
+            self._index.setdefault(self._details(entry), {}).setdefault(
+                self._value(entry), []).append(entry)
+            heapq.heappush(self._expirations, (
+                entry.get_expiration_time(100), next(self._sequence), entry))
 
     def remove(self, entry):
         """Removes an entry"""
+        with self._lock:
+            self._remove(entry)
+
+    def _remove(self, entry):
         try:
             list_ = self.cache[entry.key]
             list_.remove(entry)
+            if not list_:
+                del self.cache[entry.key]
+            details = self._details(entry)
+            values = self._index[details]
+            list_ = values[self._value(entry)]
+            list_.remove(entry)
+            if not list_:
+                del values[self._value(entry)]
+                if not values:
+                    del self._index[details]
         except (KeyError, ValueError):
             pass
 
     def get(self, entry):
         """Gets an entry by key.  Will return None if there is no
         matching entry."""
-        try:
-            list_ = self.cache[entry.key]
+        if isinstance(entry, DNSRecord):
+            lists = [self._cached(entry)]
+        else:
+            lists = list(self._index.get(self._details(entry), {}).values())
+        for list_ in lists:
             for cached_entry in list_:
                 if entry.__eq__(cached_entry):
                     return cached_entry
-        except (KeyError, ValueError):
-            return None
+        return None
 
     def get_by_details(self, name, type_, class_):
         """Gets an entry by details.  Will return None if there is
@@ -1058,19 +1152,54 @@ class DNSCache(object):
 
     def entries(self):
         """Returns a list of all entries"""
-        if not self.cache:
-            return []
-        else:
-            # avoid size change during iteration by copying the cache
-            values = list(self.cache.values())
-            return reduce(lambda a, b: a + b, values)
+        # avoid size change during iteration by copying the cache
+        return [entry for list_ in list(self.cache.values())
+                for entry in list_]
+
+    def expire(self, now):
+        """Removes the entries expired at now and returns them"""
+        expired = []
+        with self._lock:
+            while self._expirations and self._expirations[0][0] <= now:
+                entry = heapq.heappop(self._expirations)[2]
+                if not any(cached is entry
+                           for cached in self._cached(entry)):
+                    # Removed since added
+                    continue
+                expiration = entry.get_expiration_time(100)
+                if expiration > now:
+                    # TTL reset since added
+                    heapq.heappush(self._expirations, (
+                        expiration, next(self._sequence), entry))
+                    continue
+                self._remove(entry)
+                expired.append(entry)
+        return expired
+
+    def __len__(self):
+        return sum(len(list_) for list_ in list(self.cache.values()))
+
+
+class _Timer(object):
+
+    """A callback scheduled by the engine"""
+
+    __slots__ = ('when', 'callback', 'cancelled')
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
 
 
 class Engine(threading.Thread):
 
-    """An engine wraps read access to sockets, allowing objects that
-    need to receive data from sockets to be called back when the
-    sockets are ready.
+    """An engine runs everything a Zeroconf instance does in the
+    background from one thread: it calls readers back when their sockets
+    are ready, and runs the timers of the browsers and the reaper.
 
     A reader needs a handle_read() method, which is called when the socket
     it is interested in is ready for reading.
@@ -1084,43 +1213,112 @@ class Engine(threading.Thread):
         self.daemon = True
         self.zc = zc
         self.readers = {}  # maps socket to reader
-        self.timeout = 5
-        self.condition = threading.Condition()
+        self.selector = selectors.DefaultSelector()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        # Wakes the engine up when readers or timers are added
+        self._wakeup_socket, self._wakeup_sender = socket.socketpair()
+        self._wakeup_socket.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+        self.selector.register(self._wakeup_socket, selectors.EVENT_READ)
         self.start()
 
     def run(self):
-        while not self.zc.done:
-            with self.condition:
-                rs = self.readers.keys()
-                if len(rs) == 0:
-                    # No sockets to manage, but we wait for the timeout
-                    # or addition of a socket
-                    self.condition.wait(self.timeout)
-
-            if len(rs) != 0:
+        try:
+            while not self.zc.done:
+                self.run_once()
+        finally:
+            self.selector.close()
+            self._wakeup_socket.close()
+            self._wakeup_sender.close()
+
+    def run_once(self, timeout=None):
+        """Waits up to timeout milliseconds, or until the next timer, for
+        sockets to be ready, then calls their readers and the due
+        timers."""
+        with self._lock:
+            if self._timers:
+                delay = max(0, self._timers[0][0] - current_time_millis())
+                timeout = delay if timeout is None else min(timeout, delay)
+        try:
+            events = self.selector.select(
+                None if timeout is None else timeout / 1000.0)
+        except (OSError, ValueError):
+            # If the selector was closed by another thread, during
+            # shutdown, ignore it and exit
+            if self.zc.done:
+                return
+            raise
+        for key, mask in events:
+            if key.fileobj is self._wakeup_socket:
                 try:
-                    rr, wr, er = select.select(rs, [], [], self.timeout)
-                    if not self.zc.done:
-                        for socket_ in rr:
-                            reader = self.readers.get(socket_)
-                            if reader:
-                                reader.handle_read(socket_)
-
-                except (select.error, socket.error) as e:
-                    # If the socket was closed by another thread, during
-                    # shutdown, ignore it and exit
-                    if e.args[0] != socket.EBADF or not self.zc.done:
-                        raise
+                    self._wakeup_socket.recv(4096)
+                except socket.error:
+                    pass
+            elif not self.zc.done:
+                key.data.handle_read(key.fileobj)
+        self._run_timers()
+
+    def _run_timers(self):
+        now = current_time_millis()
+        while not self.zc.done:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > now:
+                    return
+                timer = heapq.heappop(self._timers)[2]
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback()
+            except Exception:
+                # A failing callback must not stop the engine thread
+                log.exception('Error in timer %r', timer.callback)
+
+    def wakeup(self):
+        """Interrupts the wait for sockets"""
+        try:
+            self._wakeup_sender.send(b'\x00')
+        except socket.error:
+            # Already woken up, or closed
+            pass
+
+    def call_later(self, delay, callback):
+        """Calls callback from the engine thread in delay milliseconds.
+        Returns a timer which can be cancelled."""
+        timer = _Timer(current_time_millis() + delay, callback)
+        with self._lock:
+            heapq.heappush(self._timers,
+                           (timer.when, next(self._sequence), timer))
+        if threading.current_thread() is not self:
+            self.wakeup()
+        return timer
+
+    def call_soon(self, callback):
+        """Calls callback from the engine thread as soon as possible"""
+        return self.call_later(0, callback)
 
     def add_reader(self, reader, socket_):
-        with self.condition:
+        with self._lock:
             self.readers[socket_] = reader
-            self.condition.notify()
+            self.selector.register(socket_, selectors.EVENT_READ, reader)
+        self.wakeup()
 
     def del_reader(self, socket_):
-        with self.condition:
+        with self._lock:
             del self.readers[socket_]
-            self.condition.notify()
+            try:
+                self.selector.unregister(socket_)
+            except (KeyError, ValueError):
+                # Selector already closed
+                pass
+        self.wakeup()
+
+    def close(self):
+        """Stops the engine once its Zeroconf instance is done"""
+        self.wakeup()
+        if threading.current_thread() is not self:
+            self.join()
 
 
 class Listener(QuietLogger):
@@ -1135,6 +1333,7 @@ class Listener(QuietLogger):
     def __init__(self, zc):
         self.zc = zc
         self.data = None
+        self.filtered = 0
 
     def handle_read(self, socket_):
         try:
@@ -1143,9 +1342,16 @@ class Listener(QuietLogger):
             self.log_exception_warning()
             return
 
+        self.handle_packet(data, addr, port)
+
+    def handle_packet(self, data, addr, port):
         log.debug('Received from %r:%r: %r ', addr, port, data)
 
         self.data = data
+        if self.zc.filter_packets and not self.zc.is_interesting(data):
+            # Dropped before decoding
+            self.filtered += 1
+            return
         msg = DNSIncoming(data)
         if not msg.valid:
             pass
@@ -1165,27 +1371,51 @@ class Listener(QuietLogger):
             self.zc.handle_response(msg)
 
 
-class Reaper(threading.Thread):
+class EngineTask(object):
+
+    """Thread-like interface of the tasks run by the engine thread.
+
+    Reapers and service browsers used to be threads: they keep their
+    name, daemon, is_alive() and join(), alive until cancelled."""
+
+    daemon = True
+
+    def __init__(self, name):
+        self.name = name
+        self._cancelled = threading.Event()
+
+    def is_alive(self):
+        return not self._cancelled.is_set()
+
+    def join(self, timeout=None):
+        """Waits until the task is cancelled"""
+        self._cancelled.wait(timeout)
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class Reaper(EngineTask):
 
     """A Reaper is used by this module to remove cache entries that
-    have expired."""
+    have expired. It runs every 10 seconds from the engine thread."""
+
+    interval = 10 * 1000
 
     def __init__(self, zc):
-        threading.Thread.__init__(self, name='zeroconf-Reaper')
-        self.daemon = True
+        EngineTask.__init__(self, 'zeroconf-Reaper')
         self.zc = zc
-        self.start()
+        self.timer = zc.engine.call_later(self.interval, self.run)
 
     def run(self):
-        while True:
-            self.zc.wait(10 * 1000)
-            if self.zc.done:
-                return
-            now = current_time_millis()
-            for record in self.zc.cache.entries():
-                if record.is_expired(now):
-                    self.zc.update_record(now, record)
-                    self.zc.cache.remove(record)
+        now = current_time_millis()
+        for record in self.zc.cache.expire(now):
+            self.zc.update_record(now, record)
+        self.timer = self.zc.engine.call_later(self.interval, self.run)
+
+    def cancel(self):
+        self.timer.cancel()
+        EngineTask.cancel(self)
 
 
 class Signal(object):
@@ -1215,28 +1445,29 @@ class SignalRegistrationInterface(object):
         return self
 
 
-class ServiceBrowser(threading.Thread):
+class ServiceBrowser(EngineTask):
 
     """Used to browse for a service of a specific type.
 
     The listener object will have its add_service() and
     remove_service() methods called when this browser
-    discovers changes in the services availability."""
+    discovers changes in the services availability.
+
+    Queries are sent and handlers are called from the engine thread of
+    the Zeroconf instance."""
 
     def __init__(self, zc, type_, handlers=None, listener=None):
         """Creates a browser for a specific type"""
         assert handlers or listener, 'You need to specify at least one handler'
         if not type_.endswith(service_type_name(type_)):
             raise BadTypeInNameException
-        threading.Thread.__init__(
-            self, name='zeroconf-ServiceBrowser_' + type_)
-        self.daemon = True
+        EngineTask.__init__(self, 'zeroconf-ServiceBrowser_' + type_)
         self.zc = zc
         self.type = type_
         self.services = {}
         self.next_time = current_time_millis()
         self.delay = _BROWSER_TIME
-        self._handlers_to_call = []
+        self._timer = None
 
         self._service_state_changed = Signal()
 
@@ -1262,25 +1493,32 @@ class ServiceBrowser(threading.Thread):
         for h in handlers:
             self.service_state_changed.register_handler(h)
 
-        self.start()
+        self.zc.add_listener(self, DNSQuestion(self.type, _TYPE_PTR, _CLASS_IN))
+        self._schedule_query(self.next_time)
 
     @property
     def service_state_changed(self):
         return self._service_state_changed.registration_interface
 
+    def interesting_names(self):
+        """Returns the names of the records the browser cares about"""
+        return [self.type]
+
     def update_record(self, zc, now, record):
         """Callback invoked by Zeroconf when new information arrives.
 
         Updates information required by browser in the Zeroconf cache."""
 
         def enqueue_callback(state_change, name):
-            self._handlers_to_call.append(
-                lambda zeroconf: self._service_state_changed.fire(
-                    zeroconf=zeroconf,
-                    service_type=self.type,
-                    name=name,
-                    state_change=state_change,
-                ))
+            def call_handlers():
+                if not self.done:
+                    self._service_state_changed.fire(
+                        zeroconf=zc,
+                        service_type=self.type,
+                        name=name,
+                        state_change=state_change,
+                    )
+            zc.engine.call_soon(call_handlers)
 
         if record.type == _TYPE_PTR and record.name == self.type:
             expired = record.is_expired(now)
@@ -1301,37 +1539,35 @@ class ServiceBrowser(threading.Thread):
 
             expires = record.get_expiration_time(75)
             if expires < self.next_time:
-                self.next_time = expires
+                self._schedule_query(expires)
 
-    def cancel(self):
-        self.done = True
-        self.zc.remove_listener(self)
-        self.join()
+    def _schedule_query(self, when):
+        if self._timer is not None:
+            self._timer.cancel()
+        self.next_time = when
+        self._timer = self.zc.engine.call_later(
+            when - current_time_millis(), self._send_query)
 
-    def run(self):
-        self.zc.add_listener(self, DNSQuestion(self.type, _TYPE_PTR, _CLASS_IN))
-
-        while True:
-            now = current_time_millis()
-            if len(self._handlers_to_call) == 0 and self.next_time > now:
-                self.zc.wait(self.next_time - now)
-            if self.zc.done or self.done:
-                return
-            now = current_time_millis()
-            if self.next_time <= now:
-                out = DNSOutgoing(_FLAGS_QR_QUERY)
-                out.add_question(DNSQuestion(self.type, _TYPE_PTR, _CLASS_IN))
-                for record in self.services.values():
-                    if not record.is_expired(now):
-                        out.add_answer_at_time(record, now)
+    def _send_query(self):
+        if self.zc.done or self.done:
+            return
+        now = current_time_millis()
+        out = DNSOutgoing(_FLAGS_QR_QUERY)
+        out.add_question(DNSQuestion(self.type, _TYPE_PTR, _CLASS_IN))
+        for record in list(self.services.values()):
+            if not record.is_expired(now):
+                out.add_answer_at_time(record, now)
 
-                self.zc.send(out)
-                self.next_time = now + self.delay
-                self.delay = min(20 * 1000, self.delay * 2)
+        self.zc.send(out)
+        self._schedule_query(now + self.delay)
+        self.delay = min(20 * 1000, self.delay * 2)
 
-            if len(self._handlers_to_call) > 0 and not self.zc.done:
-                handler = self._handlers_to_call.pop(0)
-                handler(self.zc)
+    def cancel(self):
+        self.done = True
+        if self._timer is not None:
+            self._timer.cancel()
+        self.zc.remove_listener(self)
+        EngineTask.cancel(self)
 
 
 class ServiceInfo(object):
@@ -1371,6 +1607,10 @@ class ServiceInfo(object):
     def properties(self):
         return self._properties
 
+    def interesting_names(self):
+        """Returns the names of the records the request cares about"""
+        return [name for name in (self.name, self.server) if name]
+
     def _set_properties(self, properties):
         """Sets properties and text of this info from a dictionary"""
         if isinstance(properties, dict):
@@ -1461,15 +1701,12 @@ class ServiceInfo(object):
                 if record.name == self.name:
                     self._set_text(record.text)
 
-    def request(self, zc, timeout):
-        """Returns true if the service could be discovered on the
-        network, and updates this object with details discovered.
-        """
-        now = current_time_millis()
-        delay = _LISTENER_TIME
-        next_ = now + delay
-        last = now + timeout
+    def is_complete(self):
+        """Returns true if the server, address and text are known"""
+        return None not in (self.server, self.address, self.text)
 
+    def load_from_cache(self, zc, now):
+        """Updates service information from the records already cached"""
         record_types_for_check_cache = [
             (_TYPE_SRV, _CLASS_IN),
             (_TYPE_TXT, _CLASS_IN),
@@ -1481,44 +1718,30 @@ class ServiceInfo(object):
             if cached:
                 self.update_record(zc, now, cached)
 
-        if None not in (self.server, self.address, self.text):
-            return True
+    def add_questions(self, zc, out, now):
+        """Adds the questions of the missing information to a query, with
+        the records already known as known answers"""
+        out.add_question(DNSQuestion(self.name, _TYPE_SRV, _CLASS_IN))
+        out.add_answer_at_time(
+            zc.cache.get_by_details(self.name, _TYPE_SRV, _CLASS_IN), now)
 
-        try:
-            zc.add_listener(self, DNSQuestion(self.name, _TYPE_ANY, _CLASS_IN))
-            while None in (self.server, self.address, self.text):
-                if last <= now:
-                    return False
-                if next_ <= now:
-                    out = DNSOutgoing(_FLAGS_QR_QUERY)
-                    out.add_question(
-                        DNSQuestion(self.name, _TYPE_SRV, _CLASS_IN))
-                    out.add_answer_at_time(
-                        zc.cache.get_by_details(
-                            self.name, _TYPE_SRV, _CLASS_IN), now)
-
-                    out.add_question(
-                        DNSQuestion(self.name, _TYPE_TXT, _CLASS_IN))
-                    out.add_answer_at_time(
-                        zc.cache.get_by_details(
-                            self.name, _TYPE_TXT, _CLASS_IN), now)
-
-                    if self.server is not None:
-                        out.add_question(
-                            DNSQuestion(self.server, _TYPE_A, _CLASS_IN))
-                        out.add_answer_at_time(
-                            zc.cache.get_by_details(
-                                self.server, _TYPE_A, _CLASS_IN), now)
-                    zc.send(out)
-                    next_ = now + delay
-                    delay *= 2
-
-                zc.wait(min(next_, last) - now)
-                now = current_time_millis()
-        finally:
-            zc.remove_listener(self)
+        out.add_question(DNSQuestion(self.name, _TYPE_TXT, _CLASS_IN))
+        out.add_answer_at_time(
+            zc.cache.get_by_details(self.name, _TYPE_TXT, _CLASS_IN), now)
+
+        if self.server is not None:
+            out.add_question(DNSQuestion(self.server, _TYPE_A, _CLASS_IN))
+            out.add_answer_at_time(
+                zc.cache.get_by_details(self.server, _TYPE_A, _CLASS_IN), now)
+
+    def request(self, zc, timeout):
+        """Returns true if the service could be discovered on the
+        network, and updates this object with details discovered.
 
-        return True
+        It blocks the calling thread: it cannot be called from the engine
+        thread, see Zeroconf.request_service_infos().
+        """
+        return ServiceInfoRequest(zc, [self]).run(timeout) == [self]
 
     def __eq__(self, other):
         """Tests equality of service name"""
@@ -1542,6 +1765,177 @@ class ServiceInfo(object):
         )
 
 
+class ServiceInfoRequest(object):
+
+    """Resolves many services at once.
+
+    The questions of every service are packed in shared queries, and the
+    information of every service is filled from the same responses. A
+    service is no longer asked for as soon as it is complete."""
+
+    def __init__(self, zc, infos):
+        self.zc = zc
+        self.infos = list(infos)
+        self.pending = []
+        self._by_name = {}
+        for info in self.infos:
+            self._by_name.setdefault(info.name.lower(), []).append(info)
+        # State of a request started from the engine thread
+        self._handler = None
+        self._callback = None
+        self._timer = None
+        self._cancelled = False
+        self._listening = False
+        self._next = self._last = self._delay = 0
+
+    def interesting_names(self):
+        """Returns the names of the records the request cares about"""
+        names = []
+        for info in list(self.pending):
+            names.extend(info.interesting_names())
+        return names
+
+    def update_record(self, zc, now, record):
+        """Updates the services a DNS record is about"""
+        if record.type == _TYPE_A:
+            infos = [info for info in list(self.pending)
+                     if info.server is not None and
+                     info.server.lower() == record.key]
+        else:
+            infos = self._by_name.get(record.key, [])
+        for info in infos:
+            info.update_record(zc, now, record)
+        if infos and self._timer is not None:
+            # Checked once the listeners are updated
+            self._timer.cancel()
+            self._timer = zc.engine.call_soon(self._step)
+
+    def queries(self, infos, now):
+        """Returns the queries asking for the services, split in as many
+        packets as needed to keep each one under the typical size"""
+        out = DNSOutgoing(_FLAGS_QR_QUERY)
+        for info in infos:
+            info.add_questions(self.zc, out, now)
+        if len(infos) > 1 and len(out.packet()) > _MAX_MSG_TYPICAL:
+            half = len(infos) // 2
+            return (self.queries(infos[:half], now) +
+                    self.queries(infos[half:], now))
+        return [out]
+
+    def _complete(self, handler):
+        """Stops asking for the complete services"""
+        complete = [info for info in self.pending if info.is_complete()]
+        if complete:
+            self.pending = [info for info in self.pending
+                            if not info.is_complete()]
+            if handler is not None:
+                for info in complete:
+                    handler(info)
+
+    def run(self, timeout, handler=None):
+        """Asks for the services until they are all complete or the
+        timeout (in milliseconds) expires. handler is called with each
+        service as soon as it is complete. Returns the complete services.
+
+        It blocks the calling thread, which cannot be the engine thread:
+        use start() there."""
+        if threading.current_thread() is self.zc.engine:
+            raise RuntimeError('Cannot block the engine thread, use start()')
+        now = current_time_millis()
+        delay = _LISTENER_TIME
+        next_ = now + delay
+        last = now + timeout
+
+        for info in self.infos:
+            info.load_from_cache(self.zc, now)
+        self.pending = list(self.infos)
+        self._complete(handler)
+        if self.pending:
+            try:
+                self.zc.add_listener(self, None)
+                while True:
+                    self._complete(handler)
+                    if not self.pending or last <= now:
+                        break
+                    if next_ <= now:
+                        for out in self.queries(self.pending, now):
+                            self.zc.send(out)
+                        next_ = now + delay
+                        delay *= 2
+
+                    self.zc.wait(min(next_, last) - now)
+                    now = current_time_millis()
+            finally:
+                self.zc.remove_listener(self)
+
+        return [info for info in self.infos if info.is_complete()]
+
+    def start(self, timeout, handler=None, callback=None):
+        """Asks for the services like run(), from the engine thread and
+        without blocking it: queries are sent by engine timers. callback
+        is called with the complete services once they are all complete
+        or the timeout (in milliseconds) expires."""
+        if self._cancelled:
+            return
+        now = current_time_millis()
+        self._handler = handler
+        self._callback = callback
+        self._delay = _LISTENER_TIME
+        self._next = now + self._delay
+        self._last = now + timeout
+
+        for info in self.infos:
+            info.load_from_cache(self.zc, now)
+        self.pending = list(self.infos)
+        self._complete(handler)
+        if not self.pending:
+            self._finish()
+            return
+        self.zc.add_listener(self, None)
+        self._listening = True
+        self._timer = self.zc.engine.call_later(
+            min(self._next, self._last) - now, self._step)
+
+    def _step(self):
+        """Sends the next query of a started request, or finishes it"""
+        self._timer = None
+        if self._cancelled:
+            self._stop_listening()
+            return
+        now = current_time_millis()
+        self._complete(self._handler)
+        if not self.pending or self._last <= now:
+            self._stop_listening()
+            self._finish()
+            return
+        if self._next <= now:
+            for out in self.queries(self.pending, now):
+                self.zc.send(out)
+            self._next = now + self._delay
+            self._delay *= 2
+        self._timer = self.zc.engine.call_later(
+            min(self._next, self._last) - now, self._step)
+
+    def _stop_listening(self):
+        if self._listening:
+            self._listening = False
+            self.zc.remove_listener(self)
+
+    def _finish(self):
+        if self._callback is not None:
+            self._callback([info for info in self.infos
+                            if info.is_complete()])
+
+    def cancel(self):
+        """Stops a started request, without calling its callback"""
+        self._cancelled = True
+        timer = self._timer
+        if timer is not None:
+            # Stopped from the engine thread
+            timer.cancel()
+            self.zc.engine.call_soon(self._step)
+
+
 class ZeroconfServiceTypes(object):
     """
     Return all of the advertised services on any local networks
@@ -1633,6 +2027,28 @@ def new_socket():
     return s
 
 
+_FIRST_LABELS = {}
+
+
+def packet_mentions(data, names):
+    """Returns true if a packet may hold records of any of the names.
+
+    A name is always written in full at least once in a packet which
+    mentions it, so the first label of each name is searched in the raw
+    packet."""
+    data = data.lower()
+    for name in names:
+        try:
+            label = _FIRST_LABELS[name]
+        except KeyError:
+            label = name.split('.')[0].lower().encode('utf-8')
+            label = _FIRST_LABELS.setdefault(
+                name, int2byte(len(label)) + label)
+        if label in data:
+            return True
+    return False
+
+
 def get_errno(e):
     assert isinstance(e, socket.error)
     return e.args[0]
@@ -1648,9 +2064,15 @@ class Zeroconf(QuietLogger):
     def __init__(
         self,
         interfaces=InterfaceChoice.All,
+        filter_packets=False,
     ):
         """Creates an instance of the Zeroconf class, establishing
-        multicast communications, listening and reaping threads.
+        multicast communications, and the engine thread listening,
+        browsing and reaping.
+
+        When filter_packets is true, packets which do not mention any name
+        the listeners or the registered services care about are dropped
+        before being decoded.
 
         :type interfaces: :class:`InterfaceChoice` or sequence of ip addresses
         """
@@ -1704,6 +2126,7 @@ class Zeroconf(QuietLogger):
         self.reaper = Reaper(self)
 
         self.debug = None
+        self.filter_packets = filter_packets
 
     @property
     def done(self):
@@ -1711,7 +2134,12 @@ class Zeroconf(QuietLogger):
 
     def wait(self, timeout):
         """Calling thread waits for a given number of milliseconds or
-        until notified."""
+        until notified.
+
+        The engine thread, which calls browser handlers, cannot wait:
+        packets and timers would not be handled meanwhile."""
+        if threading.current_thread() is self.engine:
+            raise RuntimeError('Cannot wait from the engine thread')
         with self.condition:
             self.condition.wait(timeout / 1000.0)
 
@@ -1728,6 +2156,33 @@ class Zeroconf(QuietLogger):
         if info.request(self, timeout):
             return info
 
+    def get_service_infos(self, type_, names, timeout=3000, handler=None):
+        """Returns a dictionary of network's service information by
+        name, resolving all the services at once. A service with no
+        match by the timeout, which defaults to 3 seconds, is None.
+        handler is called with each information as soon as complete."""
+        infos = [ServiceInfo(type_, name) for name in names]
+        ServiceInfoRequest(self, infos).run(timeout, handler)
+        return dict((info.name, info if info.is_complete() else None)
+                    for info in infos)
+
+    def request_service_infos(self, type_, names, callback, timeout=3000,
+                              handler=None):
+        """Resolves services like get_service_infos() without blocking,
+        from any thread including browser handlers. callback is called
+        from the engine thread with the dictionary of information by name
+        once done. Returns the request, which can be cancelled."""
+        infos = [ServiceInfo(type_, name) for name in names]
+
+        def finished(complete):
+            callback(dict((info.name, info if info.is_complete() else None)
+                          for info in infos))
+
+        request = ServiceInfoRequest(self, infos)
+        self.engine.call_soon(
+            lambda: request.start(timeout, handler, finished))
+        return request
+
     def add_service_listener(self, type_, listener):
         """Adds a listener for a particular service type.  This object
         will then have its update_record method called when information
@@ -1903,6 +2358,22 @@ class Zeroconf(QuietLogger):
                     listener.update_record(self, now, record)
         self.notify_all()
 
+    def is_interesting(self, data):
+        """Returns true if a packet may hold records the listeners or the
+        registered services care about."""
+        names = []
+        for listener in list(self.listeners):
+            try:
+                names.extend(listener.interesting_names())
+            except AttributeError:
+                # Unknown listener, it may care about any packet
+                return True
+        for info in list(self.services.values()):
+            names.extend((info.name, info.type, info.server))
+        if self.servicetypes:
+            names.append('_services._dns-sd._udp.local.')
+        return packet_mentions(data, names)
+
     def remove_listener(self, listener):
         """Removes a listener."""
         try:
@@ -1924,13 +2395,12 @@ class Zeroconf(QuietLogger):
         now = current_time_millis()
         for record in msg.answers:
             expired = record.is_expired(now)
-            if record in self.cache.entries():
+            entry = self.cache.get(record)
+            if entry is not None:
                 if expired:
                     self.cache.remove(record)
                 else:
-                    entry = self.cache.get(record)
-                    if entry is not None:
-                        entry.reset_ttl(record)
+                    entry.reset_ttl(record)
             else:
                 self.cache.add(record)
 
@@ -2030,17 +2500,20 @@ class Zeroconf(QuietLogger):
         servicing further queries."""
         if not self._GLOBAL_DONE:
             self._GLOBAL_DONE = True
-            # remove service listeners
+            # remove service listeners, and browsers created directly
             self.remove_all_service_listeners()
+            for listener in list(self.listeners):
+                if isinstance(listener, ServiceBrowser):
+                    listener.cancel()
             self.unregister_all_services()
 
             # shutdown recv socket and thread
+            self.reaper.cancel()
             self.engine.del_reader(self._listen_socket)
+            self.engine.close()
             self._listen_socket.close()
-            self.engine.join()
 
             # shutdown the rest
             self.notify_all()
-            self.reaper.join()
             for s in self._respond_sockets:
                 s.close()
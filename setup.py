@@ -5,9 +5,10 @@ PACKAGES = find_packages(exclude=['tests', 'tests.*'])
 
 REQUIRES = [
     'requests>=2,<3',
+    'urllib3>=1.26',
     'netifaces',
     'six',
-    'paho_mqtt',
+    'paho_mqtt>=1.6.1',
     'pycryptodome'
 ]
 
@@ -18,7 +19,6 @@ PROJECT_CLASSIFIERS = [
     'Programming Language :: Python :: 3.7',
     'Programming Language :: Python :: 3.6',
     'Programming Language :: Python :: 3.5',
-    'Programming Language :: Python :: 3.4',
     'Topic :: Software Development :: Libraries'
 ]
 
@@ -0,0 +1,127 @@
+"""Local HTTPS stand-in of Dyson web services used by the tests.
+
+It serves the login and manifest endpoints over TLS with the self-signed
+certificate of tests/data/localhost.pem, speaks HTTP/1.1 so connections are
+kept alive, and counts the connections and requests received.
+"""
+
+import json
+import os
+import ssl
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CERTIFICATE = os.path.join(os.path.dirname(__file__), "data",
+                           "localhost.pem")
+LOGIN_PATH = "/v1/userregistration/authenticate"
+# Max time in seconds a response waits for its gate
+GATE_TIMEOUT = 5
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        path = self.path.split("?")[0]
+        with stub.lock:
+            stub.requests.append((self.command, path))
+            failures = stub.failures.get(path)
+            status = failures.pop(0) if failures else None
+            received = stub._received[path]  # pylint: disable=W0212
+            gate = stub.gates.get(path)
+        received.set()
+        if gate is not None and not gate.wait(GATE_TIMEOUT):
+            with stub.lock:
+                stub.gate_timeouts.append(path)
+        time.sleep(stub.delays.get(path, 0))
+        if status is not None:
+            self._reply(status)
+        elif path in stub.routes:
+            self._reply(200, stub.routes[path])
+        else:
+            self._reply(404)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing connections early, on timeouts
+        pass
+
+
+class HttpsStub:
+    """HTTPS server answering Dyson web services requests.
+
+    routes maps paths to JSON bodies. failures maps paths to the statuses
+    returned by their next requests, before their JSON bodies. delays maps
+    paths to the time in seconds their responses are delayed. gates maps
+    paths to events their responses wait for: responses which waited
+    GATE_TIMEOUT seconds in vain are listed in gate_timeouts.
+    """
+
+    def __init__(self, routes=None):
+        self.routes = dict(routes or {})
+        self.routes.setdefault(LOGIN_PATH, {"Account": "account",
+                                            "Password": "password"})
+        self.failures = {}
+        self.delays = {}
+        self.gates = {}
+        self.gate_timeouts = []
+        self._received = defaultdict(threading.Event)
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def received(self, path):
+        """Return an event set once a request of path is received."""
+        with self.lock:
+            return self._received[path]
+
+    @property
+    def host(self):
+        return "127.0.0.1:{0}".format(self._server.server_address[1])
+
+    def start(self):
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.stub = self
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(CERTIFICATE)
+        self._server.socket = context.wrap_socket(self._server.socket,
+                                                  server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
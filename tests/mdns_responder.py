@@ -0,0 +1,162 @@
+"""Loopback mDNS responder stand-in used by the tests.
+
+It joins the mDNS multicast group on 127.0.0.1 and answers the queries of
+Dyson services published on a single thread, like a Dyson device would:
+PTR queries with the PTR, SRV, TXT and A records of the services, SRV, TXT
+and A queries with the matching records.
+"""
+
+import socket
+import threading
+import time
+
+from libpurecool.dyson_discovery import DYSON_SERVICE_TYPE
+from libpurecool.zeroconf import DNSIncoming, DNSOutgoing, DNSPointer, \
+    DNSService, DNSText, DNSAddress, new_socket, _MDNS_ADDR, _MDNS_PORT, \
+    _FLAGS_QR_RESPONSE, _FLAGS_AA, _TYPE_PTR, _TYPE_SRV, _TYPE_TXT, \
+    _TYPE_A, _TYPE_ANY, _CLASS_IN
+
+INTERFACE = "127.0.0.1"
+TTL = 120
+
+
+class PublishedService:
+    """Dyson MQTT service published by the responder."""
+
+    def __init__(self, serial, port, product_type="475", address=INTERFACE):
+        self.serial = serial
+        self.port = port
+        self.name = "{0}_{1}.{2}".format(product_type, serial,
+                                         DYSON_SERVICE_TYPE)
+        self.server = "{0}.local.".format(serial)
+        self.address = address
+
+    def pointer(self, ttl=TTL):
+        return DNSPointer(DYSON_SERVICE_TYPE, _TYPE_PTR, _CLASS_IN, ttl,
+                          self.name)
+
+    def service(self):
+        return DNSService(self.name, _TYPE_SRV, _CLASS_IN, TTL, 0, 0,
+                          self.port, self.server)
+
+    def text(self):
+        return DNSText(self.name, _TYPE_TXT, _CLASS_IN, TTL, b"\x00")
+
+    def host_address(self):
+        return DNSAddress(self.server, _TYPE_A, _CLASS_IN, TTL,
+                          socket.inet_aton(self.address))
+
+
+class MdnsResponder:
+    """mDNS responder publishing Dyson services on the loopback interface.
+
+    With split_answers, PTR queries are answered with PTR records only and
+    SRV queries with SRV records only: services must then be resolved with
+    SRV and A queries.
+
+    With answer_interval, each service answers in its own packet,
+    answer_interval seconds after the previous one, like devices answering
+    a query one after the other.
+    """
+
+    def __init__(self, split_answers=False, answer_interval=None):
+        self.split_answers = split_answers
+        self.answer_interval = answer_interval
+        self.services = {}
+        self.queries = []
+        self.query_packets = 0
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._socket = new_socket()
+        self._socket.setsockopt(
+            socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+            socket.inet_aton(_MDNS_ADDR) + socket.inet_aton(INTERFACE))
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                socket.inet_aton(INTERFACE))
+        self._socket.settimeout(0.05)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._socket.close()
+
+    def add_service(self, service):
+        with self._lock:
+            self.services[service.name.lower()] = service
+        return service
+
+    def announce(self, service):
+        """Send the records of a service without being asked."""
+        self._send([service.pointer(), service.service(), service.text(),
+                    service.host_address()])
+
+    def remove_service(self, service):
+        """Stop publishing a service and send its goodbye."""
+        with self._lock:
+            self.services.pop(service.name.lower(), None)
+        self._send([service.pointer(ttl=0)])
+
+    def _send(self, records):
+        out = DNSOutgoing(_FLAGS_QR_RESPONSE | _FLAGS_AA)
+        for record in records:
+            out.add_answer_at_time(record, 0)
+        self._socket.sendto(out.packet(), (_MDNS_ADDR, _MDNS_PORT))
+
+    def _run(self):
+        while self._running:
+            try:
+                data, _ = self._socket.recvfrom(9000)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            msg = DNSIncoming(data)
+            if msg.valid and msg.is_query():
+                self._answer(msg)
+
+    def _answer(self, msg):
+        with self._lock:
+            services = list(self.services.values())
+        self.query_packets += 1
+        records = []
+        for question in msg.questions:
+            self.queries.append((question.name, question.type))
+            for service in services:
+                service_records = self._records(question, service)
+                if service_records and self.answer_interval is not None:
+                    time.sleep(self.answer_interval)
+                    self._send(service_records)
+                else:
+                    records.extend(service_records)
+        if records:
+            self._send(records)
+
+    def _records(self, question, service):
+        any_type = question.type == _TYPE_ANY
+        if question.key == DYSON_SERVICE_TYPE.lower() and \
+                question.type in (_TYPE_PTR, _TYPE_ANY):
+            if self.split_answers:
+                return [service.pointer()]
+            return [service.pointer(), service.service(), service.text(),
+                    service.host_address()]
+        if question.key == service.name.lower():
+            records = []
+            if any_type or question.type == _TYPE_SRV:
+                records.append(service.service())
+                if not self.split_answers:
+                    records.append(service.host_address())
+            if any_type or question.type == _TYPE_TXT:
+                records.append(service.text())
+            return records
+        if question.key == service.server.lower() and \
+                (any_type or question.type == _TYPE_A):
+            return [service.host_address()]
+        return []
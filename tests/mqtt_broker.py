@@ -0,0 +1,352 @@
+"""In-process MQTT broker stand-in used by the tests.
+
+It speaks enough MQTT 3.1/3.1.1 for the library (CONNECT, SUBSCRIBE,
+PUBLISH QoS 0/1, PINGREQ, DISCONNECT) on a single selector thread, and can
+impersonate Dyson devices answering commands published on their command
+topic.
+"""
+
+import json
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+from queue import Queue, Empty
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return struct.pack("!H", len(value)) + value
+
+
+def _packet(packet_type, body, flags=0):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + \
+        body
+
+
+def publish_packet(topic, payload, qos=0, packet_id=1):
+    """Return an encoded PUBLISH packet."""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    body = _encode_string(topic)
+    if qos:
+        body += struct.pack("!H", packet_id)
+    return _packet(PUBLISH, body + payload, qos << 1)
+
+
+class DeviceStandIn:
+    """Fake Dyson device answering the commands it receives."""
+
+    def __init__(self, product_type, serial, password, state, sensor=None,
+                 status_topic=None):
+        """Create a new device stand-in.
+
+        :param state: CURRENT-STATE message (dict)
+        :param sensor: ENVIRONMENTAL-CURRENT-SENSOR-DATA message (dict)
+        """
+        self.product_type = product_type
+        self.serial = serial
+        self.password = password
+        self.state = state
+        self.sensor = sensor
+        self.status_topic = status_topic or \
+            "{0}/{1}/status/current".format(product_type, serial)
+        self.command_topic = "{0}/{1}/command".format(product_type, serial)
+        self.commands = []
+        self.silent = False
+        self.reply_delay = 0
+
+    def handle(self, payload):
+        """Return the list of messages sent in reply to a command."""
+        command = json.loads(payload.decode("utf-8"))
+        self.commands.append(command)
+        if self.silent:
+            return []
+        if command["msg"] == "REQUEST-CURRENT-STATE":
+            return [self.state]
+        if command["msg"] == "REQUEST-PRODUCT-ENVIRONMENT-CURRENT-SENSOR-DATA":
+            return [self.sensor] if self.sensor else []
+        if command["msg"] == "STATE-SET" and "product-state" in self.state:
+            product_state = self.state["product-state"]
+            change = {}
+            for field, value in product_state.items():
+                change[field] = [value, command["data"].get(field, value)]
+                product_state[field] = change[field][1]
+            return [{"msg": "STATE-CHANGE", "time": command["time"],
+                     "product-state": change}]
+        return []
+
+
+class _Session:
+    """Client connection."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.connected = False
+        self.client_id = None
+
+
+class MqttBroker:
+    """Single threaded MQTT broker."""
+
+    def __init__(self):
+        """Create a new broker listening on a random local port."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(1024)
+        self._server.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._sessions = {}
+        self._subscriptions = defaultdict(set)
+        self._devices = {}
+        self._outgoing = Queue()
+        self._delayed = []
+        self._running = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.published = []
+
+    @property
+    def port(self):
+        """Listening port."""
+        return self._server.getsockname()[1]
+
+    @property
+    def client_count(self):
+        """Number of connected clients."""
+        return len(self._sessions)
+
+    def add_device(self, device):
+        """Add a device stand-in."""
+        self._devices[device.command_topic] = device
+        return device
+
+    def start(self):
+        """Start the broker thread."""
+        self._running = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the broker and close every connection."""
+        self._running = False
+        self._wakeup_w.send(b"x")
+        self._thread.join()
+        for session in list(self._sessions.values()):
+            session.sock.close()
+        self._selector.close()
+        self._server.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def publish(self, topic, payload):
+        """Publish a message to subscribers (thread safe)."""
+        self._outgoing.put((topic, payload))
+        self._wakeup_w.send(b"x")
+
+    def _run(self):
+        while self._running:
+            timeout = None
+            if self._delayed:
+                timeout = max(0, min(d[0] for d in self._delayed) -
+                              time.monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._server:
+                    self._accept()
+                elif key.fileobj is self._wakeup_r:
+                    self._wakeup_r.recv(4096)
+                else:
+                    self._service(key)
+            self._flush_outgoing()
+
+    def _flush_outgoing(self):
+        now = time.monotonic()
+        due = [d for d in self._delayed if d[0] <= now]
+        self._delayed = [d for d in self._delayed if d[0] > now]
+        for _, topic, payload in due:
+            self._route(topic, payload)
+        while True:
+            try:
+                topic, payload = self._outgoing.get_nowait()
+            except Empty:
+                break
+            self._route(topic, payload)
+
+    def _accept(self):
+        try:
+            sock, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        session = _Session(sock)
+        self._sessions[sock] = session
+        self._selector.register(sock, selectors.EVENT_READ, session)
+
+    def _close(self, session):
+        self._selector.unregister(session.sock)
+        session.sock.close()
+        del self._sessions[session.sock]
+        for subscribers in self._subscriptions.values():
+            subscribers.discard(session)
+
+    def _service(self, key):
+        session = key.data
+        if key.events & selectors.EVENT_WRITE or session.outbuf:
+            self._write(session)
+        try:
+            data = session.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(session)
+            return
+        session.inbuf.extend(data)
+        while session.sock in self._sessions:
+            packet = self._read_packet(session)
+            if packet is None:
+                break
+            self._handle(session, *packet)
+
+    @staticmethod
+    def _read_packet(session):
+        buf = session.inbuf
+        if len(buf) < 2:
+            return None
+        length = 0
+        multiplier = 1
+        pos = 1
+        while True:
+            if pos >= len(buf):
+                return None
+            byte = buf[pos]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            pos += 1
+            if not byte & 0x80:
+                break
+        if len(buf) < pos + length:
+            return None
+        header = buf[0]
+        body = bytes(buf[pos:pos + length])
+        del buf[:pos + length]
+        return header >> 4, header & 0x0F, body
+
+    def _send(self, session, data):
+        session.outbuf.extend(data)
+        self._write(session)
+
+    def _write(self, session):
+        if session.outbuf:
+            try:
+                sent = session.sock.send(session.outbuf)
+                del session.outbuf[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                session.outbuf.clear()
+        events = selectors.EVENT_READ
+        if session.outbuf:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(session.sock, events, session)
+
+    def _handle(self, session, packet_type, flags, body):
+        if packet_type == CONNECT:
+            self._handle_connect(session, body)
+        elif packet_type == SUBSCRIBE:
+            packet_id = body[:2]
+            pos = 2
+            granted = bytearray()
+            while pos < len(body):
+                length = struct.unpack("!H", body[pos:pos + 2])[0]
+                topic = body[pos + 2:pos + 2 + length].decode("utf-8")
+                self._subscriptions[topic].add(session)
+                granted.append(0)
+                pos += 3 + length
+            self._send(session, _packet(SUBACK, packet_id + bytes(granted)))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            length = struct.unpack("!H", body[:2])[0]
+            topic = body[2:2 + length].decode("utf-8")
+            pos = 2 + length
+            if qos:
+                self._send(session, _packet(PUBACK, body[pos:pos + 2]))
+                pos += 2
+            self._on_publish(topic, body[pos:])
+        elif packet_type == PINGREQ:
+            self._send(session, _packet(PINGRESP, b""))
+        elif packet_type == DISCONNECT:
+            self._close(session)
+
+    def _handle_connect(self, session, body):
+        pos = 2 + struct.unpack("!H", body[:2])[0]
+        connect_flags = body[pos + 1]
+        pos += 4
+        fields = []
+        while pos < len(body):
+            length = struct.unpack("!H", body[pos:pos + 2])[0]
+            fields.append(body[pos + 2:pos + 2 + length].decode("utf-8"))
+            pos += 2 + length
+        session.client_id = fields[0]
+        username = fields[1] if connect_flags & 0x80 else None
+        password = fields[2] if connect_flags & 0x40 else None
+        return_code = 0
+        devices = [d for d in self._devices.values() if d.serial == username]
+        if devices and devices[0].password != password:
+            return_code = 4
+        self._send(session, _packet(CONNACK, bytes([0, return_code])))
+        session.connected = return_code == 0
+
+    def _on_publish(self, topic, payload):
+        self.published.append((topic, payload))
+        self._route(topic, payload)
+        device = self._devices.get(topic)
+        if device is None:
+            return
+        for reply in device.handle(payload):
+            reply = json.dumps(reply).encode("utf-8")
+            if device.reply_delay:
+                self._delayed.append((time.monotonic() + device.reply_delay,
+                                      device.status_topic, reply))
+            else:
+                self._route(device.status_topic, reply)
+
+    def _route(self, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        for session in list(self._subscriptions.get(topic, ())):
+            if session.sock in self._sessions:
+                self._send(session, publish_packet(topic, payload))
@@ -6,7 +6,8 @@ import json
 
 from libpurecool.dyson_360_eye import Dyson360Eye, NetworkDevice, \
     Dyson360EyeState, Dyson360EyeMapGlobal, Dyson360EyeMapData, \
-    Dyson360EyeMapGrid, Dyson360EyeTelemetryData, Dyson360Goodbye
+    Dyson360EyeMapGrid, Dyson360EyeTelemetryData, Dyson360Goodbye, \
+    MESSAGE_TYPES, register_message_type
 from libpurecool.const import PowerMode, Dyson360EyeMode
 
 
@@ -26,7 +27,10 @@ def _mocked_send_start_command(*args, **kwargs):
 
 class TestDysonEye360Device(unittest.TestCase):
     def setUp(self):
-        pass
+        # Connections are mocked: no network thread
+        patcher = mock.patch('paho.mqtt.client.Client.loop_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         pass
@@ -76,6 +80,13 @@ class TestDysonEye360Device(unittest.TestCase):
                                             "name=device-1,"
                                             "address=192.168.1.1,port=1883))")
 
+    @mock.patch('paho.mqtt.client.Client.connect',
+                side_effect=ConnectionRefusedError(111, "refused"))
+    def test_connect_refused(self, mocked_connect):
+        device = self._device_sample()
+        self.assertFalse(device.connect('192.168.1.1'))
+        self.assertFalse(device.device_available)
+
     def test_start_not_connected(self):
         self._called = False
 
@@ -422,3 +433,42 @@ class TestDysonEye360Device(unittest.TestCase):
         self.assertEqual(self.message.__repr__(),
                          "Dyson360EyeGoodbye(reason=UNKNOWN,"
                          "time=2017-07-30 16:00:13)")
+
+    def test_on_message_parse_payload_once(self):
+        messages = []
+        device = self._device_sample()
+        device.add_message_listener(messages.append)
+        with mock.patch('json.loads', side_effect=json.loads) as mocked_loads:
+            for fixture in ["goodbye.json", "map-data.json", "state.json"]:
+                message = Mock()
+                message.payload = open("tests/data/vacuum/" + fixture,
+                                       "rb").read()
+                Dyson360Eye.on_message(None, device, message)
+        self.assertEqual(mocked_loads.call_count, 3)
+        self.assertIsInstance(messages[0], Dyson360Goodbye)
+        self.assertIsInstance(messages[1], Dyson360EyeMapData)
+        self.assertIsInstance(messages[2], Dyson360EyeState)
+        self.assertEqual(device.state, messages[2])
+
+    def test_register_message_type(self):
+        @register_message_type("TEST-MESSAGE")
+        class TestMessage:
+            def __init__(self, json_body):
+                self.json_body = json_body
+
+        self.message = None
+
+        def callback_function(msg):
+            self.message = msg
+
+        device = self._device_sample()
+        device.add_message_listener(callback_function)
+        message = Mock()
+        message.payload = b'{"msg": "TEST-MESSAGE", "value": 1}'
+        try:
+            Dyson360Eye.on_message(None, device, message)
+        finally:
+            del MESSAGE_TYPES["TEST-MESSAGE"]
+        self.assertIsInstance(self.message, TestMessage)
+        self.assertEqual(self.message.json_body["value"], 1)
+        self.assertIsNone(device.state)
@@ -1,14 +1,25 @@
+import copy
+import os
+import stat
+import tempfile
+import threading
 import unittest
 
 from unittest import mock
 
+import requests
+
 from libpurecool.dyson_pure_cool import DysonPureCool
 from libpurecool.dyson_pure_hotcool import DysonPureHotCool
 from libpurecool.dyson import DysonAccount, DysonPureCoolLink, \
     DysonPureHotCoolLink, Dyson360Eye, DysonNotLoggedException, \
-    DYSON_API_USER_AGENT
+    DYSON_API_USER_AGENT, ManifestCache
+
+from .https_stub import HttpsStub, LOGIN_PATH
 
 API_HOST = 'appapi.cp.dyson.com'
+V1_MANIFEST = '/v1/provisioningservice/manifest'
+V2_MANIFEST = '/v2/provisioningservice/manifest'
 API_CN_HOST = 'appapi.cp.dyson.cn'
 
 
@@ -167,21 +178,22 @@ class TestDysonAccount(unittest.TestCase):
     def tearDown(self):
         pass
 
-    @mock.patch('requests.post', side_effect=_mocked_login_post)
+    @mock.patch('requests.Session.post', side_effect=_mocked_login_post)
     def test_connect_account(self, mocked_login):
         dyson_account = DysonAccount("email", "password", "language")
         logged = dyson_account.login()
         self.assertEqual(mocked_login.call_count, 1)
         self.assertTrue(logged)
 
-    @mock.patch('requests.post', side_effect=_mocked_login_post_cn)
+    @mock.patch('requests.Session.post', side_effect=_mocked_login_post_cn)
     def test_connect_account_cn(self, mocked_login):
         dyson_account = DysonAccount("email", "password", "CN")
         logged = dyson_account.login()
         self.assertEqual(mocked_login.call_count, 1)
         self.assertTrue(logged)
 
-    @mock.patch('requests.post', side_effect=_mocked_login_post_failed)
+    @mock.patch('requests.Session.post',
+                side_effect=_mocked_login_post_failed)
     def test_connect_account_failed(self, mocked_login):
         dyson_account = DysonAccount("email", "password", "language")
         logged = dyson_account.login()
@@ -192,8 +204,8 @@ class TestDysonAccount(unittest.TestCase):
         dyson_account = DysonAccount("email", "password", "language")
         self.assertRaises(DysonNotLoggedException, dyson_account.devices)
 
-    @mock.patch('requests.get', side_effect=_mocked_list_devices)
-    @mock.patch('requests.post', side_effect=_mocked_login_post)
+    @mock.patch('requests.Session.get', side_effect=_mocked_list_devices)
+    @mock.patch('requests.Session.post', side_effect=_mocked_login_post)
     def test_list_devices(self, mocked_login, mocked_list_devices):
         dyson_account = DysonAccount("email", "password", "language")
         dyson_account.login()
@@ -216,3 +228,216 @@ class TestDysonAccount(unittest.TestCase):
         self.assertEqual(devices[0].version, '21.03.08')
         self.assertEqual(devices[0].product_type, '475')
         self.assertEqual(devices[0].credentials, 'password1')
+
+
+def _manifest(version):
+    path = '/{0}/provisioningservice/manifest'.format(version)
+    return path, _mocked_list_devices(
+        'https://{0}{1}'.format(API_HOST, path))._json
+
+
+class TestDysonAccountHttps(unittest.TestCase):
+    def setUp(self):
+        self._stub = HttpsStub(dict([_manifest('v1'),
+                                     _manifest('v2')])).start()
+
+    def tearDown(self):
+        self._stub.stop()
+
+    def _account(self, **kwargs):
+        account = DysonAccount("email", "password", "language",
+                               backoff_factor=0, **kwargs)
+        account._dyson_api_url = self._stub.host
+        return account
+
+    def test_keep_alive(self):
+        with self._account() as dyson_account:
+            self.assertTrue(dyson_account.login())
+            self.assertEqual(len(dyson_account.devices()), 6)
+            self.assertEqual(len(dyson_account.devices()), 6)
+        self.assertEqual(self._stub.requests[0], ('POST', LOGIN_PATH))
+        self.assertEqual(sorted(self._stub.requests[1:]), 2 * [
+            ('GET', '/v1/provisioningservice/manifest')] + 2 * [
+            ('GET', '/v2/provisioningservice/manifest')])
+        # One connection per concurrent manifest, kept alive
+        self.assertEqual(self._stub.connections, 2)
+
+    def test_concurrent_manifests(self):
+        # Each manifest is answered once the other one is requested
+        self._stub.gates = {V1_MANIFEST: self._stub.received(V2_MANIFEST),
+                            V2_MANIFEST: self._stub.received(V1_MANIFEST)}
+        dyson_account = self._account()
+        dyson_account.login()
+        self.assertEqual(len(dyson_account.devices()), 6)
+        self.assertEqual(self._stub.gate_timeouts, [])
+        dyson_account.close()
+
+    def test_iter_devices(self):
+        v2_answered = threading.Event()
+        self._stub.gates[V2_MANIFEST] = v2_answered
+        dyson_account = self._account()
+        dyson_account.login()
+        devices = dyson_account.iter_devices()
+        # v1 devices are yielded before the v2 manifest is received
+        self.assertEqual(next(devices).serial, 'device-id-1')
+        v2_answered.set()
+        self.assertEqual(len(list(devices)), 5)
+        self.assertEqual(self._stub.gate_timeouts, [])
+        dyson_account.close()
+
+    def test_iter_devices_not_logged(self):
+        dyson_account = self._account()
+        self.assertRaises(DysonNotLoggedException, dyson_account.iter_devices)
+
+    def test_retry(self):
+        self._stub.failures['/v2/provisioningservice/manifest'] = [503, 502]
+        dyson_account = self._account(retries=2)
+        dyson_account.login()
+        self.assertEqual(len(dyson_account.devices()), 6)
+        self.assertEqual(len(self._stub.requests), 5)
+        dyson_account.close()
+
+    def test_retries_exhausted(self):
+        self._stub.failures[LOGIN_PATH] = [500, 500]
+        dyson_account = self._account(retries=1)
+        self.assertFalse(dyson_account.login())
+        self.assertEqual(len(self._stub.requests), 2)
+        dyson_account.close()
+
+    def test_login_failed(self):
+        self._stub.failures[LOGIN_PATH] = [401]
+        dyson_account = self._account()
+        self.assertFalse(dyson_account.login())
+        # Client errors are not retried
+        self.assertEqual(len(self._stub.requests), 1)
+        dyson_account.close()
+
+    def test_timeout(self):
+        self._stub.delays[LOGIN_PATH] = 0.5
+        dyson_account = self._account(retries=0, timeout=0.1)
+        self.assertRaises(requests.exceptions.RequestException,
+                          dyson_account.login)
+        dyson_account.close()
+
+
+class TestManifestCache(unittest.TestCase):
+    def setUp(self):
+        self._manifests = dict([_manifest('v1'), _manifest('v2')])
+        self._stub = HttpsStub(copy.deepcopy(self._manifests)).start()
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "manifests.json")
+
+    def tearDown(self):
+        self._stub.stop()
+        self._directory.cleanup()
+
+    def _account(self, cache):
+        account = DysonAccount("email", "password", "language",
+                               backoff_factor=0, manifest_cache=cache)
+        account._dyson_api_url = self._stub.host
+        account.login()
+        return account
+
+    def _manifest_requests(self):
+        return len([request for request in self._stub.requests
+                    if request[0] == 'GET'])
+
+    def _update_manifest(self, version, update):
+        path = '/{0}/provisioningservice/manifest'.format(version)
+        self._stub.routes[path] = update(copy.deepcopy(self._stub.routes[
+            path]))
+
+    def test_cached(self):
+        dyson_account = self._account(ManifestCache())
+        devices = dyson_account.devices()
+        self.assertEqual(len(devices), 6)
+        self.assertEqual(self._manifest_requests(), 2)
+        cached_devices = dyson_account.devices()
+        self.assertEqual(self._manifest_requests(), 2)
+        for device, cached_device in zip(devices, cached_devices):
+            self.assertIs(device, cached_device)
+        dyson_account.close()
+
+    def test_refresh(self):
+        dyson_account = self._account(ManifestCache(ttl=0))
+        devices = dyson_account.devices()
+
+        def update(manifest):
+            manifest[0]["Version"] = "21.04.01"
+            manifest[0]["NewVersionAvailable"] = True
+            del manifest[2]
+            return manifest
+
+        self._update_manifest('v1', update)
+        self._update_manifest('v2', lambda manifest: manifest + [
+            dict(manifest[0], Serial="AB1-EU-DBD1232B")])
+        change = dyson_account.refresh()
+        self.assertEqual([device.serial for device in change.added],
+                         ["AB1-EU-DBD1232B"])
+        self.assertEqual(change.removed, [devices[2]])
+        self.assertEqual(change.updated, [devices[0]])
+        self.assertEqual(devices[0].version, "21.04.01")
+        self.assertTrue(devices[0].new_version_available)
+
+        refreshed = dyson_account.devices()
+        self.assertEqual(self._manifest_requests(), 6)
+        self.assertEqual(len(refreshed), 6)
+        self.assertIs(refreshed[0], devices[0])
+        self.assertNotIn(devices[2], refreshed)
+        dyson_account.close()
+
+    def test_refresh_in_background(self):
+        dyson_account = self._account(ManifestCache(ttl=0))
+        devices = dyson_account.devices()
+        self._update_manifest('v1', lambda manifest: manifest[:1])
+        v1_answered = threading.Event()
+        self._stub.gates[V1_MANIFEST] = v1_answered
+        # Returned while the manifests are being fetched
+        self.assertEqual(dyson_account.devices(refresh_in_background=True),
+                         devices)
+        refresh_thread = dyson_account._refresh_thread
+        v1_answered.set()
+        refresh_thread.join(5)
+        self.assertFalse(refresh_thread.is_alive())
+        self.assertEqual(len(dyson_account.devices(True)), 4)
+        refresh_thread = dyson_account._refresh_thread
+        if refresh_thread is not None:
+            refresh_thread.join(5)
+        self.assertEqual(self._stub.gate_timeouts, [])
+        dyson_account.close()
+
+    def test_disk(self):
+        dyson_account = self._account(ManifestCache(self._path))
+        self.assertEqual(len(dyson_account.devices()), 6)
+        self.assertEqual(stat.S_IMODE(os.stat(self._path).st_mode), 0o600)
+        dyson_account.close()
+
+        # After a restart, devices are built without fetching manifests
+        dyson_account = self._account(ManifestCache(self._path))
+        devices = dyson_account.devices()
+        self.assertEqual(len(devices), 6)
+        self.assertEqual(devices[0].credentials, 'password1')
+        self.assertEqual(self._manifest_requests(), 2)
+        dyson_account.close()
+
+    def test_other_account(self):
+        cache = ManifestCache()
+        self._account(cache).devices()
+        other = DysonAccount("other", "password", "language",
+                             manifest_cache=cache)
+        other._dyson_api_url = self._stub.host
+        other.login()
+        other.devices()
+        self.assertEqual(self._manifest_requests(), 4)
+        other.close()
+
+    def test_invalid_file(self):
+        with open(self._path, "w") as cache_file:
+            cache_file.write("{invalid")
+        cache = ManifestCache(self._path)
+        self.assertIsNone(cache.get("account"))
+        cache.put("account", [], [])
+        self.assertEqual(ManifestCache(self._path).get("account").manifest,
+                         [])
+        self.assertTrue(cache.remove("account"))
+        self.assertFalse(cache.remove("account"))
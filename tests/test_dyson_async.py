@@ -0,0 +1,268 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+from libpurecool.const import DYSON_PURE_COOL, DYSON_360_EYE, FanSpeed
+from libpurecool.dyson_async import AsyncDysonPureCool, AsyncDyson360Eye, \
+    async_device
+from libpurecool.dyson_device import ConnectTimeouts
+from libpurecool.dyson_pure_cool import DysonPureCool
+from libpurecool.dyson_pure_state_v2 import DysonPureCoolV2State, \
+    DysonEnvironmentalSensorV2State
+from libpurecool.dyson_360_eye import Dyson360EyeState
+
+from .mqtt_broker import MqttBroker, DeviceStandIn
+
+CREDENTIALS = "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1K" \
+              "e1i0ZHakFH84DZuxsSQ4KTT2vbCm7uYeTORULKLKQ=="
+
+
+def _load(fixture):
+    return json.loads(open("tests/data/" + fixture, "r").read())
+
+
+def _device_json(serial, product_type):
+    return {
+        "Serial": serial,
+        "Name": serial,
+        "ScaleUnit": "SU01",
+        "Version": "21.03.08",
+        "LocalCredentials": CREDENTIALS,
+        "AutoUpdate": True,
+        "NewVersionAvailable": False,
+        "ProductType": product_type
+    }
+
+
+async def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+class TestAsyncDevice(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._broker = MqttBroker().start()
+
+    def tearDown(self):
+        self._broker.stop()
+        self._loop.close()
+        asyncio.set_event_loop(None)
+
+    def _run(self, coroutine):
+        return self._loop.run_until_complete(
+            asyncio.wait_for(coroutine, 10))
+
+    def _add_fan(self, serial):
+        return self._broker.add_device(DeviceStandIn(
+            DYSON_PURE_COOL, serial, "password1",
+            _load("state_pure_cool.json"), _load("sensor_pure_cool.json")))
+
+    def test_connect(self):
+        self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+
+        async def scenario():
+            connected = await device.connect("127.0.0.1",
+                                             self._broker.port)
+            await device.disconnect()
+            return connected
+
+        self.assertTrue(self._run(scenario()))
+        self.assertTrue(isinstance(device.state, DysonPureCoolV2State))
+        self.assertEqual(device.state.speed, "AUTO")
+        self.assertTrue(isinstance(device.environmental_state,
+                                   DysonEnvironmentalSensorV2State))
+        self.assertFalse(device.device_available)
+
+    def test_connect_wrong_password(self):
+        self._add_fan("device-id-1").password = "other"
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+        self.assertFalse(self._run(device.connect("127.0.0.1",
+                                                  self._broker.port)))
+        self.assertFalse(device.device_available)
+
+    def test_connect_timeout(self):
+        self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+        device.connection_callback = lambda connected: None
+        self.assertFalse(self._run(device.connect(
+            "127.0.0.1", self._broker.port,
+            timeouts=ConnectTimeouts(1, 0.1, 1, 1))))
+
+    def test_connect_no_data(self):
+        self._add_fan("device-id-1").silent = True
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+        self.assertFalse(self._run(device.connect(
+            "127.0.0.1", self._broker.port,
+            timeouts=ConnectTimeouts(1, 1, 0.1, 0.1))))
+        self.assertFalse(device.connected)
+
+    def test_command(self):
+        stand_in = self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+
+        async def scenario():
+            await device.connect("127.0.0.1", self._broker.port)
+            messages = device.messages()
+            acknowledged = await device.set_fan_speed(FanSpeed.FAN_SPEED_4)
+            async for message in messages:
+                if isinstance(message, DysonPureCoolV2State):
+                    break
+            await device.disconnect()
+            return acknowledged, message
+
+        acknowledged, message = self._run(scenario())
+        self.assertTrue(acknowledged)
+        self.assertEqual(message.speed, "0004")
+        self.assertEqual(device.state.speed, "0004")
+        self.assertEqual(stand_in.commands[-1]["data"]["fnsp"], "0004")
+
+    def test_set_configuration(self):
+        stand_in = self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+
+        async def scenario():
+            await device.connect("127.0.0.1", self._broker.port)
+            confirmed = await device.set_configuration(
+                fan_speed=FanSpeed.FAN_SPEED_4)
+            await device.disconnect()
+            return confirmed
+
+        self.assertTrue(self._run(scenario()))
+        self.assertEqual(stand_in.commands[-1]["data"]["fnsp"], "0004")
+        self.assertEqual(stand_in.commands[-1]["data"]["ancp"], "CUST")
+
+    def test_command_buffer(self):
+        stand_in = self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+        device.enable_command_buffer(window=0.05)
+
+        async def scenario():
+            await device.connect("127.0.0.1", self._broker.port)
+            commands = len(stand_in.commands)
+            acknowledged = await asyncio.gather(
+                device.set_fan_speed(FanSpeed.FAN_SPEED_4),
+                device.enable_night_mode(),
+                device.set_fan_speed(FanSpeed.FAN_SPEED_5))
+            await device.disconnect()
+            return acknowledged, stand_in.commands[commands:]
+
+        acknowledged, commands = self._run(scenario())
+        self.assertEqual(acknowledged, [True, True, True])
+        self.assertEqual([command["msg"] for command in commands],
+                         ["STATE-SET"])
+        self.assertEqual(commands[0]["data"], {"fnsp": "0005",
+                                               "nmod": "ON"})
+
+    def test_command_not_confirmed(self):
+        stand_in = self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+        device.command_timeout = 0.2
+
+        async def scenario():
+            await device.connect("127.0.0.1", self._broker.port)
+            stand_in.silent = True
+            confirmed = await device.set_fan_speed(FanSpeed.FAN_SPEED_4)
+            commands = len(stand_in.commands)
+            pending = device.set_fan_speed(FanSpeed.FAN_SPEED_5)
+            # Received by the broker thread, but not confirmed
+            received = await _wait_for(
+                lambda: len(stand_in.commands) > commands)
+            await device.disconnect()
+            return confirmed, received, await pending
+
+        self.assertEqual(self._run(scenario()), (False, True, False))
+        self.assertEqual(stand_in.commands[-1]["data"], {"fnsp": "0005"})
+
+    def test_command_not_connected(self):
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+        self.assertFalse(self._run(device.set_fan_speed(
+            FanSpeed.FAN_SPEED_4)))
+
+    def test_messages_end_on_disconnect(self):
+        self._add_fan("device-id-1")
+        device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                 DYSON_PURE_COOL))
+
+        async def scenario():
+            await device.connect("127.0.0.1", self._broker.port)
+            messages = device.messages()
+            device.request_current_state()
+            received = []
+            async for message in messages:
+                received.append(message)
+                await device.disconnect()
+            return received
+
+        received = self._run(scenario())
+        self.assertEqual(len(received), 1)
+        self.assertEqual(device.callback_message, [])
+
+    def test_devices_share_loop_thread(self):
+        devices = []
+        for index in range(20):
+            serial = "device-id-{0}".format(index)
+            self._add_fan(serial)
+            devices.append(AsyncDysonPureCool(_device_json(serial,
+                                                           DYSON_PURE_COOL)))
+        threads = threading.active_count()
+
+        async def scenario():
+            results = await asyncio.gather(*[
+                device.connect("127.0.0.1", self._broker.port)
+                for device in devices])
+            connected_threads = threading.active_count()
+            await asyncio.gather(*[device.disconnect() for device in devices])
+            # The broker closes the connections asynchronously
+            for _ in range(100):
+                if not self._broker.client_count:
+                    break
+                await asyncio.sleep(0.01)
+            return results, connected_threads
+
+        results, connected_threads = self._run(scenario())
+        self.assertEqual(results, [True] * 20)
+        self.assertEqual(self._broker.client_count, 0)
+        # Only the default executor threads used by the TCP connections
+        self.assertLess(connected_threads - threads, 20)
+
+    def test_async_device(self):
+        device = DysonPureCool(_device_json("device-id-1", DYSON_PURE_COOL))
+        converted = async_device(device)
+        self.assertTrue(isinstance(converted, AsyncDysonPureCool))
+        self.assertEqual(converted.serial, "device-id-1")
+        self.assertEqual(converted.credentials, "password1")
+
+    def test_360_eye(self):
+        stand_in = self._broker.add_device(DeviceStandIn(
+            DYSON_360_EYE, "device-id-1", "password1",
+            _load("vacuum/state.json"),
+            status_topic="{0}/device-id-1/status".format(DYSON_360_EYE)))
+        device = AsyncDyson360Eye(_device_json("device-id-1", DYSON_360_EYE))
+
+        async def scenario():
+            connected = await device.connect("127.0.0.1", self._broker.port)
+            acknowledged = await device.pause()
+            await device.disconnect()
+            return connected, acknowledged
+
+        self.assertEqual(self._run(scenario()), (True, True))
+        self.assertTrue(isinstance(device.state, Dyson360EyeState))
+        self.assertEqual(stand_in.commands[-1]["msg"], "PAUSE")
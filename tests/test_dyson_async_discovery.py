@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from libpurecool.const import DYSON_PURE_COOL
+from libpurecool.dyson_async import AsyncDysonPureCool
+from libpurecool.dyson_async_discovery import AsyncDysonDiscovery, \
+    ServiceEvent
+from libpurecool.dyson_device import NetworkDevice
+from libpurecool.zeroconf import ServiceStateChange, new_socket
+
+from .mdns_responder import MdnsResponder, PublishedService, INTERFACE
+from .mqtt_broker import MqttBroker, DeviceStandIn
+from .test_dyson_async import _device_json, _load
+
+
+class TestAsyncDysonDiscovery(unittest.TestCase):
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._responder = MdnsResponder().start()
+        self._discovery = AsyncDysonDiscovery(interfaces=[INTERFACE])
+
+    def tearDown(self):
+        self._discovery.close()
+        self._responder.stop()
+        self._loop.close()
+        asyncio.set_event_loop(None)
+
+    def _run(self, coroutine):
+        return self._loop.run_until_complete(
+            asyncio.wait_for(coroutine, 10))
+
+    def test_resolve(self):
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        self.assertEqual(network_device.name, "device-id-1")
+        self.assertEqual(network_device.address, INTERFACE)
+        self.assertEqual(network_device.port, 1883)
+        self.assertTrue(self._discovery.started)
+        self.assertEqual(self._discovery.devices,
+                         {"device-id-1": network_device})
+        # Devices already found are returned without waiting
+        self.assertIs(self._run(self._discovery.resolve("device-id-1", 0)),
+                      network_device)
+
+    def test_resolve_split_answers(self):
+        self._responder.split_answers = True
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        self.assertEqual(network_device.port, 1883)
+        self.assertIn(("475_device-id-1._dyson_mqtt._tcp.local.", 33),
+                      self._responder.queries)
+        self.assertIn(("device-id-1.local.", 1), self._responder.queries)
+
+    def test_resolve_timeout(self):
+        self.assertIsNone(self._run(self._discovery.resolve("device-id-1",
+                                                            0.3)))
+
+    def test_start_once(self):
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+        endpoints = []
+        create_endpoint = self._loop.create_datagram_endpoint
+
+        async def create_datagram_endpoint(*args, **kwargs):
+            endpoints.append(kwargs["sock"])
+            return await create_endpoint(*args, **kwargs)
+
+        with mock.patch.object(self._loop, 'create_datagram_endpoint',
+                               create_datagram_endpoint):
+            results = self._run(asyncio.gather(
+                self._discovery.resolve("device-id-1"),
+                self._discovery.resolve("device-id-1")))
+        self.assertEqual([result.port for result in results], [1883, 1883])
+        self.assertEqual(len(endpoints), 1)
+        self.assertEqual(len(self._discovery._senders), 1)
+
+    def _spy_sockets(self):
+        sockets = []
+
+        def new_socket_spy():
+            sockets.append(new_socket())
+            return sockets[-1]
+
+        return sockets, mock.patch(
+            'libpurecool.dyson_async_discovery.new_socket', new_socket_spy)
+
+    def test_start_no_interface(self):
+        # Documentation address, not an interface of this host
+        self._discovery = AsyncDysonDiscovery(interfaces=["192.0.2.1"])
+        sockets, spy = self._spy_sockets()
+        with spy, self.assertRaises(OSError):
+            self._run(self._discovery.resolve("device-id-1"))
+        self.assertFalse(self._discovery.started)
+        self.assertEqual(len(sockets), 1)
+        self.assertEqual(sockets[0].fileno(), -1)
+
+    def test_start_endpoint_error(self):
+        sockets, spy = self._spy_sockets()
+        with spy, mock.patch.object(self._loop, 'create_datagram_endpoint',
+                                    side_effect=OSError("unavailable")):
+            with self.assertRaises(OSError):
+                self._run(self._discovery.start())
+        self.assertFalse(self._discovery.started)
+        # Listen socket and sender
+        self.assertEqual(len(sockets), 2)
+        self.assertTrue(all(sock.fileno() == -1 for sock in sockets))
+
+    def test_resolve_cached(self):
+        cache = mock.Mock()
+        cache.get.return_value = NetworkDevice("device-id-1", "192.168.0.2",
+                                               1883)
+        self._discovery = AsyncDysonDiscovery(interfaces=[INTERFACE],
+                                              cache=cache)
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        self.assertEqual(network_device.address, "192.168.0.2")
+        self.assertFalse(self._discovery.started)
+
+        cache.remove.return_value = True
+        self.assertTrue(self._discovery.forget_cached("device-id-1"))
+        cache.remove.assert_called_once_with("device-id-1")
+
+    def test_cache_saved(self):
+        cache = mock.Mock()
+        cache.get.return_value = None
+        self._discovery = AsyncDysonDiscovery(interfaces=[INTERFACE],
+                                              cache=cache)
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        cache.put.assert_called_once_with(network_device)
+        cache.remove.return_value = True
+        self.assertTrue(self._discovery.forget_cached("device-id-1"))
+        cache.remove.assert_called_once_with("device-id-1")
+
+    def test_forget_address_changed(self):
+        service = self._responder.add_service(
+            PublishedService("device-id-1", 1883, address="192.168.0.2"))
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        self.assertEqual(network_device.address, "192.168.0.2")
+
+        # DHCP lease renewed with another address
+        service.address = "192.168.0.3"
+        self.assertTrue(self._discovery.forget_cached("device-id-1"))
+        self.assertEqual(self._discovery.devices, {})
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        self.assertEqual(network_device.address, "192.168.0.3")
+        self.assertFalse(self._discovery.forget_cached("device-id-2"))
+
+    def test_services(self):
+        first = self._responder.add_service(
+            PublishedService("device-id-1", 1883))
+
+        async def scenario():
+            events = []
+            await self._discovery.start()
+            async for event in self._discovery.services():
+                events.append(event)
+                if len(events) == 1:
+                    self._responder.add_service(
+                        PublishedService("device-id-2", 1884))
+                    self._responder.announce(
+                        self._responder.services[
+                            "475_device-id-2._dyson_mqtt._tcp.local."])
+                elif len(events) == 2:
+                    self._responder.remove_service(first)
+                else:
+                    self._discovery.close()
+            return events
+
+        events = self._run(scenario())
+        self.assertEqual(
+            [(event.state_change, event.serial) for event in events],
+            [(ServiceStateChange.Added, "device-id-1"),
+             (ServiceStateChange.Added, "device-id-2"),
+             (ServiceStateChange.Removed, "device-id-1")])
+        self.assertEqual(events[1].network_device.port, 1884)
+        self.assertEqual(self._discovery.devices, {})
+
+    def test_services_known_first(self):
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+        network_device = self._run(self._discovery.resolve("device-id-1"))
+        iterator = self._discovery.services()
+        event = self._run(iterator.__anext__())
+        self.assertEqual(event, ServiceEvent(ServiceStateChange.Added,
+                                             "device-id-1", network_device))
+        iterator.close()
+        with self.assertRaises(StopAsyncIteration):
+            self._run(iterator.__anext__())
+
+    def test_shares_event_loop(self):
+        threads = threading.active_count()
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+
+        async def scenario():
+            async with AsyncDysonDiscovery(interfaces=[INTERFACE]) as other:
+                return await asyncio.gather(
+                    self._discovery.resolve("device-id-1"),
+                    other.resolve("device-id-1"))
+
+        results = self._run(scenario())
+        self.assertEqual([result.port for result in results], [1883, 1883])
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_ignore_other_services(self):
+        self._responder.add_service(PublishedService("device-id-1", 1883))
+        self._run(self._discovery.resolve("device-id-1"))
+        packet = mock.Mock()
+        with mock.patch('libpurecool.dyson_async_discovery.DNSIncoming',
+                        packet):
+            self._discovery._handle_packet(
+                b"\x00" * 12 + b"\x0a_googlecast\x04_tcp\x05local\x00")
+        packet.assert_not_called()
+
+    def test_auto_connect(self):
+        broker = MqttBroker().start()
+        try:
+            broker.add_device(DeviceStandIn(
+                DYSON_PURE_COOL, "device-id-1", "password1",
+                _load("state_pure_cool.json"),
+                _load("sensor_pure_cool.json")))
+            self._responder.add_service(PublishedService(
+                "device-id-1", broker.port, product_type=DYSON_PURE_COOL))
+            device = AsyncDysonPureCool(_device_json("device-id-1",
+                                                     DYSON_PURE_COOL))
+
+            async def scenario():
+                connected = await device.auto_connect(
+                    timeout=5, retry=1, discovery=self._discovery)
+                await device.disconnect()
+                return connected
+
+            self.assertTrue(self._run(scenario()))
+            self.assertEqual(device.network_device.port, broker.port)
+        finally:
+            broker.stop()
@@ -0,0 +1,128 @@
+import threading
+import unittest
+from unittest import mock
+
+from libpurecool.dyson_command_buffer import CommandBuffer, call_later
+
+
+class _Timer:
+    """Timer calling callbacks only when fired by the test."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, delay, callback):
+        handle = mock.Mock()
+        self.calls.append((delay, callback, handle))
+        return handle
+
+    def fire(self):
+        _, callback, _ = self.calls[-1]
+        callback()
+
+
+class TestCommandBuffer(unittest.TestCase):
+    def setUp(self):
+        self._published = []
+        self._expected = []
+        self._timer = _Timer()
+
+    def _publish(self, data, expected):
+        self._published.append(data)
+        self._expected.append(expected)
+        return len(self._published)
+
+    def test_merge(self):
+        buffer = CommandBuffer(self._publish, 0.05, timer=self._timer)
+        first = buffer.submit({"fnsp": "0004", "oson": "OFF"})
+        second = buffer.submit({"oson": "ON"})
+        third = buffer.submit({"nmod": "ON"})
+        self.assertEqual(len(self._timer.calls), 1)
+        self.assertEqual(self._timer.calls[0][0], 0.05)
+        self.assertEqual(buffer.pending, {"fnsp": "0004", "oson": "ON",
+                                          "nmod": "ON"})
+        self.assertFalse(first.done())
+
+        self._timer.fire()
+        self.assertEqual(self._published,
+                         [{"fnsp": "0004", "oson": "ON", "nmod": "ON"}])
+        self.assertEqual([first.result(), second.result(), third.result()],
+                         [1, 1, 1])
+        self.assertEqual(buffer.pending, {})
+
+        # Next configuration starts a new window
+        buffer.submit({"fnsp": "0005"})
+        self.assertEqual(len(self._timer.calls), 2)
+
+    def test_merge_expected(self):
+        buffer = CommandBuffer(self._publish, 0.05, timer=self._timer)
+        buffer.submit({"fnsp": "0004"})
+        # Completed with the current state, sent with the new fan speed
+        buffer.submit({"fnsp": "AUTO", "nmod": "ON"}, {"nmod": "ON"})
+        buffer.submit({"oson": "ON", "nmod": "OFF"}, {"oson": "ON"})
+        self._timer.fire()
+        self.assertEqual(self._published,
+                         [{"fnsp": "0004", "nmod": "ON", "oson": "ON"}])
+        self.assertEqual(self._expected,
+                         [{"fnsp": "0004", "nmod": "ON", "oson": "ON"}])
+
+    @mock.patch('libpurecool.dyson_command_buffer.time.monotonic')
+    def test_max_rate(self, monotonic):
+        monotonic.return_value = 100
+        buffer = CommandBuffer(self._publish, 0.05, max_rate=2,
+                               timer=self._timer)
+        buffer.submit({"fnsp": "0004"})
+        self._timer.fire()
+
+        monotonic.return_value = 100.1
+        future = buffer.submit({"fnsp": "0005"})
+        self.assertAlmostEqual(self._timer.calls[1][0], 0.4)
+        self._timer.fire()
+        self.assertEqual(future.result(), 2)
+
+        # Rate respected: the window applies
+        monotonic.return_value = 101
+        buffer.submit({"fnsp": "0006"})
+        self.assertEqual(self._timer.calls[2][0], 0.05)
+
+    def test_flush(self):
+        buffer = CommandBuffer(self._publish, 0.05, timer=self._timer)
+        future = buffer.submit({"fnsp": "0004"})
+        buffer.flush()
+        self.assertEqual(future.result(), 1)
+        self._timer.calls[0][2].cancel.assert_called_once_with()
+        # Nothing pending
+        buffer.flush()
+        self.assertEqual(len(self._published), 1)
+
+    def test_publish_error(self):
+        error = ValueError("not serializable")
+        buffer = CommandBuffer(mock.Mock(side_effect=error), 0.05,
+                               timer=self._timer)
+        future = buffer.submit({"fnsp": "0004"})
+        self._timer.fire()
+        self.assertIs(future.exception(), error)
+
+    def test_cancel(self):
+        buffer = CommandBuffer(self._publish, 0.05, timer=self._timer)
+        future = buffer.submit({"fnsp": "0004"})
+        buffer.cancel()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(buffer.pending, {})
+        self._timer.calls[0][2].cancel.assert_called_once_with()
+        self.assertEqual(self._published, [])
+
+    def test_call_later(self):
+        calls = []
+        done = threading.Event()
+        call_later(0.2, done.set)
+        call_later(0.1, lambda: calls.append(threading.get_ident()))
+        call_later(0.05, lambda: calls.append(threading.get_ident()))
+        call_later(0.01, lambda: calls.append("cancelled")).cancel()
+        threads = threading.active_count()
+        self.assertTrue(done.wait(5))
+        # Callbacks called by one thread
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(set(calls)), 1)
+        self.assertNotEqual(calls[0], threading.get_ident())
+        self.assertLessEqual(threading.active_count(), threads)
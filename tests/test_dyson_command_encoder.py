@@ -0,0 +1,140 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+from libpurecool.const import FanMode, FanSpeed, NightMode, Oscillation, \
+    OscillationV2, HeatMode, HeatTarget, FocusMode, ResetFilter, FanPower
+from libpurecool.dyson_command_encoder import message_time, \
+    state_set_payload
+from libpurecool.dyson_pure_cool import DysonPureCool
+from libpurecool.dyson_pure_cool_link import DysonPureCoolLink
+from libpurecool.dyson_pure_hotcool import DysonPureHotCool
+from libpurecool.dyson_pure_hotcool_link import DysonPureHotCoolLink
+from libpurecool.dyson_pure_state import DysonPureCoolState, \
+    DysonPureHotCoolState
+from libpurecool.dyson_pure_state_v2 import DysonPureCoolV2State, \
+    DysonPureHotCoolV2State
+
+
+def _state(state_class, fixture):
+    return state_class(open("tests/data/" + fixture, "r").read())
+
+
+def _json_payload(data, timestamp):
+    """Encode a configuration as done before compiled encoders."""
+    return json.dumps({
+        "msg": "STATE-SET",
+        "time": timestamp.decode("ascii"),
+        "mode-reason": "LAPP",
+        "data": data
+    })
+
+
+class TestCommandEncoder(unittest.TestCase):
+    def _assert_same_payload(self, device_class, state, kwargs):
+        encoder = device_class._COMMAND_ENCODER
+        timestamp = message_time()
+        payload, values = encoder.encode(kwargs, state, timestamp)
+        data = encoder.data(kwargs, state)
+        self.assertEqual(payload, state_set_payload(data, timestamp))
+        self.assertEqual(values, list(encoder.given(kwargs, data).items()))
+        return json.loads(payload)["data"]
+
+    def test_pure_cool_link(self):
+        data = self._assert_same_payload(
+            DysonPureCoolLink, _state(DysonPureCoolState, "state.json"),
+            {"fan_mode": FanMode.FAN, "fan_speed": FanSpeed.FAN_SPEED_3,
+             "oscillation": Oscillation.OSCILLATION_ON, "sleep_timer": 0})
+        self.assertEqual(data["fmod"], "FAN")
+        self.assertEqual(data["fnsp"], "0003")
+        self.assertEqual(data["sltm"], 0)
+        self.assertEqual(data["rstf"], "STET")
+        self.assertEqual(data["qtar"], "0004")
+
+    def test_pure_hot_cool_link(self):
+        data = self._assert_same_payload(
+            DysonPureHotCoolLink,
+            _state(DysonPureHotCoolState, "state_hot.json"),
+            {"heat_mode": HeatMode.HEAT_ON,
+             "heat_target": HeatTarget.celsius(25),
+             "focus_mode": FocusMode.FOCUS_ON})
+        self.assertEqual(data["hmod"], "HEAT")
+        self.assertEqual(data["hmax"], "2980")
+        self.assertEqual(data["ffoc"], "ON")
+        self.assertEqual(data["sltm"], "STET")
+
+    def test_pure_cool(self):
+        data = self._assert_same_payload(
+            DysonPureCool, _state(DysonPureCoolV2State,
+                                  "state_pure_cool.json"),
+            {"fan_power": FanPower.POWER_ON,
+             "oscillation": OscillationV2.OSCILLATION_ON,
+             "sleep_timer": 240, "oscillation_angle_low": 110,
+             "reset_filter": ResetFilter.RESET_FILTER})
+        self.assertEqual(data["fpwr"], "ON")
+        self.assertEqual(data["oson"], "OION")
+        self.assertEqual(data["sltm"], "240")
+        self.assertEqual(data["ancp"], "CUST")
+        self.assertEqual(data["osal"], "110")
+        self.assertEqual(data["rstf"], "RSTF")
+
+    def test_pure_hot_cool(self):
+        data = self._assert_same_payload(
+            DysonPureHotCool, _state(DysonPureHotCoolV2State,
+                                     "state_pure_hotcool.json"),
+            {"heat_mode": HeatMode.HEAT_ON,
+             "heat_target": HeatTarget.celsius(25)})
+        self.assertEqual(data["hmod"], "HEAT")
+        self.assertEqual(data["hmax"], "2980")
+        self.assertEqual(data["ancp"], "CUST")
+
+    def test_given(self):
+        encoder = DysonPureCool._COMMAND_ENCODER
+        state = _state(DysonPureCoolV2State, "state_pure_cool.json")
+        kwargs = {"fan_speed": FanSpeed.FAN_SPEED_4, "sleep_timer": 0,
+                  "oscillation_angle_low": 110}
+        values = encoder.encode(kwargs, state)[1]
+        # Values completed from the state and constants are not given
+        self.assertEqual(values, [("fnsp", "0004"), ("sltm", "0"),
+                                  ("osal", "110")])
+
+    def test_invalid_value(self):
+        state = _state(DysonPureCoolV2State, "state_pure_cool.json")
+        with self.assertRaises(TypeError):
+            DysonPureCool._COMMAND_ENCODER.encode(
+                {"oscillation": Oscillation.OSCILLATION_ON}, state)
+        with self.assertRaises(TypeError):
+            DysonPureCool._COMMAND_ENCODER.encode(
+                {"night_mode": "ON"}, state)
+
+    def test_message_time(self):
+        with mock.patch('libpurecool.dyson_command_encoder.time.time',
+                        return_value=1500000000.5), \
+                mock.patch('libpurecool.dyson_command_encoder.time.strftime',
+                           wraps=time.strftime) as strftime:
+            self.assertEqual(message_time(), b"2017-07-14T02:40:00Z")
+            self.assertEqual(message_time(), b"2017-07-14T02:40:00Z")
+        self.assertEqual(strftime.call_count, 1)
+
+    def test_json_payload(self):
+        # Data built by _parse_command_args before compiled encoders
+        timestamp = message_time()
+        cases = [
+            (DysonPureCoolLink, _state(DysonPureCoolState, "state.json"),
+             {"fan_speed": FanSpeed.FAN_SPEED_4, "sleep_timer": 0},
+             {"fmod": "AUTO", "fnsp": "0004", "oson": "OFF", "sltm": 0,
+              "rhtm": "ON", "rstf": "STET", "qtar": "0004", "nmod": "ON"}),
+            (DysonPureCool, _state(DysonPureCoolV2State,
+                                   "state_pure_cool.json"),
+             {"fan_speed": FanSpeed.FAN_SPEED_4,
+              "night_mode": NightMode.NIGHT_MODE_ON},
+             {"fpwr": "OFF", "fdir": "OFF", "auto": "OFF", "oson": "OIOF",
+              "nmod": "ON", "rhtm": "OFF", "fnsp": "0004", "sltm": "STET",
+              "ancp": "CUST", "osal": "0063", "osau": "0243",
+              "rstf": "STET"})]
+        for device_class, state, kwargs, data in cases:
+            payload = device_class._COMMAND_ENCODER.encode(
+                kwargs, state, timestamp)[0]
+            self.assertEqual(payload,
+                             _json_payload(data, timestamp).encode("utf-8"))
@@ -0,0 +1,266 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from libpurecool.dyson_device import NetworkDevice
+from libpurecool.dyson_discovery import DysonDiscovery, default_discovery, \
+    service_serial, DiscoveryCache, DYSON_SERVICE_TYPE, RESOLVE_DELAY
+from libpurecool.zeroconf import DNSCache, DNSService, DNSAddress, \
+    DNSPointer, Zeroconf, _TYPE_PTR, _TYPE_SRV, _TYPE_A, _CLASS_IN
+
+from .mdns_responder import MdnsResponder, PublishedService, INTERFACE
+
+
+def _service_info(name, address, port=1883):
+    info = Mock()
+    info.name = name
+    info.address = socket.inet_aton(address)
+    info.port = port
+    return info
+
+
+def _zeroconf(addresses):
+    """Return a zeroconf mock resolving services to addresses by name."""
+    zeroconf = Mock()
+    zeroconf.engine.call_later.side_effect = \
+        lambda delay, callback: callback()
+
+    def request_service_infos(service_type, names, callback, timeout=3000,
+                              handler=None):
+        infos = {}
+        for name in names:
+            infos[name] = None
+            if addresses.get(name) is not None:
+                infos[name] = _service_info(name, addresses[name])
+                handler(infos[name])
+        callback(infos)
+
+    zeroconf.request_service_infos.side_effect = request_service_infos
+    return zeroconf
+
+
+@mock.patch('libpurecool.dyson_discovery.ServiceBrowser')
+@mock.patch('libpurecool.dyson_discovery.Zeroconf')
+class TestDysonDiscovery(unittest.TestCase):
+    def setUp(self):
+        self._discovery = DysonDiscovery()
+
+    def _announce(self, serial, address, product_type="475"):
+        name = "{0}_{1}.{2}".format(product_type, serial, DYSON_SERVICE_TYPE)
+        self._discovery.add_service(_zeroconf({name: address}),
+                                    DYSON_SERVICE_TYPE, name)
+
+    def test_service_serial(self, mocked_zeroconf, mocked_browser):
+        self.assertEqual(service_serial(
+            "475_device-id-1._dyson_mqtt._tcp.local."), "device-id-1")
+
+    def test_browse_once(self, mocked_zeroconf, mocked_browser):
+        self.assertFalse(self._discovery.browsing)
+        self.assertIsNone(self._discovery.find("device-id-1", 0.01))
+        self.assertIsNone(self._discovery.find("device-id-2", 0.01))
+        self.assertTrue(self._discovery.browsing)
+        mocked_zeroconf.assert_called_once_with(filter_packets=True)
+        mocked_browser.assert_called_once_with(
+            mocked_zeroconf.return_value, DYSON_SERVICE_TYPE,
+            listener=self._discovery)
+
+    def test_find_known_device(self, mocked_zeroconf, mocked_browser):
+        self._announce("device-id-1", "192.168.0.2")
+        network_device = self._discovery.find("device-id-1", 0)
+        self.assertEqual(network_device.name, "device-id-1")
+        self.assertEqual(network_device.address, "192.168.0.2")
+        self.assertEqual(network_device.port, 1883)
+        # Known devices are found without browsing
+        self.assertEqual(mocked_zeroconf.call_count, 0)
+
+    def test_find_wait(self, mocked_zeroconf, mocked_browser):
+        timer = threading.Timer(0.05, self._announce,
+                                ("device-id-1", "192.168.0.2"))
+        timer.start()
+        network_device = self._discovery.find("device-id-1", 5)
+        timer.join()
+        self.assertEqual(network_device.address, "192.168.0.2")
+
+    def test_many_devices(self, mocked_zeroconf, mocked_browser):
+        for index in range(10):
+            self._announce("device-id-{0}".format(index),
+                           "192.168.0.{0}".format(index + 2))
+        for index in range(10):
+            self.assertEqual(
+                self._discovery.find("device-id-{0}".format(index), 0).address,
+                "192.168.0.{0}".format(index + 2))
+        self.assertEqual(len(self._discovery.devices), 10)
+
+    def test_remove_service(self, mocked_zeroconf, mocked_browser):
+        self._announce("device-id-1", "192.168.0.2")
+        self._discovery.remove_service(
+            Mock(), DYSON_SERVICE_TYPE,
+            "475_device-id-1.{0}".format(DYSON_SERVICE_TYPE))
+        self.assertEqual(self._discovery.devices, {})
+
+    def test_unresolved_service(self, mocked_zeroconf, mocked_browser):
+        self._discovery.add_service(
+            _zeroconf({}), DYSON_SERVICE_TYPE,
+            "475_device-id-1.{0}".format(DYSON_SERVICE_TYPE))
+        self.assertEqual(self._discovery.devices, {})
+
+    def test_resolve_batch(self, mocked_zeroconf, mocked_browser):
+        names = ["475_device-id-{0}.{1}".format(index, DYSON_SERVICE_TYPE)
+                 for index in range(3)]
+        zeroconf = _zeroconf({name: "192.168.0.2" for name in names})
+        callbacks = []
+        zeroconf.engine.call_later.side_effect = \
+            lambda delay, callback: callbacks.append((delay, callback))
+        for name in names:
+            self._discovery.add_service(zeroconf, DYSON_SERVICE_TYPE, name)
+        # Services added within the delay are resolved at once
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(callbacks[0][0], RESOLVE_DELAY * 1000)
+        callbacks[0][1]()
+        zeroconf.request_service_infos.assert_called_once_with(
+            DYSON_SERVICE_TYPE, names, mock.ANY, handler=mock.ANY)
+        self.assertEqual(len(self._discovery.devices), 3)
+
+    def test_forget_address_changed(self, mocked_zeroconf, mocked_browser):
+        name = "475_device-id-1.{0}".format(DYSON_SERVICE_TYPE)
+        addresses = {name: "192.168.0.2"}
+        zeroconf = _zeroconf(addresses)
+        zeroconf.cache = DNSCache()
+        records = [
+            DNSPointer(DYSON_SERVICE_TYPE, _TYPE_PTR, _CLASS_IN, 120, name),
+            DNSService(name, _TYPE_SRV, _CLASS_IN, 120, 0, 0, 1883,
+                       "device-id-1.local."),
+            DNSAddress("device-id-1.local.", _TYPE_A, _CLASS_IN, 120,
+                       socket.inet_aton("192.168.0.2"))]
+        for record in records:
+            zeroconf.cache.add(record)
+        mocked_zeroconf.return_value = zeroconf
+        self._discovery.start()
+        self._discovery.add_service(zeroconf, DYSON_SERVICE_TYPE, name)
+        self.assertEqual(self._discovery.find("device-id-1", 0).address,
+                         "192.168.0.2")
+
+        # DHCP lease renewed with another address
+        addresses[name] = "192.168.0.3"
+        self.assertTrue(self._discovery.forget_cached("device-id-1"))
+        self.assertEqual(self._discovery.find("device-id-1", 0).address,
+                         "192.168.0.3")
+        # Service records removed, but the pointer
+        self.assertEqual(zeroconf.cache.entries_with_name(name), [])
+        self.assertEqual(
+            zeroconf.cache.entries_with_name("device-id-1.local."), [])
+        self.assertEqual(
+            zeroconf.cache.entries_with_name(DYSON_SERVICE_TYPE),
+            [records[0]])
+        self.assertFalse(self._discovery.forget_cached("device-id-2"))
+
+    def test_close(self, mocked_zeroconf, mocked_browser):
+        self._discovery.start()
+        self._announce("device-id-1", "192.168.0.2")
+        self._discovery.close()
+        self.assertFalse(self._discovery.browsing)
+        self.assertEqual(self._discovery.devices, {})
+        self.assertEqual(mocked_zeroconf.return_value.close.call_count, 1)
+
+    def test_default_discovery(self, mocked_zeroconf, mocked_browser):
+        self.assertIs(default_discovery(), default_discovery())
+
+
+class TestDysonDiscoveryNetwork(unittest.TestCase):
+    def setUp(self):
+        # Devices answering one after the other, in separate packets
+        self._responder = MdnsResponder(split_answers=True,
+                                        answer_interval=0.03).start()
+        patcher = mock.patch(
+            'libpurecool.dyson_discovery.Zeroconf',
+            lambda **kwargs: Zeroconf(interfaces=[INTERFACE], **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._discovery = DysonDiscovery()
+
+    def tearDown(self):
+        self._discovery.close()
+        self._responder.stop()
+
+    @mock.patch.object(Zeroconf, 'request_service_infos', autospec=True,
+                       side_effect=Zeroconf.request_service_infos)
+    def test_resolve_separate_answers(self, mocked_request):
+        services = [self._responder.add_service(PublishedService(
+            "device-id-{0}".format(index), 1883 + index))
+            for index in range(6)]
+        for service in services:
+            network_device = self._discovery.find(service.serial, 5)
+            self.assertEqual(network_device.address, INTERFACE)
+            self.assertEqual(network_device.port, service.port)
+        # Answers received within the resolve delay are resolved at once
+        batches = [len(call[0][2]) for call in mocked_request.call_args_list]
+        self.assertEqual(sum(batches), 6)
+        self.assertLessEqual(len(batches), 2)
+
+
+class TestDiscoveryCache(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "cache",
+                                  "devices.json")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_put_get(self):
+        cache = DiscoveryCache(self._path)
+        self.assertIsNone(cache.get("device-id-1"))
+        cache.put(NetworkDevice("device-id-1", "192.168.0.2", 1883))
+        network_device = DiscoveryCache(self._path).get("device-id-1")
+        self.assertEqual(network_device.name, "device-id-1")
+        self.assertEqual(network_device.address, "192.168.0.2")
+        self.assertEqual(network_device.port, 1883)
+        with open(self._path) as cache_file:
+            entry = json.load(cache_file)["device-id-1"]
+        self.assertEqual(entry["ttl"], 24 * 3600)
+        self.assertLessEqual(entry["last_seen"], time.time())
+
+    def test_expired(self):
+        cache = DiscoveryCache(self._path, ttl=-1)
+        cache.put(NetworkDevice("device-id-1", "192.168.0.2", 1883))
+        self.assertIsNone(cache.get("device-id-1"))
+        self.assertIsNone(DiscoveryCache(self._path).get("device-id-1"))
+
+    def test_remove(self):
+        cache = DiscoveryCache(self._path)
+        cache.put(NetworkDevice("device-id-1", "192.168.0.2", 1883))
+        self.assertTrue(cache.remove("device-id-1"))
+        self.assertFalse(cache.remove("device-id-1"))
+        self.assertIsNone(DiscoveryCache(self._path).get("device-id-1"))
+
+    def test_invalid_file(self):
+        os.makedirs(os.path.dirname(self._path))
+        with open(self._path, "w") as cache_file:
+            cache_file.write("{invalid")
+        cache = DiscoveryCache(self._path)
+        self.assertIsNone(cache.get("device-id-1"))
+        cache.put(NetworkDevice("device-id-1", "192.168.0.2", 1883))
+        self.assertIsNotNone(DiscoveryCache(self._path).get("device-id-1"))
+
+    @mock.patch('libpurecool.dyson_discovery.ServiceBrowser')
+    @mock.patch('libpurecool.dyson_discovery.Zeroconf')
+    def test_discovery_cache(self, mocked_zeroconf, mocked_browser):
+        discovery = DysonDiscovery(cache=DiscoveryCache(self._path))
+        name = "475_device-id-1.{0}".format(DYSON_SERVICE_TYPE)
+        discovery.add_service(_zeroconf({name: "192.168.0.2"}),
+                              DYSON_SERVICE_TYPE, name)
+
+        # After a restart, found without browsing
+        discovery = DysonDiscovery(cache=DiscoveryCache(self._path))
+        self.assertEqual(discovery.find("device-id-1", 0).address,
+                         "192.168.0.2")
+        self.assertEqual(mocked_zeroconf.call_count, 0)
+        self.assertTrue(discovery.forget_cached("device-id-1"))
+        self.assertIsNone(discovery.find("device-id-1", 0.01))
+        self.assertEqual(mocked_zeroconf.call_count, 1)
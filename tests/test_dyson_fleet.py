@@ -0,0 +1,286 @@
+import json
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from libpurecool.const import DYSON_PURE_COOL, DYSON_PURE_COOL_DESKTOP, \
+    DYSON_360_EYE, FanSpeed, NightMode
+from libpurecool.dyson_360_eye import Dyson360Eye, Dyson360EyeState
+from libpurecool.dyson_command_encoder import state_set_payload
+from libpurecool.dyson_device import ConnectTimeouts, NetworkDevice
+from libpurecool.dyson_fleet import DysonFleet, connect_devices
+from libpurecool.dyson_pure_cool import DysonPureCool
+from libpurecool.dyson_pure_state_v2 import DysonPureCoolV2State
+
+from .mqtt_broker import MqttBroker, DeviceStandIn
+from .test_dyson_async import _device_json, _load
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestDysonFleet(unittest.TestCase):
+    def setUp(self):
+        self._broker = MqttBroker().start()
+        self._fleet = DysonFleet(workers=2)
+
+    def tearDown(self):
+        self._fleet.close()
+        self._broker.stop()
+
+    def _add_fan(self, serial, product_type=DYSON_PURE_COOL):
+        self._broker.add_device(DeviceStandIn(
+            product_type, serial, "password1",
+            _load("state_pure_cool.json"), _load("sensor_pure_cool.json")))
+        return DysonPureCool(_device_json(serial, product_type))
+
+    def test_connect(self):
+        device = self._add_fan("device-id-1")
+        self.assertTrue(self._fleet.connect(device, "127.0.0.1",
+                                            self._broker.port))
+        self.assertTrue(device.device_available)
+        self.assertEqual(device.state.speed, "AUTO")
+        self.assertIsNotNone(device.environmental_state)
+        self.assertEqual(self._fleet.devices, [device])
+
+        self._fleet.disconnect(device)
+        self.assertFalse(device.connected)
+        self.assertEqual(self._fleet.devices, [])
+        self.assertTrue(_wait_for(lambda: self._broker.client_count == 0))
+
+    def test_connect_wrong_password(self):
+        device = self._add_fan("device-id-1")
+        device._credentials = "other"
+        self.assertFalse(self._fleet.connect(device, "127.0.0.1",
+                                             self._broker.port))
+        self.assertEqual(self._fleet.devices, [])
+
+    def test_connect_refused(self):
+        device = self._add_fan("device-id-1")
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        self.assertFalse(self._fleet.connect(device, "127.0.0.1",
+                                             closed_port))
+        self.assertFalse(device.connected)
+        self.assertEqual(self._fleet.devices, [])
+
+    def test_connect_no_data(self):
+        device = self._add_fan("device-id-1")
+        self._broker._devices["{0}/device-id-1/command".format(
+            DYSON_PURE_COOL)].silent = True
+        self.assertFalse(self._fleet.connect(
+            device, "127.0.0.1", self._broker.port,
+            timeouts=ConnectTimeouts(1, 1, 0.2, 0.2)))
+        self.assertFalse(device.connected)
+
+    def test_command(self):
+        device = self._add_fan("device-id-1")
+        self._fleet.connect(device, "127.0.0.1", self._broker.port)
+        received = []
+        device.add_message_listener(received.append)
+        device.set_fan_speed(FanSpeed.FAN_SPEED_4)
+        self.assertTrue(_wait_for(lambda: device.state.speed == "0004"))
+        self.assertTrue(isinstance(received[-1], DysonPureCoolV2State))
+
+    def test_broadcast(self):
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(3)]
+        devices.append(self._add_fan("device-id-3", DYSON_PURE_COOL_DESKTOP))
+        for device in devices:
+            self._fleet.connect(device, "127.0.0.1", self._broker.port)
+        not_connected = self._add_fan("device-id-4")
+        types = []
+
+        def night_mode(product_type):
+            types.append(product_type)
+            return {"nmod": NightMode.NIGHT_MODE_ON.value}
+
+        with mock.patch('libpurecool.dyson_fleet.state_set_payload',
+                        wraps=state_set_payload) as serialize:
+            results = self._fleet.broadcast(night_mode,
+                                            devices + [not_connected])
+        # Serialized once per product type
+        self.assertEqual(sorted(types),
+                         sorted([DYSON_PURE_COOL, DYSON_PURE_COOL_DESKTOP]))
+        self.assertEqual(serialize.call_count, 2)
+        self.assertEqual([result.device for result in results],
+                         devices + [not_connected])
+        self.assertEqual([(result.published, result.acknowledged)
+                          for result in results],
+                         [(True, True)] * 4 + [(False, False)])
+        for device in devices:
+            self.assertEqual(device.state.night_mode, "ON")
+            self.assertEqual(device._state_set_waiters, [])
+
+    def test_broadcast_not_acknowledged(self):
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(2)]
+        for device in devices:
+            self._fleet.connect(device, "127.0.0.1", self._broker.port)
+        stand_in = self._broker._devices["{0}/device-id-1/command".format(
+            DYSON_PURE_COOL)]
+        stand_in.silent = True
+        results = self._fleet.broadcast({"fnsp": "0004"}, timeout=0.5)
+        self.assertEqual([(result.published, result.acknowledged)
+                          for result in results],
+                         [(True, True), (True, False)])
+        self.assertEqual(stand_in.commands[-1]["data"], {"fnsp": "0004"})
+        self.assertTrue(_wait_for(
+            lambda: devices[1]._state_set_waiters == []))
+
+    def test_broadcast_disconnected(self):
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(2)]
+        for device in devices:
+            self._fleet.connect(device, "127.0.0.1", self._broker.port)
+        self._broker._devices["{0}/device-id-1/command".format(
+            DYSON_PURE_COOL)].silent = True
+        disconnect = threading.Timer(0.2, self._fleet.disconnect,
+                                     [devices[1]])
+        disconnect.start()
+        start = time.monotonic()
+        results = self._fleet.broadcast({"fnsp": "0004"},
+                                        devices=devices, timeout=5)
+        disconnect.join()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([(result.published, result.acknowledged)
+                          for result in results],
+                         [(True, True), (True, False)])
+        self.assertEqual(devices[1]._state_set_waiters, [])
+
+    def test_threads_shared(self):
+        threads = threading.active_count()
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(20)]
+        for device in devices:
+            self.assertTrue(self._fleet.connect(device, "127.0.0.1",
+                                                self._broker.port))
+        # Only the worker threads
+        self.assertLessEqual(threading.active_count() - threads, 2)
+
+    def test_backpressure(self):
+        fleet = DysonFleet(workers=1, max_pending=2)
+        device = self._add_fan("device-id-1")
+        fleet.connect(device, "127.0.0.1", self._broker.port)
+        blocked = threading.Event()
+        device.add_message_listener(lambda msg: blocked.wait(5))
+        topic = device.status_topic
+        for speed in range(1, 10):
+            message = _load("state_pure_cool.json")
+            message["product-state"]["fnsp"] = "000{0}".format(speed)
+            self._broker.publish(topic, json.dumps(message))
+        self.assertTrue(_wait_for(lambda: fleet.dropped_messages(device)))
+        blocked.set()
+        self.assertTrue(_wait_for(lambda: device.state.speed == "0009"))
+        fleet.close()
+
+    def test_360_eye(self):
+        self._broker.add_device(DeviceStandIn(
+            DYSON_360_EYE, "device-id-1", "password1",
+            _load("vacuum/state.json"),
+            status_topic="{0}/device-id-1/status".format(DYSON_360_EYE)))
+        device = Dyson360Eye(_device_json("device-id-1", DYSON_360_EYE))
+        self.assertTrue(self._fleet.connect(device, "127.0.0.1",
+                                            self._broker.port))
+        self.assertTrue(isinstance(device.state, Dyson360EyeState))
+
+    def test_connect_all(self):
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(4)]
+        devices[1]._credentials = "other"
+        self._broker._devices["{0}/device-id-2/command".format(
+            DYSON_PURE_COOL)].silent = True
+        self._broker._devices["{0}/device-id-3/command".format(
+            DYSON_PURE_COOL)].sensor = None
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        unreachable = self._add_fan("device-id-4")
+        addresses = {device.serial: ("127.0.0.1", self._broker.port)
+                     for device in devices}
+        addresses["device-id-4"] = ("127.0.0.1", closed_port)
+
+        results = self._fleet.connect_all(
+            devices + [unreachable], addresses,
+            timeouts=ConnectTimeouts(1, 1, 0.2, 0.2))
+        self.assertEqual([result.device for result in results],
+                         devices + [unreachable])
+        self.assertEqual([result.connected for result in results],
+                         [True, False, False, False, False])
+        self.assertEqual([result.phase for result in results],
+                         [None, "connack", "state", "sensor", "tcp"])
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[2].error.reason, "timeout")
+        self.assertEqual(self._fleet.devices, [devices[0]])
+
+    def test_connect_all_invalid_credentials(self):
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(3)]
+        manifest = _device_json("device-id-1", DYSON_PURE_COOL)
+        manifest["LocalCredentials"] = "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6"
+        devices[1] = DysonPureCool(manifest)
+        addresses = {device.serial: ("127.0.0.1", self._broker.port)
+                     for device in devices}
+
+        results = connect_devices(devices, addresses, fleet=self._fleet)
+        self.assertEqual([result.connected for result in results],
+                         [True, False, True])
+        self.assertEqual(results[1].phase, "credentials")
+        self.assertIsNone(devices[1].credentials)
+        self.assertEqual(self._fleet.devices, [devices[0], devices[2]])
+
+    def test_connect_all_concurrency(self):
+        devices = [self._add_fan("device-id-{0}".format(index))
+                   for index in range(8)]
+        for device in devices:
+            self._broker._devices["{0}/{1}/command".format(
+                DYSON_PURE_COOL, device.serial)].silent = True
+        addresses = {device.serial: ("127.0.0.1", self._broker.port)
+                     for device in devices}
+        timeouts = ConnectTimeouts(1, 1, 0.3, 0.3)
+        start = time.monotonic()
+        results = connect_devices(devices, addresses, 8, timeouts,
+                                  self._fleet)
+        self.assertEqual({result.phase for result in results}, {"state"})
+        self.assertLess(time.monotonic() - start, 8 * 0.3)
+
+    def test_connect_devices_threads(self):
+        device = self._add_fan("device-id-1")
+        results = connect_devices(
+            [device], {"device-id-1": ("127.0.0.1", self._broker.port)})
+        self.assertTrue(results[0].connected)
+        self.assertTrue(device.device_available)
+        self.assertNotIn(device, self._fleet.devices)
+        device.disconnect()
+        device._mqtt.loop_stop()
+
+    def test_connect_outdated_cache(self):
+        device = self._add_fan("device-id-1")
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        discovery = mock.Mock()
+        discovery.find.side_effect = [
+            NetworkDevice("device-id-1", "127.0.0.1", closed_port),
+            NetworkDevice("device-id-1", "127.0.0.1", self._broker.port)]
+        discovery.forget_cached.return_value = True
+        with mock.patch('libpurecool.dyson_fleet.default_discovery',
+                        return_value=discovery), \
+                mock.patch('libpurecool.dyson_pure_cool_link.'
+                           'default_discovery', return_value=discovery):
+            results = self._fleet.connect_all([device])
+        self.assertTrue(results[0].connected)
+        discovery.forget_cached.assert_called_with("device-id-1")
+        self.assertEqual(device.network_device.port, self._broker.port)
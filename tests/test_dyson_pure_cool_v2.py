@@ -249,6 +249,10 @@ def _mocked_send_command_night_mode_off(*args):
 
 class TestPureCool(unittest.TestCase):
     def setUp(self):
+        # Connections are mocked: no network thread
+        patcher = mock.patch('paho.mqtt.client.Client.loop_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
         device = DysonPureCool({
             "Serial": "device-id-1",
             "Name": "device-1",
@@ -601,6 +605,18 @@ class TestPureCool(unittest.TestCase):
                          "oscillation_angle_low=0063,"
                          "oscillation_angle_high=0243)")
 
+    def test_dyson_v2_state_compact(self):
+        message = json.loads(
+            open("tests/data/state_pure_cool.json", "r").read())
+        dyson_state = DysonPureCoolV2State(message)
+        sensor_state = DysonEnvironmentalSensorV2State(json.loads(
+            open("tests/data/sensor_pure_cool.json", "r").read()))
+        self.assertFalse(hasattr(dyson_state, "__dict__"))
+        self.assertFalse(hasattr(sensor_state, "__dict__"))
+        message["product-state"]["fnsp"] = "0005"
+        self.assertEqual(dyson_state.speed, "AUTO")
+        self.assertEqual(sensor_state.temperature, 297.7)
+
     def test_dyson_v2_sensor_state(self):
         dyson_sensor_state = DysonEnvironmentalSensorV2State(
             open("tests/data/sensor_pure_cool.json", "r").read())
@@ -676,3 +692,67 @@ class TestPureCool(unittest.TestCase):
         msg.payload = Mock()
         msg.payload.decode.return_value = payload
         DysonPureCool.on_message(None, self._device, msg)
+
+    def test_on_state_change_message_shares_state(self):
+        msg = Mock()
+        msg.payload = open("tests/data/state_pure_cool.json", "rb").read()
+        DysonPureCool.on_message(None, self._device, msg)
+        previous = self._device.state
+        message = json.loads(msg.payload)
+        message["msg"] = "STATE-CHANGE"
+        message["product-state"]["fnsp"] = ["AUTO", "0004"]
+        msg.payload = json.dumps(message).encode("utf-8")
+        DysonPureCool.on_message(None, self._device, msg)
+        self.assertEqual(self._device.state.speed, "0004")
+        self.assertEqual(previous.speed, "AUTO")
+        self.assertIs(self._device.state._state["osal"],
+                      previous._state["osal"])
+
+    def test_state_change_listener(self):
+        self._device.state = None
+        all_changes = []
+        speed_changes = []
+        self._device.add_state_change_listener(
+            lambda state, changes: all_changes.append(changes))
+        self._device.add_state_change_listener(
+            lambda state, changes: speed_changes.append(changes),
+            fields=["fnsp"])
+        msg = Mock()
+        msg.payload = open("tests/data/state_pure_cool.json", "rb").read()
+        DysonPureCool.on_message(None, self._device, msg)
+        message = json.loads(msg.payload)
+        message["msg"] = "STATE-CHANGE"
+        message["product-state"]["nmod"] = ["OFF", "ON"]
+        msg.payload = json.dumps(message).encode("utf-8")
+        DysonPureCool.on_message(None, self._device, msg)
+        message["product-state"]["fnsp"] = ["AUTO", "0004"]
+        msg.payload = json.dumps(message).encode("utf-8")
+        DysonPureCool.on_message(None, self._device, msg)
+
+        self.assertEqual(len(all_changes), 3)
+        self.assertEqual(len(all_changes[0]), 20)
+        self.assertEqual(all_changes[1], [("nmod", "OFF", "ON")])
+        self.assertEqual(all_changes[2], [("fnsp", "AUTO", "0004")])
+        self.assertEqual(len(speed_changes), 2)
+        self.assertEqual(speed_changes[1], [("fnsp", "AUTO", "0004")])
+
+    def test_state_change_listener_from_message(self):
+        self._device.state = None
+        changes = []
+        self._device.add_state_change_listener(
+            lambda state, state_changes: changes.extend(state_changes))
+        msg = Mock()
+        msg.payload = b'{"msg": "STATE-CHANGE", "product-state": ' \
+                      b'{"fnsp": ["0001", "0002"], "fpwr": ["ON", "ON"]}}'
+        DysonPureCool.on_message(None, self._device, msg)
+        self.assertEqual(changes, [("fnsp", "0001", "0002")])
+
+    def test_remove_state_change_listener(self):
+        def listener(state, changes):
+            assert False
+
+        self._device.add_state_change_listener(listener)
+        self._device.remove_state_change_listener(listener)
+        msg = Mock()
+        msg.payload = open("tests/data/state_pure_cool.json", "rb").read()
+        DysonPureCool.on_message(None, self._device, msg)
@@ -92,6 +92,10 @@ def _mocked_send_command_heat_target(*args):
 
 class TestPureHotCool(unittest.TestCase):
     def setUp(self):
+        # Connections are mocked: no network thread
+        patcher = mock.patch('paho.mqtt.client.Client.loop_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
         device = DysonPureHotCool({
             "Serial": "device-id-1",
             "Name": "device-1",
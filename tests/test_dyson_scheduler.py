@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+from libpurecool.dyson_scheduler import SensorScheduler, jittered, \
+    default_scheduler
+
+
+def _device(serial, interval=0.02, connected=True):
+    device = Mock()
+    device.serial = serial
+    device.sensor_interval = interval
+    device.connected = connected
+    return device
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestSensorScheduler(unittest.TestCase):
+    def setUp(self):
+        self._scheduler = SensorScheduler()
+
+    def tearDown(self):
+        for device in self._scheduler.devices:
+            self._scheduler.remove(device)
+
+    def test_jittered(self):
+        for _ in range(100):
+            value = jittered(30, 0.1)
+            self.assertTrue(27 <= value <= 33)
+        self.assertEqual(jittered(30, 0), 30)
+
+    def test_poll(self):
+        device = _device("device-id-1")
+        self._scheduler.add(device)
+        self.assertEqual(self._scheduler.devices, [device])
+        self.assertTrue(_wait_for(
+            lambda: device.request_environmental_state.call_count >= 3))
+
+    def test_per_device_interval(self):
+        fast = _device("device-id-1", interval=0.01)
+        slow = _device("device-id-2", interval=10)
+        self._scheduler.add(fast)
+        self._scheduler.add(slow)
+        self.assertTrue(_wait_for(
+            lambda: fast.request_environmental_state.call_count >= 5))
+        self.assertEqual(slow.request_environmental_state.call_count, 0)
+
+    def test_remove(self):
+        device = _device("device-id-1")
+        self._scheduler.add(device)
+        self.assertTrue(_wait_for(
+            lambda: device.request_environmental_state.call_count))
+        self._scheduler.remove(device)
+        time.sleep(0.05)
+        count = device.request_environmental_state.call_count
+        time.sleep(0.1)
+        self.assertEqual(device.request_environmental_state.call_count,
+                         count)
+        self.assertEqual(self._scheduler.devices, [])
+
+    def test_add_again_reschedules(self):
+        device = _device("device-id-1", interval=0.05)
+        self._scheduler.add(device)
+        self._scheduler.add(device)
+        self.assertEqual(len(self._scheduler.devices), 1)
+        self.assertEqual(len([item for item in self._scheduler._heap
+                              if not item[2].cancelled]), 1)
+
+    def test_disconnected_backoff(self):
+        scheduler = SensorScheduler(jitter=0, max_backoff=0.08)
+        device = _device("device-id-1", interval=0.02, connected=False)
+        scheduler.add(device)
+        self.assertTrue(_wait_for(lambda: scheduler._entries[
+            "device-id-1"].backoff == 0.08))
+        self.assertEqual(device.request_environmental_state.call_count, 0)
+
+        device.connected = True
+        self.assertTrue(_wait_for(
+            lambda: device.request_environmental_state.call_count))
+        self.assertIsNone(scheduler._entries["device-id-1"].backoff)
+        scheduler.remove(device)
+
+    def test_request_error(self):
+        device = _device("device-id-1")
+        device.request_environmental_state.side_effect = OSError
+        self._scheduler.add(device)
+        self.assertTrue(_wait_for(
+            lambda: device.request_environmental_state.call_count >= 2))
+
+    def test_single_thread(self):
+        threads = threading.active_count()
+        devices = [_device("device-id-{0}".format(index), interval=0.05)
+                   for index in range(200)]
+        for device in devices:
+            self._scheduler.add(device)
+        self.assertTrue(_wait_for(lambda: all(
+            device.request_environmental_state.call_count
+            for device in devices)))
+        self.assertEqual(threading.active_count() - threads, 1)
+
+    def test_default_scheduler(self):
+        self.assertIs(default_scheduler(), default_scheduler())
@@ -0,0 +1,102 @@
+import json
+import unittest
+
+from libpurecool.dyson_pure_state import DysonPureCoolState, \
+    DysonPureHotCoolState
+from libpurecool.dyson_pure_state_v2 import DysonPureCoolV2State
+from libpurecool.dyson_state import resolve_product_state, intern_value, \
+    product_state_changes, StateChange
+
+
+def _state_change(message, **changes):
+    product_state = {}
+    for field, value in message["product-state"].items():
+        product_state[field] = [value, changes.get(field, value)]
+    return {"msg": "STATE-CHANGE", "product-state": product_state}
+
+
+class TestDysonState(unittest.TestCase):
+    def setUp(self):
+        self._message = json.loads(
+            open("tests/data/state_pure_cool.json", "r").read())
+
+    def tearDown(self):
+        pass
+
+    def test_intern_value(self):
+        value = "".join(["00", "04"])
+        self.assertIs(intern_value(value), intern_value("0004"))
+        self.assertEqual(intern_value(4), 4)
+
+    def test_resolve_product_state(self):
+        state = resolve_product_state(
+            {"fnsp": ["0001", "0004"], "fmod": "FAN"})
+        self.assertEqual(state, {"fnsp": "0004", "fmod": "FAN"})
+        self.assertIs(state["fnsp"], intern_value("0004"))
+
+    def test_resolve_product_state_unchanged(self):
+        state = resolve_product_state({"fnsp": "0004"})
+        self.assertIs(resolve_product_state({"fnsp": ["0001", "0004"]},
+                                            state), state)
+        self.assertIsNot(resolve_product_state({"fnsp": "0005"}, state),
+                         state)
+        self.assertIsNot(resolve_product_state(
+            {"fnsp": "0004", "fmod": "FAN"}, state), state)
+
+    def test_state_change_shares_previous_values(self):
+        previous = DysonPureCoolV2State(self._message)
+        state = DysonPureCoolV2State(
+            _state_change(self._message, fnsp="0007"), previous)
+        self.assertEqual(state.speed, "0007")
+        self.assertEqual(previous.speed, "AUTO")
+        self.assertIs(state._state["fpwr"], previous._state["fpwr"])
+        self.assertNotEqual(state, previous)
+
+        same = DysonPureCoolV2State(_state_change(self._message), previous)
+        self.assertIs(same._state, previous._state)
+        self.assertEqual(same, previous)
+
+    def test_state_hashable(self):
+        state = DysonPureCoolV2State(self._message)
+        other = DysonPureCoolV2State(
+            open("tests/data/state_pure_cool.json", "r").read())
+        self.assertEqual(state, other)
+        self.assertEqual(hash(state), hash(other))
+        self.assertEqual(len({state, other}), 1)
+
+    def test_state_type_in_equality(self):
+        message = json.loads(open("tests/data/state_hot.json", "r").read())
+        self.assertNotEqual(DysonPureCoolState(message),
+                            DysonPureHotCoolState(message))
+
+    def test_state_immutable(self):
+        state = DysonPureCoolV2State(self._message)
+        with self.assertRaises(AttributeError):
+            state._state = {}
+        with self.assertRaises(AttributeError):
+            state.speed = "0001"
+
+    def test_diff(self):
+        previous = DysonPureCoolV2State(self._message)
+        state = DysonPureCoolV2State(
+            _state_change(self._message, fnsp="0007", nmod="ON"), previous)
+        self.assertEqual(sorted(state.diff(previous)),
+                         [StateChange("fnsp", "AUTO", "0007"),
+                          StateChange("nmod", "OFF", "ON")])
+        self.assertEqual(state.diff(state), [])
+        self.assertEqual(len(previous.diff(None)),
+                         len(self._message["product-state"]))
+
+    def test_diff_missing_field(self):
+        previous = DysonPureCoolV2State(
+            {"product-state": {"fnsp": "0001", "hmod": "OFF"}})
+        state = DysonPureCoolV2State(
+            {"product-state": {"fnsp": "0001", "fpwr": "ON"}})
+        self.assertEqual(sorted(state.diff(previous)),
+                         [StateChange("fpwr", None, "ON"),
+                          StateChange("hmod", "OFF", None)])
+
+    def test_product_state_changes(self):
+        changes = product_state_changes(
+            {"fnsp": ["0001", "0004"], "nmod": ["ON", "ON"], "fmod": "FAN"})
+        self.assertEqual(changes, [StateChange("fnsp", "0001", "0004")])
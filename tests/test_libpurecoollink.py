@@ -4,7 +4,8 @@ from unittest import mock
 from unittest.mock import Mock
 import json
 
-from libpurecool.dyson_device import NetworkDevice
+from libpurecool.dyson_device import NetworkDevice, ConnectTimeouts, \
+    decrypt_credentials
 from libpurecool.dyson_pure_cool_link import DysonPureCoolState, \
     DysonEnvironmentalSensorState, DysonPureCoolLink
 from libpurecool.dyson_pure_hotcool_link import DysonPureHotCoolLink
@@ -13,7 +14,8 @@ from libpurecool.const import FanMode, NightMode, FanSpeed, Oscillation, \
     FanState, QualityTarget, StandbyMonitoring as SM, \
     DYSON_PURE_COOL_LINK_DESK as Desk, DYSON_PURE_HOT_COOL_LINK_TOUR as Hot, \
     HeatMode, HeatState, HeatTarget, FocusMode, TiltState, ResetFilter
-from libpurecool.exceptions import DysonInvalidTargetTemperatureException
+from libpurecool.exceptions import DysonInvalidTargetTemperatureException, \
+    DysonConnectionException
 
 
 def _mocked_request_state(*args, **kwargs):
@@ -99,13 +101,12 @@ def _mocked_send_command_timer_off(*args, **kwargs):
         assert args[2] == 1
 
 
-def on_add_device(network_device):
-    pass
-
-
 class TestLibPureCoolLink(unittest.TestCase):
     def setUp(self):
-        pass
+        # Connections are mocked: no network thread
+        patcher = mock.patch('paho.mqtt.client.Client.loop_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         pass
@@ -199,8 +200,15 @@ class TestLibPureCoolLink(unittest.TestCase):
         self.assertEqual(mocked_loop_start.call_count, 1)
         self.assertEqual(mocked_loop_stop.call_count, 1)
 
-    @mock.patch('libpurecool.zeroconf.Zeroconf.close')
-    def test_connect_device_fail(self, mocked_close_zeroconf):
+    @mock.patch('paho.mqtt.client.Client.publish')
+    @mock.patch('paho.mqtt.client.Client.loop_stop')
+    @mock.patch('paho.mqtt.client.Client.loop_start')
+    @mock.patch('paho.mqtt.client.Client.connect')
+    def test_connect_device_phase_timeout(self,
+                                          mocked_connect,
+                                          mocked_loop_start,
+                                          mocked_loop_stop,
+                                          mocked_publish):
         device = DysonPureCoolLink({
             "Active": True,
             "Serial": "device-id-1",
@@ -214,9 +222,101 @@ class TestLibPureCoolLink(unittest.TestCase):
             "NewVersionAvailable": False,
             "ProductType": "475"
         })
-        connected = device.auto_connect(retry=1, timeout=1)
+        device.connection_callback(True)
+        device.state_data_available()
+        timeouts = ConnectTimeouts(tcp=1, connack=1, state=0.1, sensor=0.1)
+        self.assertFalse(device.connect("192.168.0.2", timeouts=timeouts))
+        self.assertFalse(device.connected)
+        self.assertFalse(device.device_available)
+        self.assertEqual(mocked_loop_stop.call_count, 1)
+
+        with self.assertRaises(DysonConnectionException) as context:
+            device._connect_phases(timeouts)
+        self.assertEqual(context.exception.phase, "connack")
+        self.assertEqual(context.exception.reason, "timeout")
+
+    @mock.patch('libpurecool.dyson_pure_cool_link.default_discovery')
+    def test_connect_device_fail(self, mocked_discovery):
+        mocked_discovery.return_value.find.return_value = None
+        device = DysonPureCoolLink({
+            "Active": True,
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "ScaleUnit": "SU01",
+            "Version": "21.03.08",
+            "LocalCredentials": "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/"
+                                "70ZGysII1Ke1i0ZHakFH84DZuxsSQ4KTT2v"
+                                "bCm7uYeTORULKLKQ==",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": "475"
+        })
+        connected = device.auto_connect(retry=2, timeout=1)
         self.assertFalse(connected)
-        self.assertEqual(mocked_close_zeroconf.call_count, 1)
+        mocked_discovery.return_value.find.assert_called_with("device-id-1",
+                                                              1)
+        self.assertEqual(mocked_discovery.return_value.find.call_count, 2)
+
+    @mock.patch('paho.mqtt.client.Client.loop_start')
+    @mock.patch('paho.mqtt.client.Client.connect')
+    @mock.patch('libpurecool.dyson_pure_cool_link.default_discovery')
+    def test_connect_device_discovered(self, mocked_discovery,
+                                       mocked_connect, mocked_loop):
+        network_device = NetworkDevice('device-id-1', 'host', 1111)
+        mocked_discovery.return_value.find.return_value = network_device
+        device = DysonPureCoolLink({
+            "Active": True,
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "ScaleUnit": "SU01",
+            "Version": "21.03.08",
+            "LocalCredentials": "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/"
+                                "70ZGysII1Ke1i0ZHakFH84DZuxsSQ4KTT2v"
+                                "bCm7uYeTORULKLKQ==",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": "475"
+        })
+        device.state_data_available()
+        device.sensor_data_available()
+        device.connection_callback(True)
+        self.assertTrue(device.auto_connect())
+        self.assertEqual(device.network_device, network_device)
+        mocked_connect.assert_called_with('host', 1111)
+        device.disconnect()
+
+    @mock.patch('paho.mqtt.client.Client.loop_start')
+    @mock.patch('paho.mqtt.client.Client.connect',
+                side_effect=[OSError("unreachable"), None])
+    @mock.patch('libpurecool.dyson_pure_cool_link.default_discovery')
+    def test_connect_device_outdated_cache(self, mocked_discovery,
+                                           mocked_connect, mocked_loop):
+        network_device = NetworkDevice('device-id-1', 'host2', 1883)
+        mocked_discovery.return_value.find.side_effect = [
+            NetworkDevice('device-id-1', 'host1', 1883), network_device]
+        mocked_discovery.return_value.forget_cached.return_value = True
+        device = DysonPureCoolLink({
+            "Active": True,
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "ScaleUnit": "SU01",
+            "Version": "21.03.08",
+            "LocalCredentials": "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/"
+                                "70ZGysII1Ke1i0ZHakFH84DZuxsSQ4KTT2v"
+                                "bCm7uYeTORULKLKQ==",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": "475"
+        })
+        device.state_data_available()
+        device.sensor_data_available()
+        device.connection_callback(True)
+        self.assertTrue(device.auto_connect())
+        mocked_discovery.return_value.forget_cached.assert_called_with(
+            "device-id-1")
+        self.assertEqual(device.network_device, network_device)
+        mocked_connect.assert_called_with('host2', 1883)
+        device.disconnect()
 
     def test_status_topic(self):
         device = DysonPureCoolLink({
@@ -234,18 +334,43 @@ class TestLibPureCoolLink(unittest.TestCase):
         })
         self.assertEqual(device.status_topic, "475/device-id-1/status/current")
 
-    @mock.patch('socket.inet_ntoa', )
-    def test_device_dyson_listener(self, mocked_ntoa):
-        listener = DysonPureCoolLink.DysonDeviceListener('serial-1',
-                                                         on_add_device)
-        zeroconf = Mock()
-        listener.remove_service(zeroconf, "ptype", "serial-1")
-        info = Mock()
-        info.address = "192.168.0.1"
-        zeroconf.get_service_info = Mock()
-        zeroconf.get_service_info.return_value = info
-        listener.add_service(zeroconf, '_dyson_mqtt._tcp.local.',
-                             'ptype_serial-1._dyson_mqtt._tcp.local.')
+    def test_lazy_credentials(self):
+        manifest = {
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "Version": "21.03.08",
+            "LocalCredentials": "invalid",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": "475"
+        }
+        # Not decrypted before used
+        device = DysonPureCoolLink(manifest)
+        manifest["LocalCredentials"] = "1/aJ5t52WvAfn+z+fjDuebkH6aWl2H5Q1v" \
+                                       "CqCQSjJfENzMefozxWaDoW1yDluPsi09SG" \
+                                       "T5nWMxqxtrfkxnUtRQ=="
+        self.assertTrue(device.update_manifest(manifest))
+        self.assertFalse(device.update_manifest(manifest))
+        self.assertEqual(device.credentials, "password2")
+
+    @mock.patch('libpurecool.dyson_device.decrypt_passwords',
+                return_value=["password1", "password2"])
+    def test_decrypt_credentials(self, mocked_decrypt):
+        devices = [DysonPureCoolLink({
+            "Serial": "device-id-{0}".format(index),
+            "Name": "device",
+            "Version": "21.03.08",
+            "LocalCredentials": "credentials{0}".format(index),
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": "475"
+        }) for index in range(3)]
+        devices[1]._credentials = "decrypted"
+        decrypt_credentials(devices)
+        mocked_decrypt.assert_called_once_with(["credentials0",
+                                                "credentials2"])
+        self.assertEqual([device.credentials for device in devices],
+                         ["password1", "decrypted", "password2"])
 
     def test_on_connect(self):
         client = Mock()
@@ -354,6 +479,22 @@ class TestLibPureCoolLink(unittest.TestCase):
         msg.payload = payload
         DysonPureCoolLink.on_message(None, userdata, msg)
 
+    @mock.patch('json.loads', side_effect=json.loads)
+    def test_on_message_parse_payload_once(self, mocked_loads):
+        messages = []
+        userdata = Mock()
+        userdata.product_type = "475"
+        userdata.callback_message = [messages.append]
+        for fixture in ["state.json", "sensor.json"]:
+            msg = Mock()
+            msg.payload = open("tests/data/" + fixture, "rb").read()
+            DysonPureCoolLink.on_message(None, userdata, msg)
+        self.assertEqual(mocked_loads.call_count, 2)
+        self.assertIsInstance(messages[0], DysonPureCoolState)
+        self.assertIsInstance(messages[1], DysonEnvironmentalSensorState)
+        self.assertEqual(messages[0].fan_mode, "AUTO")
+        self.assertEqual(messages[1].dust, 4)
+
     def test_on_message_with_unknown_message(self):
         def on_message(msg):
             # Should not be called
@@ -484,6 +625,118 @@ class TestLibPureCoolLink(unittest.TestCase):
                          "address=host,port=1111))")
         device.disconnect()
 
+    def test_command_buffer(self):
+        device = DysonPureCoolLink({
+            "Active": True,
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "ScaleUnit": "SU01",
+            "Version": "21.03.08",
+            "LocalCredentials": "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1K"
+                                "e1i0ZHakFH84DZuxsSQ4KTT2vbCm7uYeTORULKLKQ==",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": Desk
+        })
+        device._mqtt = Mock()
+        device._mqtt.publish.return_value.rc = 0
+        device.connected = True
+        device.enable_command_buffer(window=60)
+        futures = [device.set_fan_configuration({"fnsp": "0003"}),
+                   device.set_fan_configuration({"oson": "ON"}),
+                   device.set_fan_configuration({"fnsp": "0004"})]
+        device._mqtt.publish.assert_not_called()
+        device._flush_commands()
+        self.assertEqual(device._mqtt.publish.call_count, 1)
+        payload = json.loads(device._mqtt.publish.call_args[0][1])
+        self.assertEqual(payload["msg"], "STATE-SET")
+        self.assertEqual(payload["data"], {"fnsp": "0004", "oson": "ON"})
+        self.assertIs(futures[0].info, device._mqtt.publish.return_value)
+        # Futures resolved by the confirmation of the merged configuration
+        device.confirm_state_set({"fnsp": ["0001", "0004"],
+                                  "oson": ["OFF", "ON"]})
+        self.assertEqual([future.result(1) for future in futures],
+                         [True] * 3)
+
+        device.disable_command_buffer()
+        device.set_fan_configuration({"fnsp": "0005"})
+        self.assertEqual(device._mqtt.publish.call_count, 2)
+        device.disconnect()
+
+    def test_command_future(self):
+        device = DysonPureCoolLink({
+            "Active": True,
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "ScaleUnit": "SU01",
+            "Version": "21.03.08",
+            "LocalCredentials": "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1K"
+                                "e1i0ZHakFH84DZuxsSQ4KTT2vbCm7uYeTORULKLKQ==",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": Desk
+        })
+        self.assertFalse(device.set_fan_configuration(
+            {"fnsp": "0003"}).result(1))
+
+        device._mqtt = Mock()
+        device._mqtt.publish.return_value.rc = 0
+        device.connected = True
+        device.command_timeout = 0.1
+        confirmed = device.set_fan_configuration({"fnsp": "0003",
+                                                  "sltm": "STET"})
+        other = device.set_fan_configuration({"nmod": "ON"})
+        # Other fields and other values do not confirm the configuration
+        device.confirm_state_set({"fnsp": ["0001", "0002"]})
+        device.confirm_state_set({"oson": ["OFF", "ON"]})
+        self.assertFalse(confirmed.done())
+        device.confirm_state_set({"fnsp": ["0002", "0003"],
+                                  "sltm": ["OFF", "OFF"]})
+        self.assertTrue(confirmed.result(1))
+        # Not confirmed in time
+        self.assertFalse(other.result(5))
+        self.assertEqual(device._state_set_waiters, [])
+
+        pending = device.set_fan_configuration({"nmod": "OFF"})
+        device.disconnect()
+        self.assertFalse(pending.result(1))
+
+        device.connected = True
+        device._mqtt.publish.return_value.rc = 4
+        self.assertFalse(device.set_fan_configuration(
+            {"fnsp": "0003"}).result(1))
+
+    def test_set_configuration_confirmed(self):
+        device = DysonPureCoolLink({
+            "Active": True,
+            "Serial": "device-id-1",
+            "Name": "device-1",
+            "ScaleUnit": "SU01",
+            "Version": "21.03.08",
+            "LocalCredentials": "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1K"
+                                "e1i0ZHakFH84DZuxsSQ4KTT2vbCm7uYeTORULKLKQ==",
+            "AutoUpdate": True,
+            "NewVersionAvailable": False,
+            "ProductType": Desk
+        })
+        device._current_state = DysonPureCoolState(
+            open("tests/data/state.json", "r").read())
+        device._mqtt = Mock()
+        device._mqtt.publish.return_value.rc = 0
+        device.connected = True
+        futures = [device.set_configuration(fan_mode=FanMode.FAN)]
+        device.enable_command_buffer(window=60)
+        futures.append(device.set_configuration(fan_mode=FanMode.FAN))
+        device._flush_commands()
+        payload = json.loads(device._mqtt.publish.call_args[0][1])
+        self.assertEqual(payload["data"]["fnsp"], "AUTO")
+        # Fields completed from the state are not compared
+        device.confirm_state_set({"fmod": ["AUTO", "FAN"],
+                                  "fnsp": ["AUTO", "0004"]})
+        self.assertEqual([future.result(1) for future in futures],
+                         [True, True])
+        device.disconnect()
+
     @mock.patch('paho.mqtt.client.Client.publish',
                 side_effect=_mocked_send_command_hot)
     @mock.patch('paho.mqtt.client.Client.connect')
@@ -711,6 +964,16 @@ class TestLibPureCoolLink(unittest.TestCase):
         self.assertEqual(dyson_state.standby_monitoring,
                          SM.STANDBY_MONITORING_ON.value)
 
+    def test_dyson_state_slots(self):
+        dyson_state = DysonPureHotCoolState(
+            open("tests/data/state_hot.json", "r").read())
+        sensor_state = DysonEnvironmentalSensorState(
+            open("tests/data/sensor.json", "r").read())
+        self.assertFalse(hasattr(dyson_state, "__dict__"))
+        self.assertFalse(hasattr(sensor_state, "__dict__"))
+        with self.assertRaises(AttributeError):
+            dyson_state.extra = True
+
     def test_dyson_state_hot(self):
         dyson_state = DysonPureHotCoolState(
             open("tests/data/state_hot.json", "r").read())
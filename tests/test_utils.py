@@ -1,7 +1,11 @@
 import unittest
+from unittest import mock
+
+from Crypto.Cipher import AES
 
 from libpurecool.utils import support_heating, is_heating_device, \
     is_360_eye_device, printable_fields, decrypt_password, \
+    decrypt_passwords, \
     is_pure_cool_v2, is_dyson_pure_cool_device, get_field_value, \
     support_heating_v2, is_heating_device_v2
 
@@ -57,6 +61,33 @@ class TestUtils(unittest.TestCase):
                                     "uYeTORULKLKQ==")
         self.assertEqual(password, "password1")
 
+    @mock.patch('libpurecool.utils.AES.new', wraps=AES.new)
+    def test_decrypt_passwords(self, mocked_new):
+        passwords = decrypt_passwords([
+            "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1Ke1i0ZHakFH84DZuxs"
+            "SQ4KTT2vbCm7uYeTORULKLKQ==",
+            "1/aJ5t52WvAfn+z+fjDuebkH6aWl2H5Q1vCqCQSjJfENzMefozxWaDoW1yDluP"
+            "si09SGT5nWMxqxtrfkxnUtRQ=="])
+        self.assertEqual(passwords, ["password1", "password2"])
+        # One cipher set up for the batch
+        self.assertEqual(mocked_new.call_count, 1)
+        self.assertEqual(decrypt_passwords([]), [])
+
+    def test_decrypt_passwords_invalid(self):
+        passwords = decrypt_passwords([
+            "1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6/70ZGysII1Ke1i0ZHakFH84DZuxs"
+            "SQ4KTT2vbCm7uYeTORULKLKQ==",
+            # Truncated
+            "1/aJ5t52WvAfn+z+fjDuebkH6aWl2H5Q1vCqCQSjJfENzMefozxWaDoW1yDluP",
+            "not base64",
+            "",
+            "1/aJ5t52WvAfn+z+fjDuebkH6aWl2H5Q1vCqCQSjJfENzMefozxWaDoW1yDluP"
+            "si09SGT5nWMxqxtrfkxnUtRQ=="])
+        self.assertEqual(passwords,
+                         ["password1", None, None, None, "password2"])
+        with self.assertRaises(ValueError):
+            decrypt_password("1/aJ5t52WvAfn+z+fjDuef86kQDQPefbQ6")
+
     def test_get_field_value(self):
         state = {"field1": ["value1", "value2"], "field2": "value3"}
         self.assertTrue(get_field_value(state, "field1") == "value2")
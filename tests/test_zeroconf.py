@@ -0,0 +1,421 @@
+import struct
+import threading
+import unittest
+from unittest.mock import Mock
+
+from libpurecool.zeroconf import DNSCache, DNSPointer, DNSAddress, \
+    DNSText, DNSService, DNSIncoming, DNSOutgoing, Zeroconf, ServiceInfo, \
+    ServiceBrowser, ServiceStateChange, ServiceInfoRequest, \
+    current_time_millis, _TYPE_PTR, _TYPE_A, _TYPE_TXT, _TYPE_SRV, \
+    _CLASS_IN, _FLAGS_QR_RESPONSE
+
+from .mdns_responder import MdnsResponder, PublishedService
+
+SERVICE_TYPE = "_dyson_mqtt._tcp.local."
+
+
+def _pointer(serial, ttl=120):
+    return DNSPointer(SERVICE_TYPE, _TYPE_PTR, _CLASS_IN, ttl,
+                      "475_{0}.{1}".format(serial, SERVICE_TYPE))
+
+
+class TestDNSCache(unittest.TestCase):
+    def setUp(self):
+        self._cache = DNSCache()
+
+    def test_get(self):
+        pointers = [_pointer("device-id-{0}".format(index))
+                    for index in range(5)]
+        for pointer in pointers:
+            self._cache.add(pointer)
+        address = DNSAddress("device.local.", _TYPE_A, _CLASS_IN, 120,
+                             b"\xc0\xa8\x00\x02")
+        self._cache.add(address)
+        self.assertIs(self._cache.get(_pointer("device-id-3")), pointers[3])
+        self.assertIsNone(self._cache.get(_pointer("device-id-9")))
+        self.assertIs(self._cache.get_by_details("device.local.", _TYPE_A,
+                                                 _CLASS_IN), address)
+        self.assertIsNone(self._cache.get_by_details(
+            "device.local.", _TYPE_TXT, _CLASS_IN))
+        self.assertEqual(len(self._cache.entries_with_name(SERVICE_TYPE)), 5)
+        self.assertEqual(len(self._cache.entries()), 6)
+        self.assertEqual(len(self._cache), 6)
+
+    def test_remove(self):
+        pointer = _pointer("device-id-1")
+        self._cache.add(pointer)
+        self._cache.remove(_pointer("device-id-1"))
+        self.assertIsNone(self._cache.get(pointer))
+        self.assertEqual(self._cache.entries(), [])
+        self.assertEqual(self._cache.entries_with_name(SERVICE_TYPE), [])
+        # Removing an unknown entry is ignored
+        self._cache.remove(pointer)
+
+    def test_expire(self):
+        expired = _pointer("device-id-1", ttl=0)
+        valid = _pointer("device-id-2")
+        self._cache.add(expired)
+        self._cache.add(valid)
+        now = current_time_millis()
+        self.assertEqual(self._cache.expire(now), [expired])
+        self.assertEqual(self._cache.entries(), [valid])
+        self.assertEqual(self._cache.expire(now), [])
+        self.assertEqual(self._cache.expire(now + 121 * 1000), [valid])
+        self.assertEqual(len(self._cache), 0)
+
+    def test_expire_reset_ttl(self):
+        pointer = _pointer("device-id-1", ttl=1)
+        self._cache.add(pointer)
+        pointer.reset_ttl(_pointer("device-id-1", ttl=120))
+        now = current_time_millis()
+        self.assertEqual(self._cache.expire(now + 2000), [])
+        self.assertEqual(self._cache.expire(now + 121 * 1000), [pointer])
+
+    def test_expire_removed(self):
+        pointer = _pointer("device-id-1", ttl=0)
+        self._cache.add(pointer)
+        self._cache.remove(pointer)
+        self.assertEqual(self._cache.expire(current_time_millis()), [])
+
+    def test_text(self):
+        text = DNSText("475_device-id-1." + SERVICE_TYPE, _TYPE_TXT,
+                       _CLASS_IN, 120, b"")
+        self._cache.add(text)
+        self.assertIs(self._cache.get(
+            DNSText("475_device-id-1." + SERVICE_TYPE, _TYPE_TXT, _CLASS_IN,
+                    60, b"")), text)
+
+
+def _response(serials, service_type=SERVICE_TYPE):
+    out = DNSOutgoing(_FLAGS_QR_RESPONSE)
+    for index, serial in enumerate(serials):
+        name = "475_{0}.{1}".format(serial, service_type)
+        host = "{0}.local.".format(serial)
+        out.add_answer_at_time(DNSPointer(service_type, _TYPE_PTR, _CLASS_IN,
+                                          120, name), 0)
+        out.add_answer_at_time(DNSService(name, _TYPE_SRV, _CLASS_IN, 120,
+                                          0, 0, 1883, host), 0)
+        out.add_answer_at_time(DNSText(name, _TYPE_TXT, _CLASS_IN, 120,
+                                       b"\x05id=ab"), 0)
+        out.add_answer_at_time(DNSAddress(host, _TYPE_A, _CLASS_IN, 120,
+                                          bytes([192, 168, 0, index])), 0)
+    return out.packet()
+
+
+class TestDNSIncoming(unittest.TestCase):
+    def test_response(self):
+        incoming = DNSIncoming(_response(["device-id-1", "device-id-2"]))
+        self.assertTrue(incoming.valid)
+        self.assertTrue(incoming.is_response())
+        self.assertEqual(len(incoming.answers), 8)
+        pointer, service, text, address = incoming.answers[4:]
+        self.assertEqual(pointer.name, SERVICE_TYPE)
+        self.assertEqual(pointer.alias,
+                         "475_device-id-2." + SERVICE_TYPE)
+        self.assertEqual(service.name, "475_device-id-2." + SERVICE_TYPE)
+        self.assertEqual(service.port, 1883)
+        self.assertEqual(service.server, "device-id-2.local.")
+        self.assertEqual(text.text, b"\x05id=ab")
+        self.assertEqual(address.name, "device-id-2.local.")
+        self.assertEqual(address.address, b"\xc0\xa8\x00\x01")
+        self.assertIsInstance(address.address, bytes)
+        # Compressed names share the labels decoded once
+        self.assertIn(SERVICE_TYPE, incoming._names.values())
+        self.assertIn("local.", incoming._names.values())
+
+    def test_unknown_type(self):
+        header = struct.pack("!6H", 0, _FLAGS_QR_RESPONSE, 0, 2, 0, 0)
+        unknown = b"\x01a\x00" + \
+            struct.pack("!HHiH", 99, _CLASS_IN, 120, 3) + b"xyz"
+        pointer = b"\x01b\x00" + \
+            struct.pack("!HHiH", _TYPE_PTR, _CLASS_IN, 120, 2) + b"\xc0\x0c"
+        incoming = DNSIncoming(header + unknown + pointer)
+        self.assertTrue(incoming.valid)
+        self.assertEqual(len(incoming.answers), 1)
+        self.assertEqual(incoming.answers[0].name, "b.")
+        self.assertEqual(incoming.answers[0].alias, "a.")
+
+    def test_circular_name(self):
+        header = struct.pack("!6H", 0, _FLAGS_QR_RESPONSE, 1, 0, 0, 0)
+        incoming = DNSIncoming(header + b"\xc0\x0c" +
+                               struct.pack("!HH", _TYPE_PTR, _CLASS_IN))
+        self.assertFalse(incoming.valid)
+
+    def test_truncated(self):
+        packet = _response(["device-id-1"])
+        self.assertFalse(DNSIncoming(packet[:-3]).valid)
+        self.assertFalse(DNSIncoming(packet[:5]).valid)
+
+
+class _Listener:
+    def __init__(self, names):
+        self.names = names
+        self.records = []
+
+    def interesting_names(self):
+        return self.names
+
+    def update_record(self, zc, now, record):
+        self.records.append(record)
+
+
+class TestPacketFilter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._zeroconf = Zeroconf(interfaces=["127.0.0.1"],
+                                 filter_packets=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._zeroconf.close()
+
+    def setUp(self):
+        self._zeroconf.filter_packets = True
+        self._zeroconf.listeners = []
+        self._zeroconf.cache = DNSCache()
+        self._zeroconf.listener.filtered = 0
+        self._listener = _Listener([SERVICE_TYPE])
+        self._zeroconf.add_listener(self._listener, None)
+
+    def _handle(self, packet):
+        self._zeroconf.listener.handle_packet(packet, "192.168.0.2", 5353)
+
+    def test_filter(self):
+        self._handle(_response(["device-id-1"]))
+        self.assertEqual(len(self._listener.records), 4)
+        self._handle(_response(["Chromecast-1", "Chromecast-2"],
+                               "_googlecast._tcp.local."))
+        self.assertEqual(len(self._listener.records), 4)
+        self.assertEqual(self._zeroconf.listener.filtered, 1)
+        self.assertEqual(len(self._zeroconf.cache), 4)
+
+    def test_filter_case(self):
+        self._listener.names = ["_Dyson_MQTT._tcp.local."]
+        self._handle(_response(["device-id-1"]))
+        self.assertEqual(self._zeroconf.listener.filtered, 0)
+
+    def test_service_info(self):
+        self._listener.names = []
+        info = ServiceInfo(SERVICE_TYPE, "475_device-id-1." + SERVICE_TYPE,
+                           server="device-id-1.local.")
+        self.assertEqual(info.interesting_names(),
+                         ["475_device-id-1." + SERVICE_TYPE,
+                          "device-id-1.local."])
+        self._zeroconf.add_listener(info, None)
+        address = DNSOutgoing(_FLAGS_QR_RESPONSE)
+        address.add_answer_at_time(DNSAddress(
+            "device-id-1.local.", _TYPE_A, _CLASS_IN, 120,
+            b"\xc0\xa8\x00\x02"), 0)
+        self._handle(address.packet())
+        self.assertEqual(self._zeroconf.listener.filtered, 0)
+        self.assertEqual(info.address, b"\xc0\xa8\x00\x02")
+
+    def test_unknown_listener(self):
+        self._zeroconf.add_listener(Mock(spec=["update_record"]), None)
+        self.assertTrue(self._zeroconf.is_interesting(
+            _response(["Chromecast-1"], "_googlecast._tcp.local.")))
+
+    def test_disabled(self):
+        self._zeroconf.filter_packets = False
+        self._handle(_response(["Chromecast-1"], "_googlecast._tcp.local."))
+        self.assertEqual(self._zeroconf.listener.filtered, 0)
+        self.assertEqual(len(self._zeroconf.cache), 4)
+
+
+class TestEngine(unittest.TestCase):
+    def setUp(self):
+        self._threads = threading.active_count()
+        self._zeroconf = Zeroconf(interfaces=["127.0.0.1"])
+
+    def tearDown(self):
+        self._zeroconf.close()
+
+    def test_single_thread(self):
+        browsers = [ServiceBrowser(self._zeroconf, service_type,
+                                   handlers=[Mock()])
+                    for service_type in [SERVICE_TYPE, "_ipp._tcp.local.",
+                                         "_googlecast._tcp.local."]]
+        self.assertEqual(threading.active_count() - self._threads, 1)
+        for browser in browsers:
+            browser.cancel()
+        self._zeroconf.close()
+        self.assertEqual(threading.active_count(), self._threads)
+
+    def test_thread_interface(self):
+        browsers = [ServiceBrowser(self._zeroconf, service_type,
+                                   handlers=[Mock()])
+                    for service_type in [SERVICE_TYPE, "_ipp._tcp.local."]]
+        reaper = self._zeroconf.reaper
+        self.assertEqual(browsers[0].name,
+                         "zeroconf-ServiceBrowser_" + SERVICE_TYPE)
+        self.assertTrue(browsers[0].daemon)
+        self.assertTrue(all(task.is_alive() for task in browsers + [reaper]))
+        browsers[0].join(0.01)
+        self.assertTrue(browsers[0].is_alive())
+
+        browsers[0].cancel()
+        browsers[0].join()
+        self.assertFalse(browsers[0].is_alive())
+        # Stopped by close()
+        self._zeroconf.close()
+        for task in (browsers[1], reaper):
+            task.join(2)
+            self.assertFalse(task.is_alive())
+
+    def test_timers(self):
+        engine = self._zeroconf.engine
+        calls = []
+        done = threading.Event()
+        engine.call_later(50, lambda: calls.append(2) or done.set())
+        engine.call_soon(lambda: calls.append(1))
+        engine.call_later(20, lambda: calls.append(3)).cancel()
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, [1, 2])
+
+    def test_timer_error(self):
+        done = threading.Event()
+        self._zeroconf.engine.call_soon(Mock(side_effect=ValueError))
+        self._zeroconf.engine.call_soon(done.set)
+        self.assertTrue(done.wait(2))
+
+    def test_browser(self):
+        name = "475_device-id-1." + SERVICE_TYPE
+        announce = DNSOutgoing(_FLAGS_QR_RESPONSE)
+        announce.add_answer_at_time(_pointer("device-id-1"), 0)
+        response = _response(["device-id-1"])
+        found = []
+        done = threading.Event()
+
+        def on_change(zeroconf, service_type, name, state_change):
+            self.assertIs(threading.current_thread(), zeroconf.engine)
+            # Blocking requests would stop the engine thread
+            with self.assertRaises(RuntimeError):
+                zeroconf.get_service_info(service_type, name)
+
+            def resolved(infos):
+                found.append((name, state_change, infos[name]))
+                done.set()
+
+            zeroconf.request_service_infos(service_type, [name], resolved)
+            # Information arriving after the handler returned
+            zeroconf.engine.call_later(20, lambda: zeroconf.listener.
+                                       handle_packet(response, "192.168.0.2",
+                                                     5353))
+
+        ServiceBrowser(self._zeroconf, SERVICE_TYPE, handlers=[on_change])
+        self._zeroconf.engine.call_soon(
+            lambda: self._zeroconf.listener.handle_packet(
+                announce.packet(), "192.168.0.2", 5353))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(found[0][:2], (name, ServiceStateChange.Added))
+        info = found[0][2]
+        self.assertEqual(info.port, 1883)
+        self.assertEqual(info.address, b"\xc0\xa8\x00\x00")
+        self.assertNotIn(info, self._zeroconf.listeners)
+
+    def test_close_from_handler(self):
+        done = threading.Event()
+
+        def close(zeroconf, **kwargs):
+            zeroconf.close()
+            done.set()
+
+        self._zeroconf.engine.call_soon(
+            lambda: close(self._zeroconf))
+        self.assertTrue(done.wait(2))
+        self._zeroconf.engine.join(2)
+        self.assertFalse(self._zeroconf.engine.is_alive())
+
+
+class TestServiceInfoRequest(unittest.TestCase):
+    def setUp(self):
+        self._responder = MdnsResponder().start()
+        self._zeroconf = Zeroconf(interfaces=["127.0.0.1"])
+
+    def tearDown(self):
+        self._zeroconf.close()
+        self._responder.stop()
+
+    def _asked(self, name):
+        return len([query for query in self._responder.queries
+                    if query[0] == name])
+
+    def test_batch(self):
+        services = [self._responder.add_service(PublishedService(
+            "device-id-{0}".format(index), 1883 + index))
+            for index in range(20)]
+        infos = self._zeroconf.get_service_infos(
+            SERVICE_TYPE, [service.name for service in services])
+        for service in services:
+            info = infos[service.name]
+            self.assertEqual(info.port, service.port)
+            self.assertEqual(info.address, b"\x7f\x00\x00\x01")
+            self.assertEqual(info.server, service.server)
+            # Answered by the first query, not asked again
+            self.assertEqual(self._asked(service.name), 3)
+        # Questions of all the services shared in a few packets
+        self.assertLessEqual(self._responder.query_packets, 2)
+
+    def test_stop_when_complete(self):
+        found = self._responder.add_service(
+            PublishedService("device-id-1", 1883))
+        missing = PublishedService("device-id-2", 1883)
+        completed = []
+        infos = [ServiceInfo(SERVICE_TYPE, found.name),
+                 ServiceInfo(SERVICE_TYPE, missing.name)]
+        request = ServiceInfoRequest(self._zeroconf, infos)
+        self.assertEqual(request.run(1000, completed.append), infos[:1])
+        self.assertEqual(completed, infos[:1])
+        # SRV, TXT and A questions of one query
+        self.assertEqual(self._asked(found.name), 3)
+        self.assertGreater(self._asked(missing.name), 3)
+
+    def test_request_from_engine(self):
+        services = [self._responder.add_service(PublishedService(
+            "device-id-{0}".format(index), 1883 + index))
+            for index in range(3)]
+        missing = PublishedService("device-id-3", 1883)
+        names = [service.name for service in services + [missing]]
+        completed = []
+        results = []
+        done = threading.Event()
+
+        def finished(infos):
+            self.assertIs(threading.current_thread(), self._zeroconf.engine)
+            results.append(infos)
+            done.set()
+
+        request = self._zeroconf.request_service_infos(
+            SERVICE_TYPE, names, finished, timeout=500,
+            handler=completed.append)
+        self.assertTrue(done.wait(2))
+        infos = results[0]
+        for service in services:
+            self.assertEqual(infos[service.name].port, service.port)
+        self.assertIsNone(infos[missing.name])
+        self.assertEqual(len(completed), 3)
+        self.assertNotIn(request, self._zeroconf.listeners)
+
+    def test_request_cancelled(self):
+        finished = Mock()
+        request = self._zeroconf.request_service_infos(
+            SERVICE_TYPE, [PublishedService("device-id-1", 1883).name],
+            finished, timeout=200)
+        done = threading.Event()
+        self._zeroconf.engine.call_soon(done.set)
+        self.assertTrue(done.wait(2))
+        request.cancel()
+        # Timers run in order: after the end of the request timeout
+        expired = threading.Event()
+        self._zeroconf.engine.call_later(300, expired.set)
+        self.assertTrue(expired.wait(2))
+        finished.assert_not_called()
+        self.assertNotIn(request, self._zeroconf.listeners)
+
+    def test_cached(self):
+        self._zeroconf.listener.handle_packet(_response(["device-id-1"]),
+                                              "192.168.0.2", 5353)
+        info = ServiceInfo(SERVICE_TYPE, "475_device-id-1." + SERVICE_TYPE)
+        self.assertTrue(info.request(self._zeroconf, 1000))
+        self.assertEqual(info.address, b"\xc0\xa8\x00\x00")
+        self.assertEqual(self._responder.query_packets, 0)